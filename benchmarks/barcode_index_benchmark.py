@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+DESC = """Check of how often BarcodeIndex labels random barcodes as known indexes.
+
+undemultiplexed_index identifies the most abundant undetermined barcodes of a lane by
+looking them up among the 10X, SmartSeq3 and ONT indexes. A label is only useful if
+random barcodes rarely get one, so this script identifies random single and dual barcodes
+against the same tables and reports the share that was labelled, along with the lookup
+rate. The known dual 10X indexes are also identified, as is and with 1 mismatch, to check
+that they are still found.
+
+The script exits with an error if random barcodes are labelled more often than --max_rate
+or if a known dual index is not found.
+
+Usage:
+    python benchmarks/barcode_index_benchmark.py --barcodes 500 --lengths 8 10
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from data.Chromium_10X_indexes import Chromium_10X_indexes  # noqa: E402
+from data.ONT_barcodes import ONT_BARCODES  # noqa: E402
+from scilifelab_epps.utils.barcode_index import BarcodeIndex  # noqa: E402
+
+SMARTSEQ3_indexes_json = os.path.join(
+    os.path.dirname(__file__), "..", "data", "SMARTSEQ3_indexes.json"
+)
+
+
+def build_known_index():
+    """The tables of undemultiplexed_index.build_barcode_index, without any run."""
+    barcode_index = BarcodeIndex()
+    for name, seqs in Chromium_10X_indexes.items():
+        if len(seqs) == 2:
+            barcode_index.add(seqs[0], name, "10X", "i7")
+            barcode_index.add(seqs[1], name, "10X", "i5")
+        else:
+            for seq in seqs:
+                barcode_index.add(seq, name, "10X", "i7")
+    with open(SMARTSEQ3_indexes_json) as file:
+        for name, (i7_seqs, i5_seqs) in json.loads(file.read()).items():
+            for seq in i7_seqs:
+                barcode_index.add(seq, name, "SmartSeq3", "i7")
+            for seq in i5_seqs:
+                barcode_index.add(seq, name, "SmartSeq3", "i5")
+    for barcode in ONT_BARCODES:
+        barcode_index.add(barcode["seq"], barcode["label"], "ONT", "i7")
+    return barcode_index
+
+
+def random_seq(rng, length):
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+
+def mutate(rng, seq):
+    pos = rng.randrange(len(seq))
+    return seq[:pos] + rng.choice([b for b in "ACGT" if b != seq[pos]]) + seq[pos + 1 :]
+
+
+def main(args):
+    barcode_index = build_known_index()
+    rng = random.Random(args.seed)
+    failed = False
+
+    print(f"Known sequences: {len(barcode_index.known)}")
+    for length in args.lengths:
+        for dual in [False, True]:
+            barcodes = [
+                random_seq(rng, length)
+                + (f"+{random_seq(rng, length)}" if dual else "")
+                for _ in range(args.barcodes)
+            ]
+            start = time.perf_counter()
+            labelled = [b for b in barcodes if barcode_index.identify(b)]
+            elapsed = time.perf_counter() - start
+            rate = len(labelled) / len(barcodes)
+            print(
+                f"Random {'dual' if dual else 'single'} {length} bp barcodes:"
+                + f" {rate:6.1%} labelled, {len(barcodes) / elapsed:8.0f} lookups/s"
+            )
+            failed |= rate > args.max_rate
+
+    # Known dual indexes, as is and with 1 mismatch in each read
+    dual_indexes = {
+        name: seqs for name, seqs in Chromium_10X_indexes.items() if len(seqs) == 2
+    }
+    missed = []
+    for name, (i7, i5) in dual_indexes.items():
+        for barcode in [f"{i7}+{i5}", f"{mutate(rng, i7)}+{mutate(rng, i5)}"]:
+            if not barcode_index.identify(barcode).startswith(f"{name} "):
+                missed.append(barcode)
+    print(
+        f"Known dual indexes not identified: {len(missed)} of {2 * len(dual_indexes)}"
+    )
+    failed |= bool(missed)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=DESC)
+    parser.add_argument("--barcodes", type=int, default=500)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[8, 10])
+    parser.add_argument("--max_rate", type=float, default=0.15)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args)
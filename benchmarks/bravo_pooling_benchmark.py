@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+DESC = """Benchmark of the Bravo pooling volume solver against the previous iterative search.
+
+bravo_csv.pool_volumes computes the volume to take of each input analytically, for all
+pools at once. The previous implementation, reproduced below as optimize_volumes, reduced
+a trial volume by 10% per recursive call until the pipetting or total volume limits were
+hit.
+
+For random pools, this script checks that the analytical solution respects the same
+limits and compares the resulting pool volumes and run times of both solvers.
+
+Usage:
+    python benchmarks/bravo_pooling_benchmark.py --pools 1000 --samples_per_pool 24
+"""
+
+import os
+import random
+import statistics
+import sys
+import time
+from argparse import ArgumentParser
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from bravo_csv import MIN_WARNING_VOLUME, pool_volumes  # noqa: E402
+
+
+def optimize_volumes(samples, final_vol, limit_vol=2):
+    """The previous 0.9-step search, kept as reference."""
+    # Create a list we can sort to get the min/max values:
+    l = [(s["conc"] * s["vol"], s["conc"], s["vol"]) for s in samples]
+    # Find the min/max values by sorting on the different values:
+    max_conc = sorted(l, key=lambda x: x[1])[-1][1]
+    min_vol = sorted(l, key=lambda x: x[2])[0][2]
+    # The volume of the input with lowest amount:
+    min_amount = sorted(l)[0][2]
+
+    def _minimize_vol(vol, final_vol=final_vol, limit_vol=limit_vol, reduce=0.9):
+        try_vol = reduce * vol
+        # The lowest volume to take would then be (sample(s) w highest conc):
+        low_vol = min(try_vol * max_conc / s["conc"] for s in samples)
+        # Total pool volume if we were to take this amount of all samples:
+        tot_vol = sum(try_vol * max_conc / s["conc"] for s in samples)
+        # We don't want to pipette less than limit_vol
+        # while keeping total volume above final_vol:
+        if low_vol >= limit_vol and tot_vol >= final_vol and try_vol >= limit_vol:
+            return _minimize_vol(try_vol)
+        else:
+            # We can't improve anymore within the given limits...
+            return vol
+
+    # Start from whichever is the smallest volume:
+    use_vol = _minimize_vol(min(min_amount, min_vol))
+    # Calculate the volume to take of each input:
+    return [(use_vol * max_conc / s["conc"]) for s in samples]
+
+
+def make_pools(n_pools, samples_per_pool, seed=0):
+    rng = random.Random(seed)
+    data = []
+    final_vols = {}
+    for i in range(n_pools):
+        pool_id = f"2-{i}"
+        final_vols[pool_id] = rng.choice([10.0, 20.0, 30.0, 50.0])
+        for _ in range(samples_per_pool):
+            data.append(
+                {
+                    "pool_id": pool_id,
+                    "conc": rng.uniform(0.5, 20),
+                    "vol": rng.uniform(5, 60),
+                }
+            )
+    return data, final_vols
+
+
+def main(args):
+    data, final_vols = make_pools(args.pools, args.samples_per_pool, args.seed)
+    df = pd.DataFrame(data)
+
+    # Reference: iterative search, pool by pool
+    timings_search = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        search_vols = []
+        for pool_id, final_vol in final_vols.items():
+            samples = [s for s in data if s["pool_id"] == pool_id]
+            search_vols += optimize_volumes(samples, final_vol, MIN_WARNING_VOLUME)
+        timings_search.append(time.perf_counter() - start)
+
+    # Analytical solution, all pools at once
+    timings_closed = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        closed_vols = pool_volumes(df, final_vols, MIN_WARNING_VOLUME)
+        timings_closed.append(time.perf_counter() - start)
+
+    df["search_vol"] = search_vols
+    df["closed_vol"] = closed_vols
+    g = df.groupby("pool_id", sort=False)
+    pools = pd.DataFrame(
+        {
+            "final_vol": pd.Series(final_vols),
+            "search_tot": g.search_vol.sum(),
+            "closed_tot": g.closed_vol.sum(),
+            "search_min": g.search_vol.min(),
+            "closed_min": g.closed_vol.min(),
+            "start_vol": g.vol.min(),
+        }
+    )
+
+    # The analytical solution may only relax a limit where the search also had to
+    eps = 1e-9
+    violations = pools[
+        (
+            (pools.closed_min < MIN_WARNING_VOLUME - eps)
+            & (pools.closed_min < pools.search_min - eps)
+        )
+        | (
+            (pools.closed_tot < pools.final_vol - eps)
+            & (pools.closed_tot < pools.search_tot - eps)
+        )
+    ]
+    worse = pools[
+        (pools.closed_tot - pools.final_vol).abs()
+        > (pools.search_tot - pools.final_vol).abs() + eps
+    ]
+    excess_search = (pools.search_tot - pools.final_vol).clip(lower=0)
+    excess_closed = (pools.closed_tot - pools.final_vol).clip(lower=0)
+
+    print(f"Pools: {len(pools)}, inputs per pool: {args.samples_per_pool}")
+    print(
+        f"Iterative search:  median {statistics.median(timings_search) * 1000:9.2f} ms,"
+        + f" mean excess pool volume {excess_search.mean():.3f} uL"
+    )
+    print(
+        f"Closed form:       median {statistics.median(timings_closed) * 1000:9.2f} ms,"
+        + f" mean excess pool volume {excess_closed.mean():.3f} uL"
+    )
+    print(f"Pools violating limits beyond the search: {len(violations)}")
+    print(f"Pools further from the final volume than the search: {len(worse)}")
+
+    if len(violations) or len(worse):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=DESC)
+    parser.add_argument("--pools", type=int, default=200)
+    parser.add_argument("--samples_per_pool", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+DESC = """Benchmark suite for the Zika worklist generation, run apart from LIMS I/O.
+
+Synthetic sample data (random concentrations, volumes and pool assignments on 96- or 384-well
+plates) is fed through zika.methods.pool and zika.methods.norm, as well as through the
+separate stages format_worklist, resolve_buffer_transfers and render_worklist.
+
+Each stage is timed after a warm-up, over a number of repetitions, and its peak memory is
+recorded. Results can be stored as a baseline JSON and later runs compared against it.
+
+Usage:
+    python benchmarks/zika_benchmark.py --save-baseline
+    python benchmarks/zika_benchmark.py --baseline benchmarks/zika_baseline.json
+"""
+
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from unittest import mock
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from scilifelab_epps import zika  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "zika_baseline.json")
+
+# Written by the zika methods before exiting, when the worklist is generated with warnings
+WARNINGS_MESSAGE = "CSV-file generated with warnings, please check the Log file\n"
+
+# (rows, columns) of supported plate layouts
+LAYOUTS = {96: (8, 12), 384: (16, 24)}
+
+POOL_UDFS = {
+    "target_amt": None,
+    "target_vol": "Final Volume (uL)",
+    "target_conc": "Pool Conc. (nM)",
+    "final_amt": None,
+    "final_vol": "Final Volume (uL)",
+    "final_conc": "Pool Conc. (nM)",
+}
+NORM_UDFS = {
+    "target_amt": "Amount for prep (ng)",
+    "target_vol": "Total Volume (uL)",
+    "target_conc": None,
+    "final_amt": "Amount taken from plate (ng)",
+    "final_vol": "Total Volume (uL)",
+    "final_conc": None,
+}
+
+
+class FakeArtifact:
+    """Stand-in for an output artifact, UDF updates are kept in memory."""
+
+    type = "Analyte"
+
+    def __init__(self, name, well):
+        self.name = name
+        self.location = (None, well)
+        self.udf = {}
+
+    def put(self):
+        pass
+
+
+class FakeStep:
+    def __init__(self, id, outputs):
+        self.id = id
+        self.outputs = outputs
+
+    def all_outputs(self):
+        return self.outputs
+
+
+def well_names(layout):
+    """Column-wise well names of a plate layout."""
+    n_rows, n_cols = LAYOUTS[layout]
+    return [
+        f"{chr(ord('A') + row)}:{col}"
+        for col in range(1, n_cols + 1)
+        for row in range(n_rows)
+    ]
+
+
+def make_pool_data(n_samples, n_pools, layout, seed=0):
+    """Return synthetic pooling input, as fetched by zika.utils.fetch_sample_data, and pool artifacts."""
+    rng = random.Random(seed)
+    wells = well_names(layout)
+
+    pools = [FakeArtifact(f"Pool_{i}", wells[i % len(wells)]) for i in range(n_pools)]
+    targets = {
+        pool.name: (rng.choice([20.0, 30.0, 50.0]), rng.choice([2.0, 5.0, 10.0]))
+        for pool in pools
+    }
+
+    rows = []
+    for i in range(n_samples):
+        pool = pools[i % n_pools]
+        rows.append(
+            {
+                "sample_name": f"P1_{i}",
+                "vol": rng.uniform(10, 60),
+                "conc": rng.lognormvariate(2, 1),
+                "conc_units": "nM",
+                "src_name": f"src_plate_{i // len(wells)}",
+                "src_id": f"27-{i // len(wells)}",
+                "src_well": wells[i % len(wells)],
+                "target_name": pool.name,
+                "dst_name": "dst_plate",
+                "dst_id": "27-0000",
+                "dst_well": pool.location[1],
+                "target_vol": targets[pool.name][0],
+                "target_conc": targets[pool.name][1],
+                "final_vol": None,
+                "final_conc": None,
+            }
+        )
+
+    return pd.DataFrame(rows), pools
+
+
+def make_norm_data(n_samples, layout, seed=0):
+    """Return synthetic normalization input, as fetched by zika.utils.fetch_sample_data, and output artifacts."""
+    rng = random.Random(seed)
+    wells = well_names(layout)
+
+    outputs = []
+    rows = []
+    for i in range(n_samples):
+        well = wells[i % len(wells)]
+        outputs.append(FakeArtifact(f"P1_{i}", well))
+        rows.append(
+            {
+                "sample_name": f"P1_{i}",
+                "src_name": f"src_plate_{i // len(wells)}",
+                "src_id": f"27-{i // len(wells)}",
+                "src_well": well,
+                "dst_name": f"dst_plate_{i // len(wells)}",
+                "dst_id": f"28-{i // len(wells)}",
+                "dst_well": well,
+                "conc_units": "ng/ul",
+                "conc": rng.lognormvariate(2, 1),
+                "vol": rng.uniform(10, 60),
+                "target_amt": rng.choice([10.0, 50.0, 100.0]),
+                "target_vol": rng.choice([20.0, 50.0]),
+                "final_amt": None,
+                "final_vol": None,
+            }
+        )
+
+    for output in outputs:
+        output.udf[NORM_UDFS["target_amt"]] = None
+        output.udf[NORM_UDFS["target_vol"]] = None
+
+    return pd.DataFrame(rows), outputs
+
+
+def run_method(method, df, outputs, **kwargs):
+    """Run a zika method on synthetic data, with LIMS fetching and uploading patched out."""
+    with (
+        mock.patch.object(zika.utils, "fetch_sample_data", return_value=df.copy()),
+        mock.patch.object(zika.utils, "upload_outputs"),
+        mock.patch.object(sys, "stderr") as stderr,
+    ):
+        try:
+            method(currentStep=FakeStep("24-0000", outputs), lims=None, **kwargs)
+        except SystemExit:
+            # Only expected when the worklist is generated, but the log contains warnings
+            messages = "".join(call.args[0] for call in stderr.write.call_args_list)
+            if messages != WARNINGS_MESSAGE:
+                raise RuntimeError(f"{method.__name__} aborted: {messages}")
+
+
+def measure(func, warmup, repeat):
+    """Time a function over repetitions after warm-up, then record its peak memory in a separate run."""
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "peak_kib": peak / 1024,
+    }
+
+
+def make_stages(n_samples, n_pools, layout, seed):
+    """Return a dict of stage names mapping to argument-less functions to benchmark."""
+    df_pool, pools = make_pool_data(n_samples, n_pools, layout, seed)
+    df_norm, outputs = make_norm_data(n_samples, layout, seed)
+
+    # Intermediate frames for the separate stages
+    df_transfers = df_pool.copy()
+    df_transfers["transfer_vol"] = [
+        random.Random(seed + i).uniform(0.5, 20) for i in range(len(df_transfers))
+    ]
+    df_buffer = df_norm.copy()
+    df_buffer["sample_vol"] = df_buffer.target_amt / df_buffer.conc
+    df_buffer["buffer_vol"] = (df_buffer.target_vol - df_buffer.sample_vol).clip(0)
+    df_buffer = df_buffer[df_buffer.dst_name == df_buffer.dst_name.iloc[0]]
+
+    deck = {"dst_plate": 3}
+    deck.update(zip(df_transfers.src_name.unique(), [2, 4, 1, 5]))
+    df_formatted = zika.utils.format_worklist(df_transfers.copy(), deck)
+
+    return {
+        "pool": lambda: run_method(
+            zika.methods.pool, df_pool, [p for p in pools], udfs=POOL_UDFS
+        ),
+        "norm": lambda: run_method(
+            zika.methods.norm,
+            df_norm,
+            outputs,
+            udfs=NORM_UDFS,
+        ),
+        "format_worklist": lambda: zika.utils.format_worklist(
+            df_transfers.copy(), deck
+        ),
+        "resolve_buffer_transfers": lambda: zika.utils.resolve_buffer_transfers(
+            df=df_buffer.copy(),
+            wl_comments=[],
+        ),
+        "render_worklist": lambda: zika.utils.render_worklist(
+            df=df_formatted.copy(), deck=deck, wl_filename="benchmark.csv"
+        ),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Compare results to a baseline, returning a list of regressions."""
+    regressions = []
+    for case, stages in results.items():
+        for stage, metrics in stages.items():
+            reference = baseline.get(case, {}).get(stage)
+            if not reference:
+                continue
+            for metric in ["median_s", "peak_kib"]:
+                if metrics[metric] > reference[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{case} {stage} {metric}: {metrics[metric]:.4g} vs. baseline {reference[metric]:.4g}"
+                    )
+    return regressions
+
+
+def main(args):
+    results = {}
+    for layout in args.layouts:
+        n_samples = args.samples or layout
+        n_pools = max(n_samples // args.samples_per_pool, 1)
+        case = f"{layout}-well_{n_samples}-samples_{n_pools}-pools"
+        results[case] = {}
+        for stage, func in make_stages(n_samples, n_pools, layout, args.seed).items():
+            results[case][stage] = measure(func, args.warmup, args.repeat)
+            print(
+                f"{case:<36} {stage:<26}"
+                + f" median {results[case][stage]['median_s'] * 1000:9.2f} ms"
+                + f" min {results[case][stage]['min_s'] * 1000:9.2f} ms"
+                + f" peak {results[case][stage]['peak_kib']:10.1f} KiB"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%} of baseline:")
+            for regression in regressions:
+                print(f" - {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} of baseline.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=DESC)
+    parser.add_argument(
+        "--layouts",
+        type=int,
+        nargs="+",
+        choices=list(LAYOUTS),
+        default=[96, 384],
+        help="Plate layouts to benchmark",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=None,
+        help="Number of samples per case, defaults to one full plate",
+    )
+    parser.add_argument("--samples_per_pool", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="Allowed relative increase compared to the baseline",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        dest="save_baseline",
+        action="store_true",
+        help="Store the results as the new baseline",
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    main(args)
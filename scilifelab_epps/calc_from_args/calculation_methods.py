@@ -11,6 +11,8 @@ from scilifelab_epps.calc_from_args.udf_arg_methods import (
     fetch_from_arg,
     get_UDF_source,
     get_UDF_source_name,
+    prefetch_args,
+    resolve_arg,
 )
 from scilifelab_epps.utils import formula, udf_tools
 
@@ -31,95 +33,93 @@ def volume_to_use(process: Process, args: Namespace):
             args.amt_out       --> Target amount to take
             args.vol_out       --> Volume corresponding to target amount (or max available volume)
 
+    All tuples are calculated at once from a table of the fetched UDFs. Tuples with missing
+    or invalid data are skipped.
     """
     art_tuples = udf_tools.get_art_tuples(process)
+    prefetched = prefetch_args(
+        process,
+        art_tuples,
+        [args.size_in, args.conc_in, args.vol_in, args.conc_units_in, args.amt_out],
+    )
+
+    arg_dicts = {
+        "size_bp": args.size_in,
+        "input_conc": args.conc_in,
+        "input_vol": args.vol_in,
+    }
+    target_in_fmol = "fmol" in args.amt_out["udf"]
+    if target_in_fmol:
+        arg_dicts["target_output_amt"] = args.amt_out
+        if args.conc_units_in:
+            arg_dicts["input_conc_units"] = args.conc_units_in
+    table = _fetch_table(process, art_tuples, arg_dicts, prefetched)
+    if not target_in_fmol:
+        _invalidate(table, True, "Target amount must be in fmol.")
+    else:
+        _check_units(table, args)
+        _check_numbers(
+            table,
+            {name: arg_dicts[name] for name in ["input_conc", "input_vol"]}
+            | {"target_output_amt": args.amt_out},
+            size_needed=table.input_conc_units == "ng/ul",
+        )
+        _invalidate(
+            table,
+            table.input_conc == 0,
+            f"Zero concentration in UDF '{args.conc_in['udf']}'.",
+        )
 
-    for art_tuple in art_tuples:
-        try:
-            # Explicate current working input-output tuple
-            art_in = art_tuple[0]["uri"]
-            art_out = art_tuple[1]["uri"]
-            logging.info("")
-            logging.info(
-                f"Processing input '{art_in.name}' -> output '{art_out.name}'..."
+    # Calculate required volumes
+    df = table[table.error.isna()]
+    if not df.empty:
+        input_vol = df.input_vol.to_numpy(dtype=float)
+        target_output_amt = df.target_output_amt.to_numpy(dtype=float)
+        vol_required = formula.convert(
+            target_output_amt,
+            "fmol",
+            "ul",
+            bp=pd.to_numeric(df.size_bp, errors="coerce").to_numpy(dtype=float),
+            conc=df.input_conc.to_numpy(dtype=float),
+            conc_unit=df.input_conc_units,
+        )
+        # Address case of volume depletion, applying the fraction of available / target volume to the target amount
+        table.loc[df.index, "vol_required"] = vol_required
+        table.loc[df.index, "depleted"] = vol_required > input_vol
+        with np.errstate(divide="ignore", invalid="ignore"):
+            table.loc[df.index, "depleted_amt"] = (
+                input_vol / vol_required * target_output_amt
             )
 
-            # Get info specified by script arguments
-            size_bp = fetch_from_arg(art_tuple, args.size_in, process)
-            input_conc = fetch_from_arg(art_tuple, args.conc_in, process)
-            input_vol = fetch_from_arg(art_tuple, args.vol_in, process)
-            assert "fmol" in args.amt_out["udf"], "Target amount must be in fmol."
-            target_output_amt = fetch_from_arg(art_tuple, args.amt_out, process)
-            if args.conc_units_in:
-                input_conc_units = fetch_from_arg(
-                    art_tuple, args.conc_units_in, process
-                )
-                assert input_conc_units in [
-                    "ng/ul",
-                    "nM",
-                ], f"Unsupported conc. units '{input_conc_units}'"
-            else:
-                # Infer concentration unit
-                if "ng/ul" in args.conc_in["udf"]:
-                    input_conc_units = "ng/ul"
-                elif "nM" in args.conc_in["udf"]:
-                    input_conc_units = "nM"
-                else:
-                    raise AssertionError(
-                        f"Can't infer units from '{args.conc_in['udf']}' for {art_out.name}."
-                    )
-                logging.info(
-                    f"Inferred unit of UDF '{args.conc_in['udf']}': {input_conc_units}."
-                )
+    for i, art_tuple in enumerate(art_tuples):
+        row = table.loc[i]
+        try:
+            if not _log_fetched(art_tuple, row):
+                continue
 
-            # Calculate required volume
-            if input_conc_units == "nM":
-                vol_required = target_output_amt / input_conc
-            elif input_conc_units == "ng/ul":
-                vol_required = (
-                    formula.fmol_to_ng(target_output_amt, size_bp) / input_conc
-                )
             logging.info(
-                f"Calculating required volume: {target_output_amt} fmol of {input_conc} {input_conc_units} at {size_bp} bp -> {vol_required:.2f} ul."
+                f"Calculating required volume: {row.target_output_amt} fmol of {row.input_conc} {row.input_conc_units} at {row.size_bp} bp -> {row.vol_required:.2f} ul."
             )
 
-            # Address case of volume depletion
-            if vol_required > input_vol:
+            if row.depleted:
                 logging.warning(
-                    f"Volume required ({vol_required:.2f} ul) is greater than the available input '{args.vol_in['udf']}': {input_vol:.2f}."
+                    f"Volume required ({row.vol_required:.2f} ul) is greater than the available input '{args.vol_in['udf']}': {row.input_vol:.2f}."
                 )
                 logging.warning("Using all available volume.")
-                vol_to_take = input_vol
-
-                # Apply fraction of target / available volume to target amount
-                output_amt = vol_to_take / vol_required * target_output_amt
+                vol_to_take = row.input_vol
+                output_amt = row.depleted_amt
                 logging.warning(
-                    f"Changing output '{args.amt_out['udf']}': {target_output_amt} -> {output_amt:.2f} for {args.amt_out['source']} '{get_UDF_source_name(art_tuple, args.amt_out, process)}'."
+                    f"Changing output '{args.amt_out['udf']}': {row.target_output_amt} -> {output_amt:.2f} for {args.amt_out['source']} '{get_UDF_source_name(art_tuple, args.amt_out, process)}'."
                 )
             else:
-                vol_to_take = vol_required
-                output_amt = target_output_amt
+                vol_to_take = row.vol_required
+                output_amt = row.target_output_amt
 
             logging.info(f"Determined volume to take -> {vol_to_take:.2f} ul.")
 
             # Update UDFs
-            udf_tools.put(
-                target=get_UDF_source(art_tuple, args.vol_out, process),
-                target_udf=args.vol_out["udf"],
-                val=round(vol_to_take, 2),
-            )
-            logging.info(
-                f"Assigned UDF '{args.vol_out['udf']}': {vol_to_take:.2f} for {args.vol_out['source']} '{get_UDF_source_name(art_tuple, args.vol_out, process)}'."
-            )
-
-            udf_tools.put(
-                target=get_UDF_source(art_tuple, args.amt_out, process),
-                target_udf=args.amt_out["udf"],
-                val=round(output_amt, 2),
-            )
-            logging.info(
-                f"Assigned UDF '{args.amt_out['udf']}': {output_amt:.2f} for {args.amt_out['source']} '{get_UDF_source_name(art_tuple, args.amt_out, process)}'."
-            )
+            _put_and_log(process, art_tuple, args.vol_out, vol_to_take)
+            _put_and_log(process, art_tuple, args.amt_out, output_amt)
 
         except AssertionError as e:
             logging.error(str(e), exc_info=True)
@@ -145,6 +145,18 @@ def summarize_pooling(process: Process, args: Namespace):
     """
 
     step_tuples = udf_tools.get_art_tuples(process)
+    prefetched = prefetch_args(
+        process,
+        step_tuples,
+        [
+            args.size_in,
+            args.conc_in,
+            args.vol_in,
+            args.conc_units_in,
+            args.amt_out,
+            args.vol_out,
+        ],
+    )
 
     pools = [art for art in process.all_outputs() if art.type == "Analyte"]
     pools.sort(key=lambda pool: pool.name)
@@ -174,12 +186,20 @@ def summarize_pooling(process: Process, args: Namespace):
             )
 
             # Get info specified by script arguments
-            cols["size_bp"] = fetch_from_arg(art_tuple, args.size_in, process)
-            cols["input_conc"] = fetch_from_arg(art_tuple, args.conc_in, process)
-            cols["input_vol"] = fetch_from_arg(art_tuple, args.vol_in, process)
+            cols["size_bp"] = fetch_from_arg(
+                art_tuple, args.size_in, process, prefetched=prefetched
+            )
+            cols["input_conc"] = fetch_from_arg(
+                art_tuple, args.conc_in, process, prefetched=prefetched
+            )
+            cols["input_vol"] = fetch_from_arg(
+                art_tuple, args.vol_in, process, prefetched=prefetched
+            )
             if args.conc_units_in:
                 cols["input_conc_units"] = str(
-                    fetch_from_arg(art_tuple, args.conc_units_in, process)
+                    fetch_from_arg(
+                        art_tuple, args.conc_units_in, process, prefetched=prefetched
+                    )
                 )
                 assert (
                     cols["input_conc_units"] in ["ng/ul", "nM"]
@@ -221,11 +241,8 @@ def summarize_pooling(process: Process, args: Namespace):
         ), "Inconsistent output amount units."
 
         # Get a column with consistent concentration units
-        df_pool["input_conc_nM"] = df_pool.apply(
-            lambda x: x["input_conc"]
-            if x["input_conc_units"] == "nM"
-            else formula.ng_ul_to_nM(x["input_conc"], x["size_bp"]),
-            axis=1,
+        df_pool["input_conc_nM"] = formula.convert(
+            df_pool.input_conc, df_pool.input_conc_units, "nM", bp=df_pool.size_bp
         )
 
         df_pool["transfer_amt_fmol"] = df_pool.input_vol * df_pool.input_conc_nM
@@ -272,7 +289,7 @@ def summarize_pooling(process: Process, args: Namespace):
             logging.info(
                 f"Assigned '{pool.name}' UDF '{args.size_out['udf']}': {pool_size:.1f}"
             )
-        pool.put()
+        udf_tools.save(pool)
 
 
 def equimolar_pooling(process: Process, args: Namespace):
@@ -295,6 +312,18 @@ def equimolar_pooling(process: Process, args: Namespace):
     """
 
     step_tuples = udf_tools.get_art_tuples(process)
+    prefetched = prefetch_args(
+        process,
+        step_tuples,
+        [
+            args.size_in,
+            args.conc_in,
+            args.vol_in,
+            args.conc_units_in,
+            args.amt_out,
+            args.vol_out,
+        ],
+    )
 
     pools = [art for art in process.all_outputs() if art.type == "Analyte"]
     pools.sort(key=lambda pool: pool.name)
@@ -324,12 +353,20 @@ def equimolar_pooling(process: Process, args: Namespace):
             )
 
             # Get info specified by script arguments
-            cols["size_bp"] = fetch_from_arg(art_tuple, args.size_in, process)
-            cols["input_conc"] = fetch_from_arg(art_tuple, args.conc_in, process)
-            cols["input_vol"] = fetch_from_arg(art_tuple, args.vol_in, process)
+            cols["size_bp"] = fetch_from_arg(
+                art_tuple, args.size_in, process, prefetched=prefetched
+            )
+            cols["input_conc"] = fetch_from_arg(
+                art_tuple, args.conc_in, process, prefetched=prefetched
+            )
+            cols["input_vol"] = fetch_from_arg(
+                art_tuple, args.vol_in, process, prefetched=prefetched
+            )
             if args.conc_units_in:
                 cols["input_conc_units"] = str(
-                    fetch_from_arg(art_tuple, args.conc_units_in, process)
+                    fetch_from_arg(
+                        art_tuple, args.conc_units_in, process, prefetched=prefetched
+                    )
                 )
                 assert (
                     cols["input_conc_units"] in ["ng/ul", "nM"]
@@ -371,11 +408,8 @@ def equimolar_pooling(process: Process, args: Namespace):
         ), "Inconsistent output amount units."
 
         # Get a column with consistent concentration units
-        df_pool["input_conc_nM"] = df_pool.apply(
-            lambda x: x["input_conc"]
-            if x["input_conc_units"] == "nM"
-            else formula.ng_ul_to_nM(x["input_conc"], x["size_bp"]),
-            axis=1,
+        df_pool["input_conc_nM"] = formula.convert(
+            df_pool.input_conc, df_pool.input_conc_units, "nM", bp=df_pool.size_bp
         )
 
         # Get concentrations proportions between samples
@@ -385,10 +419,10 @@ def equimolar_pooling(process: Process, args: Namespace):
 
         # Get target parameters for pool
         pool_target_amt_fmol: float | None = fetch_from_arg(
-            pool_tuples[0], args.amt_out, process, on_fail=None
+            pool_tuples[0], args.amt_out, process, on_fail=None, prefetched=prefetched
         )
         pool_target_vol: float | None = fetch_from_arg(
-            pool_tuples[0], args.vol_out, process, on_fail=None
+            pool_tuples[0], args.vol_out, process, on_fail=None, prefetched=prefetched
         )
 
         # If amount is specified, use for calculations and ignore target vol
@@ -482,7 +516,7 @@ def equimolar_pooling(process: Process, args: Namespace):
             logging.info(
                 f"Assigned '{pool.name}' UDF '{args.size_out['udf']}': {pool_size:.1f}"
             )
-        pool.put()
+        udf_tools.save(pool)
 
 
 def amount(process: Process, args: Namespace):
@@ -498,83 +532,213 @@ def amount(process: Process, args: Namespace):
         To be calculated:
             args.amt_out        --> Total amount of the sample
 
+    All tuples are calculated at once from a table of the fetched UDFs. Tuples with missing
+    or invalid data are skipped.
     """
     art_tuples = udf_tools.get_art_tuples(process)
+    prefetched = prefetch_args(
+        process,
+        art_tuples,
+        [args.size_in, args.conc_in, args.vol_in, args.conc_units_in, args.amt_out],
+    )
+
+    arg_dicts = {
+        "size_bp": args.size_in,
+        "input_conc": args.conc_in,
+        "input_vol": args.vol_in,
+    } | ({"input_conc_units": args.conc_units_in} if args.conc_units_in else {})
+    table = _fetch_table(process, art_tuples, arg_dicts, prefetched)
+    _check_units(table, args)
+
+    # Infer amount unit, the size is only needed to convert between mass and moles
+    if "fmol" in args.amt_out["udf"]:
+        output_amt_unit = "fmol"
+        size_needed = table.input_conc_units != "nM"
+    elif "ng" in args.amt_out["udf"]:
+        output_amt_unit = "ng"
+        size_needed = table.input_conc_units != "ng/ul"
+    else:
+        output_amt_unit = None
+        size_needed = False
+        _invalidate(
+            table,
+            True,
+            f"Can't infer units from '{args.amt_out['udf']}' for art "
+            + table.output_name,
+        )
+    _check_numbers(
+        table,
+        {name: arg_dicts[name] for name in ["input_conc", "input_vol"]},
+        size_needed=size_needed,
+    )
+
+    # Calculate amounts, all rows are invalid if the amount unit is unknown
+    df = table[table.error.isna()]
+    if output_amt_unit is not None and not df.empty:
+        table.loc[df.index, "output_amt"] = formula.convert(
+            df.input_vol.to_numpy(dtype=float),
+            "ul",
+            output_amt_unit,
+            bp=pd.to_numeric(df.size_bp, errors="coerce").to_numpy(dtype=float),
+            conc=df.input_conc.to_numpy(dtype=float),
+            conc_unit=df.input_conc_units,
+        )
 
-    for art_tuple in art_tuples:
+    for i, art_tuple in enumerate(art_tuples):
+        row = table.loc[i]
         try:
-            art_in = art_tuple[0]["uri"]
-            art_out = art_tuple[1]["uri"]
-            logging.info("")
-            logging.info(
-                f"Processing input '{art_in.name}' -> output '{art_out.name}'..."
-            )
+            if not _log_fetched(art_tuple, row):
+                continue
 
-            # Get info specified by script arguments
-            size_bp = fetch_from_arg(art_tuple, args.size_in, process)
-            input_conc = fetch_from_arg(art_tuple, args.conc_in, process)
-            input_vol = fetch_from_arg(art_tuple, args.vol_in, process)
-            if args.conc_units_in:
-                input_conc_units = str(
-                    fetch_from_arg(art_tuple, args.conc_units_in, process)
-                )
-                assert input_conc_units in [
-                    "ng/ul",
-                    "nM",
-                ], f'Unsupported conc. units "{input_conc_units}" for art {art_in.name}'
-            else:
-                # Infer concentration unit
-                if "ng/ul" in args.conc_in["udf"]:
-                    input_conc_units = "ng/ul"
-                elif "nM" in args.conc_in["udf"]:
-                    input_conc_units = "nM"
-                else:
-                    raise AssertionError(
-                        f"Can't infer units from '{args.conc_in['udf']}' for {art_out.name}."
-                    )
-                logging.info(
-                    f"Inferred unit of UDF '{args.conc_in['udf']}': {input_conc_units}."
-                )
-
-            # Infer amount unit
-            if "fmol" in args.amt_out["udf"]:
-                output_amt_unit = "fmol"
-            elif "ng" in args.amt_out["udf"]:
-                output_amt_unit = "ng"
-            else:
-                raise AssertionError(
-                    f"Can't infer units from '{args.amt_out['udf']}' for art {art_out.name}"
-                )
             logging.info(
                 f"Inferred unit of UDF '{args.amt_out['udf']}': {output_amt_unit}."
             )
-
-            # Calculate amount
-            if input_conc_units == "nM":
-                if output_amt_unit == "fmol":
-                    output_amt = input_vol * input_conc
-                elif output_amt_unit == "ng":
-                    output_amt = formula.fmol_to_ng(input_vol * input_conc, size_bp)
-            elif input_conc_units == "ng/ul":
-                if output_amt_unit == "fmol":
-                    output_amt = formula.ng_to_fmol(input_vol * input_conc, size_bp)
-                elif output_amt_unit == "ng":
-                    output_amt = input_vol * input_conc
             logging.info(
-                f"Calculating amount: {input_vol} ul of {input_conc} {input_conc_units} at {size_bp} bp -> {output_amt:.2f} {output_amt_unit}"
+                f"Calculating amount: {row.input_vol} ul of {row.input_conc} {row.input_conc_units} at {row.size_bp} bp -> {row.output_amt:.2f} {output_amt_unit}"
             )
 
             # Update amount UDF of output artifact
-            udf_tools.put(
-                target=get_UDF_source(art_tuple, args.amt_out, process),
-                target_udf=args.amt_out["udf"],
-                val=round(output_amt, 2),
-            )
-            logging.info(
-                f"Assigned UDF '{args.amt_out['udf']}': {output_amt:.2f} for {args.amt_out['source']} '{get_UDF_source_name(art_tuple, args.amt_out, process)}'."
-            )
+            _put_and_log(process, art_tuple, args.amt_out, row.output_amt)
 
         except AssertionError as e:
             logging.error(str(e), exc_info=True)
             logging.warning("Skipping.")
             continue
+
+
+def _fetch_table(
+    process: Process,
+    art_tuples: list,
+    arg_dicts: dict[str, dict],
+    prefetched: dict,
+) -> pd.DataFrame:
+    """Fetch UDF args across all input-output tuples into a table, without logging.
+
+    Returns a dataframe with one row per tuple, holding the fetched values and their log
+    messages in columns "<name>" and "<name>_log", along with the input and output names. The args of a tuple are fetched in order
+    until one could not be found, whose error message is put in column "error".
+    """
+
+    rows = []
+    for art_tuple in art_tuples:
+        row: dict = {
+            "error": None,
+            "input_name": art_tuple[0]["uri"].name,
+            "output_name": art_tuple[1]["uri"].name,
+        }
+        for name, arg_dict in arg_dicts.items():
+            try:
+                row[name], row[f"{name}_log"] = resolve_arg(
+                    art_tuple, arg_dict, process, prefetched=prefetched
+                )
+            except (AssertionError, KeyError, TypeError) as e:
+                row["error"] = str(e)
+                break
+        rows.append(row)
+
+    return pd.DataFrame(
+        rows,
+        columns=["error", "input_name", "output_name"]
+        + [col for name in arg_dicts for col in [name, f"{name}_log"]],
+        dtype=object,
+    )
+
+
+def _invalidate(table: pd.DataFrame, mask, error):
+    """Set the error message of the rows of a table that are masked and not already invalid.
+
+    The mask and error message can be given for all rows or per row.
+    """
+
+    mask = table.error.isna() & mask
+    table.loc[mask, "error"] = error[mask] if isinstance(error, pd.Series) else error
+
+
+def _check_units(table: pd.DataFrame, args: Namespace):
+    """Set or infer the concentration units of a table, invalidating unsupported units."""
+
+    if args.conc_units_in:
+        units = table.input_conc_units
+        _invalidate(
+            table,
+            ~(units.isin(["ng/ul", "nM"]) & units.map(lambda u: isinstance(u, str))),
+            'Unsupported conc. units "'
+            + units.astype(str)
+            + '" for art '
+            + table.input_name,
+        )
+        return
+
+    if "ng/ul" in args.conc_in["udf"]:
+        inferred_units = "ng/ul"
+    elif "nM" in args.conc_in["udf"]:
+        inferred_units = "nM"
+    else:
+        inferred_units = None
+    table["input_conc_units"] = inferred_units
+
+    if inferred_units is None:
+        _invalidate(
+            table,
+            True,
+            f"Can't infer units from '{args.conc_in['udf']}' for "
+            + table.output_name
+            + ".",
+        )
+    else:
+        # Log the inferred units along with the fetched UDFs of the valid rows
+        table["input_conc_units_log"] = table.error.map(
+            lambda error: None
+            if pd.notna(error)
+            else f"Inferred unit of UDF '{args.conc_in['udf']}': {inferred_units}."
+        )
+
+
+def _check_numbers(table: pd.DataFrame, arg_dicts: dict[str, dict], size_needed):
+    """Invalidate the rows of a table with non-numeric values."""
+
+    def is_number(value) -> bool:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    for name, arg_dict in arg_dicts.items():
+        _invalidate(
+            table,
+            ~table[name].map(is_number),
+            f"Non-numeric value of UDF '{arg_dict['udf']}': " + table[name].astype(str),
+        )
+    _invalidate(
+        table,
+        ~table.size_bp.map(is_number) & size_needed,
+        "Non-numeric size: " + table.size_bp.astype(str),
+    )
+
+
+def _log_fetched(art_tuple: tuple, row: pd.Series) -> bool:
+    """Log the fetched UDFs of a table row, returning False if the row is to be skipped."""
+
+    logging.info("")
+    logging.info(
+        f"Processing input '{art_tuple[0]['uri'].name}' -> output '{art_tuple[1]['uri'].name}'..."
+    )
+    for col in row.index:
+        if col.endswith("_log") and pd.notna(row[col]):
+            logging.info(row[col])
+
+    if pd.notna(row.error):
+        logging.error(row.error)
+        logging.warning("Skipping.")
+        return False
+    return True
+
+
+def _put_and_log(process: Process, art_tuple: tuple, arg_dict: dict, value):
+    """Put a calculated UDF, rounded to two decimals, and log it."""
+
+    udf_tools.put(
+        target=get_UDF_source(art_tuple, arg_dict, process),
+        target_udf=arg_dict["udf"],
+        val=round(float(value), 2),
+    )
+    logging.info(
+        f"Assigned UDF '{arg_dict['udf']}': {value:.2f} for {arg_dict['source']} '{get_UDF_source_name(art_tuple, arg_dict, process)}'."
+    )
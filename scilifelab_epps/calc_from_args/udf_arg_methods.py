@@ -2,14 +2,17 @@
 import logging
 from typing import Any
 
-import yaml
 from genologics.entities import Artifact, Process
 
 from scilifelab_epps.utils import udf_tools
 
 
 def fetch_from_arg(
-    art_tuple: tuple, arg_dict: dict, process: Process, on_fail=AssertionError
+    art_tuple: tuple,
+    arg_dict: dict,
+    process: Process,
+    on_fail=AssertionError,
+    prefetched: dict | None = None,
 ) -> Any:
     """Branching decision-making function. Determine HOW to fetch UDFs given the argument dictionary.
 
@@ -21,9 +24,31 @@ def fetch_from_arg(
             "recursive": True | False,
         }
 
+    If "prefetched" is supplied, as returned by prefetch_args, recursive UDFs are looked up
+    from it instead of back-tracking the input-output tuple.
     """
 
-    history: str | None = None
+    value, log_str = resolve_arg(art_tuple, arg_dict, process, on_fail, prefetched)
+    if log_str is not None:
+        logging.info(log_str)
+
+    return value
+
+
+def resolve_arg(
+    art_tuple: tuple,
+    arg_dict: dict,
+    process: Process,
+    on_fail=AssertionError,
+    prefetched: dict | None = None,
+) -> tuple[Any, str | None]:
+    """Fetch a UDF like fetch_from_arg, but return the log message instead of logging it.
+
+    The log message is None if the UDF could not be found and "on_fail" was returned.
+    """
+
+    history: udf_tools.LineageHistory | None = None
+    last_step: Process | None = None
     source: Artifact | Process
     source_name: str
 
@@ -54,13 +79,20 @@ def fetch_from_arg(
                     assert arg_dict["source"] == "output"
                     use_current = True
 
-                value, history = udf_tools.fetch_last(
-                    currentStep=process,
-                    art_tuple=art_tuple,
-                    target_udfs=arg_dict["udf"],
-                    use_current=use_current,
-                    print_history=True,
-                )
+                if prefetched is not None:
+                    found = prefetched[get_tuple_key(art_tuple)].get(
+                        get_arg_key(arg_dict)
+                    )
+                    assert found is not None
+                    value, last_step = found[0], found[1]
+                else:
+                    value, history = udf_tools.fetch_last(
+                        currentStep=process,
+                        art_tuple=art_tuple,
+                        target_udfs=arg_dict["udf"],
+                        use_current=use_current,
+                        print_history=True,
+                    )
             else:
                 # Fetch UDF from input or output artifact
                 value = udf_tools.fetch(source, arg_dict["udf"])
@@ -76,20 +108,17 @@ def fetch_from_arg(
             )
             raise on_fail(msg)
         else:
-            return on_fail
+            return on_fail, None
 
     # Log what has been done
     log_str = f"Fetched UDF '{arg_dict['udf']}': {value} from {arg_dict['source']} '{source_name}'."
 
-    if history:
-        history_yaml = yaml.load(history, Loader=yaml.FullLoader)
-        last_step_name = history_yaml[-1]["Step name"]
-        last_step_id = history_yaml[-1]["Step ID"]
-        log_str += f"\n\tUDF recusively fetched from step: '{last_step_name}' (ID: '{last_step_id}')"
+    if last_step:
+        log_str += f"\n\tUDF recusively fetched from step: '{last_step.type.name}' (ID: '{last_step.id}')"
+    elif history is not None:
+        log_str += f"\n\tUDF recusively fetched from step: '{history.last_step_name}' (ID: '{history.last_step_id}')"
 
-    logging.info(log_str)
-
-    return value
+    return value, log_str
 
 
 def get_UDF_source(
@@ -122,3 +151,78 @@ def get_UDF_source_name(art_tuple: tuple, arg_dict: dict, process: Process) -> s
         raise AssertionError
 
     return source_name
+
+
+def get_arg_key(arg_dict: dict) -> tuple:
+    """Return a hashable key identifying a UDF arg."""
+    return (arg_dict["udf"], arg_dict["source"], arg_dict["recursive"])
+
+
+def get_tuple_key(art_tuple: tuple) -> tuple:
+    """Return a hashable key identifying an input-output tuple."""
+    return tuple(io["uri"].id if io else None for io in art_tuple)
+
+
+def prefetch_args(process: Process, art_tuples: list, arg_dicts: list) -> dict:
+    """Resolve the UDF args needed for a calculation across all input-output tuples at once.
+
+    A fetch plan is made from the arg dictionaries, grouping the UDFs by source. The
+    artifacts of all tuples are loaded in a single batch call, so non-recursive UDFs can be
+    read directly. Recursive UDFs are resolved by a single shared lineage pass per source.
+
+    Returns a dict mapping tuple keys to dicts, which map the arg keys of recursive UDFs
+    to (value, step, depth) tuples. UDFs that could not be found are left out.
+    """
+
+    # Make the fetch plan
+    plan: dict[str, list] = {}
+    for arg_dict in arg_dicts:
+        if not arg_dict:
+            continue
+        plan_key = (
+            f"recursive {arg_dict['source']}"
+            if arg_dict["recursive"] and arg_dict["source"] != "step"
+            else arg_dict["source"]
+        )
+        if arg_dict["udf"] not in plan.setdefault(plan_key, []):
+            plan[plan_key].append(arg_dict["udf"])
+    logging.info(
+        "Fetch plan: "
+        + "; ".join(f"{key} UDFs {udfs}" for key, udfs in sorted(plan.items()))
+        + "."
+    )
+
+    udf_tools._batch_get(
+        process.lims,
+        [art for art_tuple in art_tuples for art in udf_tools._arts(art_tuple)],
+    )
+
+    prefetched: dict[tuple, dict] = {
+        get_tuple_key(art_tuple): {} for art_tuple in art_tuples
+    }
+    for source, use_current in [("input", False), ("output", True)]:
+        udfs = plan.get(f"recursive {source}")
+        if not udfs:
+            continue
+
+        results = udf_tools.fetch_last_batch(
+            currentStep=process,
+            art_tuples=art_tuples,
+            targets={(udf, source, True): udf for udf in udfs},
+            use_current=use_current,
+        )
+        for art_tuple, result in zip(art_tuples, results):
+            prefetched[get_tuple_key(art_tuple)].update(result)
+
+        for udf in udfs:
+            depths = [
+                result[(udf, source, True)][2]
+                for result in results
+                if (udf, source, True) in result
+            ]
+            logging.info(
+                f"Recursively fetched UDF '{udf}' from {source} for {len(depths)}/{len(art_tuples)} tuples"
+                + (f", back-tracking at most {max(depths)} steps." if depths else ".")
+            )
+
+    return prefetched
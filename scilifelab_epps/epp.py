@@ -22,6 +22,11 @@ from genologics.lims import Lims
 from pkg_resources import DistributionNotFound
 from requests import HTTPError
 
+from scilifelab_epps.utils import well_geometry
+
+# Max number of artifacts per batch update call
+BATCH_SIZE = 500
+
 
 def attach_file(src, resource):
     """Attach file at src to given resource
@@ -63,6 +68,26 @@ def set_field(element):
         logging.warning(f"Error while updating element: {e}")
 
 
+def put_in_batches(lims, artifacts, chunk_size=BATCH_SIZE):
+    """Put artifacts using batch update calls of at most chunk_size artifacts.
+
+    If a batch is rejected, its artifacts are put one by one instead, to find which ones
+    are rejected. Returns a list of (artifact, error) for the artifacts that failed.
+    """
+    failed = []
+    for i in range(0, len(artifacts), chunk_size):
+        chunk = artifacts[i : i + chunk_size]
+        try:
+            lims.put_batch(chunk)
+        except HTTPError:
+            for art in chunk:
+                try:
+                    art.put()
+                except (TypeError, HTTPError) as e:
+                    failed.append((art, e))
+    return failed
+
+
 class EppLogger:
     """Context manager for logging module useful for EPP script execution.
 
@@ -446,27 +471,8 @@ def get_well_number(art: Artifact, count_per: str) -> int:
         and art.container.type.x_dimension["offset"] == 1
     ), "Can't convert well name --> well number for invalid container"
 
-    # Get dimensions of artifact container
-    n_cols = art.container.type.x_dimension["size"]
-    n_rows = art.container.type.y_dimension["size"]
-
-    # Get simple dict translating letters to numbers
-    letter2num = {}
-    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    for i, letter in zip(range(1, len(alphabet) + 1), alphabet):
-        letter2num[letter] = i
-
-    # Collect well data from LIMS
-    well_name = art.location[1]
-    row_letter, col_num = well_name.split(":")
-    row_num = letter2num[row_letter]
-
-    if count_per == "row":
-        well_num = (int(row_num) - 1) * n_cols + int(col_num)
-    elif count_per == "col":
-        well_num = (int(col_num) - 1) * n_rows + int(row_num)
-    else:
-        raise AssertionError
+    geometry = well_geometry.for_container_type(art.container.type)
+    well_num = int(geometry.well_numbers([art.location[1]], count_per)[0])
 
     return well_num
 
@@ -2,5 +2,8 @@
 Alfred Kedhammar, 2023
 """
 
+from . import barcode_index as barcode_index
+from . import dry_run as dry_run
 from . import formula as formula
 from . import udf_tools as udf_tools
+from . import well_geometry as well_geometry
@@ -0,0 +1,157 @@
+import re
+
+DESC = """This is a submodule for identifying unknown index sequences, e.g. the most abundant
+undetermined barcodes of a sequencing lane, by looking them up among known indexes.
+
+Known indexes are hashed by their prefixes of the barcode length, in both orientations,
+and barcodes longer than a known index are compared on their prefix of its length.
+Barcodes of the same length as a known index are also looked up by their 1-mismatch
+neighbourhood, so that i5/i7 swaps, reverse complements and single sequencing errors are
+all recognized. Prefixes are only matched exactly.
+
+To keep random barcodes from being labelled, a match is only reported if both reads of a
+dual barcode hit the same known index, or if a single read hits exactly one known index
+without mismatches.
+"""
+
+COMPLEMENT = str.maketrans("ACGTN", "TGCAN")
+BASES = "ACGT"
+
+
+def revcomp(seq: str) -> str:
+    """Reverse-complement a DNA string."""
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def neighbours(seq: str) -> list[str]:
+    """Return all sequences with exactly one substitution compared to seq."""
+    return [
+        seq[:i] + base + seq[i + 1 :]
+        for i in range(len(seq))
+        for base in BASES
+        if base != seq[i]
+    ]
+
+
+class BarcodeIndex:
+    """Hashed index of known index sequences.
+
+    Usage:
+
+        index = BarcodeIndex()
+        index.add("GGTTTACT", "SI-GA-A1", "10X")
+        index.identify("GGTTTACA+AGATCTCG")
+
+    Each known sequence has a name, a source, e.g. "10X", and the read it is expected in,
+    "i7" or "i5". The lookup tables are built once per barcode length.
+    """
+
+    def __init__(self):
+        self.known: set[tuple[str, str, str, str]] = set()
+        self._tables: dict[int, dict[str, set]] = {}
+        self._lengths: set[int] = set()
+
+    def add(self, seq: str, name: str, source: str, read: str = "i7"):
+        assert read in ["i7", "i5"], "Invalid function argument"
+        seq = seq.strip().upper()
+        if re.fullmatch("[ACGTN]+", seq):
+            self.known.add((seq, name, source, read))
+            self._lengths.add(len(seq))
+            self._tables = {}
+
+    def _table(self, length: int) -> dict[str, set]:
+        """Map the prefixes of the given length of all known sequences, in both
+        orientations, to (name, source, read, reverse complemented, full length)."""
+        if length not in self._tables:
+            table: dict[str, set] = {}
+            for seq, name, source, read in self.known:
+                for is_rc, oriented in [(False, seq), (True, revcomp(seq))]:
+                    # Palindromes are only stored once
+                    if is_rc and oriented == seq:
+                        continue
+                    if len(oriented) >= length:
+                        table.setdefault(oriented[:length], set()).add(
+                            (name, source, read, is_rc, len(oriented) == length)
+                        )
+            self._tables[length] = table
+        return self._tables[length]
+
+    def lookup(self, seq: str) -> dict[tuple, int]:
+        """Return the known indexes matching seq, as (name, source, read, reverse
+        complemented, prefix match), mapped to their number of mismatches.
+
+        Known indexes shorter than seq are matched against the prefix of seq of their length,
+        and known indexes longer than seq on their prefix of its length. Prefix matches are
+        exact, known indexes of the same length as seq may have 1 mismatch.
+        """
+        seq = seq.strip().upper()
+        hits: dict[tuple, int] = {}
+        for length in {len(seq)} | {n for n in self._lengths if n < len(seq)}:
+            table = self._table(length)
+            prefix = seq[:length]
+            for name, source, read, is_rc, full in table.get(prefix, []):
+                is_prefix = not full or length < len(seq)
+                hits[(name, source, read, is_rc, is_prefix)] = 0
+            if length < len(seq):
+                continue
+            for neighbour in neighbours(prefix):
+                for name, source, read, is_rc, full in table.get(neighbour, []):
+                    if full:
+                        hits.setdefault((name, source, read, is_rc, False), 1)
+        return hits
+
+    def identify(self, barcode: str, max_hits: int = 3) -> str:
+        """Describe which known indexes a single or dual barcode, e.g. "ACGT+TTGG", could be.
+
+        For dual barcodes, known indexes matching both reads are preferred over those
+        matching a single read. A single read is only identified if it matches exactly one
+        known index without mismatches. Returns an empty string if nothing is found.
+        """
+        parts = [part for part in re.split(r"[+-]", barcode) if part][:2]
+        hits_per_read = [self.lookup(part) for part in parts]
+        expected_reads = ["i7", "i5"]
+
+        # Candidates are (sort key, description), best first
+        candidates: set[tuple[tuple, str]] = set()
+
+        if len(parts) == 2:
+            # Both reads matching the same known index
+            for (name, source, read_1, rc_1, _), mm_1 in hits_per_read[0].items():
+                for (name_2, _, read_2, rc_2, _), mm_2 in hits_per_read[1].items():
+                    if name_2 != name or read_1 == read_2:
+                        continue
+                    notes = ["i5/i7 swapped"] if read_1 != "i7" else []
+                    notes += [
+                        f"{read} reverse complement"
+                        for read, is_rc in [(read_1, rc_1), (read_2, rc_2)]
+                        if is_rc
+                    ]
+                    candidates.add(_candidate(name, source, notes, mm_1 + mm_2))
+
+        if not candidates:
+            for pos, hits in enumerate(hits_per_read):
+                exact = [hit for hit, mismatches in hits.items() if not mismatches]
+                # Skip reads matching several known indexes, or none exactly
+                if len({hit[0] for hit in exact}) != 1:
+                    continue
+                for name, source, read, is_rc, _ in exact:
+                    notes = [f"{expected_reads[pos]} only"] if len(parts) == 2 else []
+                    if read != expected_reads[pos]:
+                        notes.append("i5/i7 swapped")
+                    if is_rc:
+                        notes.append(f"{read} reverse complement")
+                    candidates.add(_candidate(name, source, notes, 0))
+
+        # Only the best match of each known index is described
+        best: dict[str, str] = {}
+        for (_, _, name), description in sorted(candidates):
+            best.setdefault(name, description)
+        return "; ".join(list(best.values())[:max_hits])
+
+
+def _candidate(name: str, source: str, notes: list[str], mismatches: int) -> tuple:
+    """Return a sort key and description of a known index matching a barcode."""
+    if mismatches:
+        notes = notes + [f"{mismatches} mismatch{'es' if mismatches > 1 else ''}"]
+    description = f"{name} [{source}]" + (f" ({', '.join(notes)})" if notes else "")
+    return (mismatches, len(notes), name), description
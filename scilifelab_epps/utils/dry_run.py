@@ -0,0 +1,160 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from genologics.lims import Lims
+from tabulate import tabulate
+
+DESC = """This is a submodule for running EPP scripts against a real step without
+writing to the Genologics Clarity LIMS API.
+
+Reads are passed through and counted, while all writes are captured instead of sent.
+The wall time and number of requests are recorded per phase of the script.
+"""
+
+
+class DryRun:
+    """Capture the writes of a Lims instance and estimate the cost of a script.
+
+    Usage:
+
+        with DryRun(lims) as dry_run:
+            with DryRun.phase("Fetch"):
+                ...
+        logging.info(dry_run.report())
+
+    The classmethods phase() and record_depth() can be called anywhere, and do nothing
+    unless a dry run is active.
+    """
+
+    active: "DryRun | None" = None
+
+    def __init__(self, lims: Lims):
+        self.lims = lims
+        self.current_phase = "Other"
+        # Phase name --> [wall time (s), requests made]
+        self.phases: dict[str, list] = {}
+        self.requests: dict[str, int] = {}
+        self.planned_writes: list[tuple[str, str]] = []
+        self.max_depth = 0
+        # Requests may be made from several threads
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._patched = {
+            (self.lims, "post"): self.lims.post,
+            (self.lims, "put"): self.lims.put,
+            (self.lims, "delete"): self.lims.delete,
+            (self.lims, "upload_new_file"): self.lims.upload_new_file,
+            (self.lims, "route_artifacts"): self.lims.route_artifacts,
+            (self.lims.request_session, "get"): self.lims.request_session.get,
+            (self.lims.request_session, "delete"): self.lims.request_session.delete,
+        }
+
+        def get(*args, **kwargs):
+            self._count("GET")
+            return self._patched[(self.lims.request_session, "get")](*args, **kwargs)
+
+        def post(uri, *args, **kwargs):
+            # Batch retrieval is the only POST request that does not write anything
+            if uri.endswith("batch/retrieve"):
+                self._count("POST batch/retrieve")
+                return self._patched[(self.lims, "post")](uri, *args, **kwargs)
+            self.capture("POST", uri)
+
+        self.lims.post = post
+        self.lims.put = lambda uri, *args, **kwargs: self.capture("PUT", uri)
+        self.lims.delete = lambda uri, *args, **kwargs: self.capture("DELETE", uri)
+        self.lims.upload_new_file = lambda entity, file: self.capture(
+            "UPLOAD", f"{file} -> {entity.uri}"
+        )
+        self.lims.route_artifacts = lambda arts, *args, **kwargs: self.capture(
+            "ROUTE", f"{len(arts)} artifacts"
+        )
+        self.lims.request_session.get = get
+        self.lims.request_session.delete = lambda uri, *args, **kwargs: self.capture(
+            "DELETE", uri
+        )
+
+        DryRun.active = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._record_time()
+        DryRun.active = None
+        for (obj, attr), method in self._patched.items():
+            setattr(obj, attr, method)
+
+    def _count(self, request: str):
+        with self._lock:
+            self.requests[request] = self.requests.get(request, 0) + 1
+            self.phases.setdefault(self.current_phase, [0.0, 0])[1] += 1
+
+    def _record_time(self):
+        now = time.perf_counter()
+        self.phases.setdefault(self.current_phase, [0.0, 0])[0] += now - self._start
+        self._start = now
+
+    def capture(self, method: str, target: str):
+        """Record a write instead of sending it."""
+        with self._lock:
+            self.planned_writes.append((method, target))
+
+    @classmethod
+    @contextmanager
+    def phase(cls, name: str):
+        """Attribute wall time and requests to a named phase, if a dry run is active."""
+        dry_run = cls.active
+        if dry_run is None:
+            yield
+            return
+
+        dry_run._record_time()
+        outer_phase, dry_run.current_phase = dry_run.current_phase, name
+        try:
+            yield
+        finally:
+            dry_run._record_time()
+            dry_run.current_phase = outer_phase
+
+    @classmethod
+    def record_depth(cls, depth: int):
+        """Record how many steps a lineage was back-tracked, if a dry run is active."""
+        if cls.active is not None:
+            cls.active.max_depth = max(cls.active.max_depth, depth)
+
+    def report(self) -> str:
+        """Summarize the dry run."""
+
+        writes: dict[str, int] = {}
+        for method, _ in self.planned_writes:
+            writes[method] = writes.get(method, 0) + 1
+
+        return "\n".join(
+            [
+                "Dry run summary, no changes were written to LIMS:",
+                tabulate(
+                    [
+                        [name, f"{seconds:.2f}", n_requests]
+                        for name, (seconds, n_requests) in self.phases.items()
+                    ]
+                    + [
+                        [
+                            "Total",
+                            f"{sum(p[0] for p in self.phases.values()):.2f}",
+                            sum(p[1] for p in self.phases.values()),
+                        ]
+                    ],
+                    headers=["Phase", "Wall time (s)", "Requests"],
+                ),
+                f"Requests made: {sum(self.requests.values())} ("
+                + ", ".join(f"{k}: {v}" for k, v in self.requests.items())
+                + ")",
+                f"Planned writes: {len(self.planned_writes)} ("
+                + ", ".join(f"{k}: {v}" for k, v in writes.items())
+                + ")",
+                *[f"\t{method} {target}" for method, target in self.planned_writes],
+                f"Max lineage depth reached: {self.max_depth} steps",
+            ]
+        )
@@ -1,5 +1,8 @@
 """This module contains reusable formulas and mappings"""
 
+import numpy as np
+import pandas as pd
+
 # Functions for switching between molarity and weight
 # To keep things explicit, define four functions from the same formula
 
@@ -30,10 +33,143 @@ def nM_to_ng_ul(nM, bp):
     return fmol_to_ng(nM, bp)
 
 
-# Plate well to number dict, e.g. "A:12" --> 89
-well_name2num_96plate = {}
-i = 1
-for col in range(1, 13):
-    for row in "ABCDEFGH":
-        well_name2num_96plate[f"{row}:{col}"] = i
-        i += 1
+# Unit-aware conversions, for scalars as well as NumPy arrays and pandas Series
+
+# Unit tag --> (quantity, kind)
+UNITS = {
+    "ng": ("amount", "mass"),
+    "fmol": ("amount", "molar"),
+    "cells": ("amount", "count"),
+    "ng/ul": ("conc", "mass"),
+    "nM": ("conc", "molar"),
+    "cells/ul": ("conc", "count"),
+    "ul": ("volume", None),
+}
+AMOUNT_UNITS = {"mass": "ng", "molar": "fmol", "count": "cells"}
+CONC_UNITS = {"mass": "ng/ul", "molar": "nM", "count": "cells/ul"}
+# Lower-case spelling --> unit tag
+UNIT_ALIASES = {unit.lower(): unit for unit in UNITS}
+
+
+def parse_unit(unit: str) -> str:
+    """Return the unit tag of a unit string, ignoring case, e.g. "ng/uL" --> "ng/ul"."""
+    assert (
+        isinstance(unit, str) and unit.lower() in UNIT_ALIASES
+    ), f"Unsupported unit '{unit}'"
+    return UNIT_ALIASES[unit.lower()]
+
+
+def amount_unit(conc_unit: str) -> str:
+    """Return the amount unit corresponding to a concentration unit, e.g. "nM" --> "fmol"."""
+    kind = UNITS[parse_unit(conc_unit)][1]
+    assert kind is not None, f"Unit '{conc_unit}' has no amount unit"
+    return AMOUNT_UNITS[kind]
+
+
+def convert(
+    values, from_unit, to_unit: str, bp=None, vol=None, conc=None, conc_unit=None
+):
+    """Convert values between ng, fmol, cells, ng/ul, nM, cells/ul and ul.
+
+    Values, sizes (bp), volumes (ul) and concentrations can be scalars, NumPy arrays or
+    pandas Series. The units "from_unit" and "conc_unit" can be given either as a single
+    unit or per value, e.g. as a column of concentration units.
+
+    - Mass and molar units are converted using the size in bp.
+    - Amounts and concentrations are converted using the volume in ul.
+    - Volumes are converted to and from amounts or concentrations using the concentration
+      "conc", given in "conc_unit".
+
+    Examples:
+        convert(df.conc, df.conc_units, "nM", bp=df.size_bp)
+        convert(df.target_amt_fmol, "fmol", "ul", bp=df.size_bp, conc=df.conc, conc_unit=df.conc_units)
+    """
+
+    to_unit = parse_unit(to_unit)
+    if isinstance(from_unit, str) and (conc_unit is None or isinstance(conc_unit, str)):
+        return _convert(
+            values,
+            parse_unit(from_unit),
+            to_unit,
+            bp,
+            vol,
+            conc,
+            parse_unit(conc_unit) if conc_unit is not None else None,
+        )
+
+    # Convert the values of each combination of units separately
+    index = values.index if isinstance(values, pd.Series) else None
+    values = np.asarray(values, dtype=float)
+    from_units = _broadcast_units(from_unit, len(values))
+    conc_units = _broadcast_units(conc_unit, len(values))
+    result = np.full(len(values), np.nan)
+    for units in set(zip(from_units, conc_units)):
+        mask = (from_units == units[0]) & (conc_units == units[1])
+        result[mask] = _convert(
+            values[mask],
+            units[0],
+            to_unit,
+            _masked(bp, mask),
+            _masked(vol, mask),
+            _masked(conc, mask),
+            units[1],
+        )
+
+    return pd.Series(result, index=index) if index is not None else result
+
+
+def _masked(arg, mask: np.ndarray):
+    """Return the masked values of an array-like argument, or the argument if it is scalar."""
+    return np.asarray(arg, dtype=float)[mask] if np.ndim(arg) else arg
+
+
+def _broadcast_units(units, length: int) -> np.ndarray:
+    """Return an array of unit tags, given a single unit or one unit per value."""
+    if units is None or isinstance(units, str):
+        units = [units] * length
+    return np.array(
+        [parse_unit(unit) if unit is not None else None for unit in units], dtype=object
+    )
+
+
+def _convert(values, from_unit, to_unit, bp, vol, conc, conc_unit):
+    if from_unit == to_unit:
+        return values
+    from_quantity, from_kind = UNITS[from_unit]
+    to_quantity, to_kind = UNITS[to_unit]
+
+    # Volume <--> amount or concentration, via the amount held in a volume
+    if "volume" in [from_quantity, to_quantity]:
+        assert (
+            conc is not None and conc_unit is not None
+        ), f"A concentration is required to convert {from_unit} to {to_unit}."
+        amount_unit = AMOUNT_UNITS[UNITS[conc_unit][1]]
+        if from_quantity == "volume":
+            return _convert(values * conc, amount_unit, to_unit, bp, vol, None, None)
+        else:
+            return _convert(values, from_unit, amount_unit, bp, vol, None, None) / conc
+
+    # Amount <--> concentration
+    if from_quantity != to_quantity:
+        assert (
+            vol is not None
+        ), f"A volume is required to convert {from_unit} to {to_unit}."
+        if from_quantity == "amount":
+            return _convert(
+                values / vol, CONC_UNITS[from_kind], to_unit, bp, None, None, None
+            )
+        else:
+            return _convert(
+                values * vol, AMOUNT_UNITS[from_kind], to_unit, bp, None, None, None
+            )
+
+    # Mass <--> molar
+    assert "count" not in [
+        from_kind,
+        to_kind,
+    ], f"Can't convert between {from_unit} and {to_unit}."
+    assert bp is not None, f"A size is required to convert {from_unit} to {to_unit}."
+    if from_kind == "mass":
+        return ng_to_fmol(values, bp)
+    else:
+        return fmol_to_ng(values, bp)
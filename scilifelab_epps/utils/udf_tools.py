@@ -4,6 +4,8 @@ from typing import Union
 from genologics.entities import Artifact, Process
 from requests.exceptions import HTTPError
 
+from scilifelab_epps.utils.dry_run import DryRun
+
 DESC = """This is a submodule for defining reusable functions to handle artifact
 UDFs in in the Genologics Clarity LIMS API.
 """
@@ -17,7 +19,7 @@ def put(target: Artifact | Process, target_udf: str, val, on_fail=AssertionError
     target.udf[target_udf] = val
 
     try:
-        target.put()
+        save(target)
         return True
 
     except HTTPError:
@@ -30,6 +32,73 @@ def put(target: Artifact | Process, target_udf: str, val, on_fail=AssertionError
             return on_fail
 
 
+def save(target: Artifact | Process):
+    """Put artifact or process, or stage it if a step snapshot is active."""
+
+    if StepSnapshot.active is not None:
+        StepSnapshot.active.stage(target)
+    else:
+        target.put()
+
+
+class StepSnapshot:
+    """In-memory snapshot of a step, shared by several calculations.
+
+    While the snapshot is active, artifacts and processes passed to save() are staged
+    instead of put. Since the LIMS entities are cached, the staged UDF values are visible to
+    subsequent lookups without re-reading LIMS. All staged artifacts are flushed using a
+    single batch call when the snapshot is exited without an error.
+
+    Usage:
+
+        with StepSnapshot(process):
+            ...
+    """
+
+    active: "StepSnapshot | None" = None
+
+    def __init__(self, process: Process):
+        self.process = process
+        self.staged: dict[str, Artifact | Process] = {}
+
+    def __enter__(self):
+        StepSnapshot.active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        StepSnapshot.active = None
+        # Staged writes are discarded if the block raised
+        if exc_info[0] is None:
+            with DryRun.phase("Write UDFs"):
+                self.flush()
+
+    def stage(self, target: Artifact | Process):
+        self.staged[target.uri] = target
+
+    def flush(self):
+        """Put all staged entities, artifacts in a single batch call."""
+
+        arts = [t for t in self.staged.values() if isinstance(t, Artifact)]
+        others = [t for t in self.staged.values() if not isinstance(t, Artifact)]
+        self.staged = {}
+
+        if arts:
+            try:
+                self.process.lims.put_batch(arts)
+            except HTTPError:
+                # Put artifacts one by one, to find which ones are rejected
+                failed = []
+                for art in arts:
+                    try:
+                        art.put()
+                    except HTTPError:
+                        failed.append(art.name)
+                if failed:
+                    raise AssertionError(f"Can't put UDFs on {', '.join(failed)}")
+        for other in others:
+            other.put()
+
+
 def is_filled(art: Artifact, target_udf: str) -> bool:
     """Check whether current UDF is populated for current article."""
     try:
@@ -62,6 +131,15 @@ def get_art_tuples(currentStep: Process) -> list:
     2) an analyte and None
     """
 
+    _batch_get(
+        currentStep.lims,
+        [
+            art
+            for art_tuple in currentStep.input_output_maps
+            for art in _arts(art_tuple)
+        ],
+    )
+
     art_tuples = []
     for art_tuple in currentStep.input_output_maps:
         if art_tuple[0] and art_tuple[1]:
@@ -134,6 +212,70 @@ def list_udfs(art: Artifact) -> list:
     return [item_tuple[0] for item_tuple in art.udf.items()]
 
 
+class LineageHistory:
+    """Lookup history of fetch_last, with one entry per visited step.
+
+    Only references to the visited steps and artifacts are kept. The detailed view, listing
+    the UDFs of every visited artifact, is rendered as JSON when converted to a string.
+    """
+
+    def __init__(self):
+        self.entries: list[dict] = []
+
+    def add_step(self, step: Process):
+        self.entries.append({"step": step})
+
+    def add_output(self, art: Artifact):
+        self.entries[-1]["output"] = art
+
+    def add_input(self, art: Artifact):
+        self.entries[-1]["input"] = art
+
+    @property
+    def last_step_name(self) -> str:
+        return self.entries[-1]["step"].type.name
+
+    @property
+    def last_step_id(self) -> str:
+        return self.entries[-1]["step"].id
+
+    def render(self) -> list[dict]:
+        rendered = []
+        for entry in self.entries:
+            rendered.append(
+                {"Step name": entry["step"].type.name, "Step ID": entry["step"].id}
+            )
+            if "output" in entry:
+                rendered[-1].update(
+                    {
+                        "Derived sample ID": entry["output"].id,
+                        "Derived sample UDFs": dict(entry["output"].udf.items()),
+                    }
+                )
+            if "input" in entry:
+                if entry["input"].parent_process:
+                    rendered[-1].update(
+                        {
+                            "Input sample parent step name": entry[
+                                "input"
+                            ].parent_process.type.name,
+                            "Input sample parent step ID": entry[
+                                "input"
+                            ].parent_process.id,
+                        }
+                    )
+                rendered[-1].update(
+                    {
+                        "Input sample ID": entry["input"].id,
+                        "Input sample UDFs": dict(entry["input"].udf.items()),
+                    }
+                )
+        return rendered
+
+    def __str__(self) -> str:
+        return json.dumps(self.render(), indent=2)
+
+
 def fetch_last(
     currentStep: Process,
     art_tuple: tuple,
@@ -146,17 +288,19 @@ def fetch_last(
 
     Target UDF can be supplied as a string, or as a prioritized list of strings.
 
-    If "print_history" == True, will return both the target metric and the lookup history as a string.
+    If "print_history" == True, will return both the target metric and the lookup history
+    as a LineageHistory, which renders as JSON when converted to a string.
     """
 
     # Convert to list, to enable iteration
     if isinstance(target_udfs, str):
         target_udfs = [target_udfs]
 
-    history = []
+    history = LineageHistory()
 
     while True:
-        history.append({"Step name": currentStep.type.name, "Step ID": currentStep.id})
+        history.add_step(currentStep)
+        DryRun.record_depth(len(history.entries) - 1)
 
         # Try to grab input and output articles, if possible
         try:
@@ -168,49 +312,28 @@ def fetch_last(
         except:
             output_art = None
 
-        if len(history) == 1 and use_current is not True:
+        if len(history.entries) == 1 and use_current is not True:
             # If we are in the original step and "use_current" is false, skip
             pass
         else:
             # Look trough outputs
             if output_art:
-                history[-1].update(
-                    {
-                        "Derived sample ID": output_art.id,
-                        "Derived sample UDFs": dict(output_art.udf.items()),
-                    }
-                )
+                history.add_output(output_art)
 
                 for target_udf in target_udfs:
-                    if target_udf in list_udfs(output_art):
+                    if target_udf in output_art.udf:
                         if print_history is True:
-                            return output_art.udf[target_udf], json.dumps(
-                                history, indent=2
-                            )
+                            return output_art.udf[target_udf], history
                         else:
                             return output_art.udf[target_udf]
 
             # Look through inputs
             if input_art:
-                if input_art.parent_process:
-                    history[-1].update(
-                        {
-                            "Input sample parent step name": input_art.parent_process.type.name,
-                            "Input sample parent step ID": input_art.parent_process.id,
-                        }
-                    )
-                history[-1].update(
-                    {
-                        "Input sample ID": input_art.id,
-                        "Input sample UDFs": dict(input_art.udf.items()),
-                    }
-                )
+                history.add_input(input_art)
                 for target_udf in target_udfs:
-                    if target_udf in list_udfs(input_art):
+                    if target_udf in input_art.udf:
                         if print_history is True:
-                            return input_art.udf[target_udf], json.dumps(
-                                history, indent=2
-                            )
+                            return input_art.udf[target_udf], history
                         else:
                             return input_art.udf[target_udf]
 
@@ -247,13 +370,116 @@ def fetch_last(
         except AssertionError:
             if isinstance(on_fail, type) and issubclass(on_fail, Exception):
                 if print_history is True:
-                    print(json.dumps(history, indent=2))
+                    print(history)
                 raise on_fail(
                     f"Could not find matching UDF(s) [{', '.join(target_udfs)}] for artifact tuple {art_tuple}"
                 )
             else:
                 if print_history is True:
-                    print(json.dumps(history, indent=2))
-                    return on_fail, json.dumps(history, indent=2)
+                    print(history)
+                    return on_fail, history
                 else:
                     return on_fail
+
+
+def fetch_last_batch(
+    currentStep: Process,
+    art_tuples: list,
+    targets: dict[str | tuple, str | list],
+    use_current=True,
+) -> list[dict]:
+    """Recursively look for several target UDFs across several I/O tuples at once.
+
+    Works like fetch_last, but walks the lineage of all tuples level by level in one shared
+    pass, so each parent step is only resolved once and the artifacts of every level are
+    fetched using a single batch call.
+
+    The "targets" dict maps keys, e.g. column names or (udf, source, recursive) tuples, to
+    target UDFs, each supplied as a string or as a prioritized list of strings.
+
+    Returns one dict per I/O tuple, mapping each key to a (value, step, depth) tuple, where
+    "step" is the process in which the value was found and "depth" the number of steps
+    back-tracked to get there. Keys that could not be resolved are left out.
+    """
+
+    targets = {
+        key: [target_udfs] if isinstance(target_udfs, str) else target_udfs
+        for key, target_udfs in targets.items()
+    }
+    results: list[dict] = [{} for _ in art_tuples]
+    lims = currentStep.lims
+
+    # Each lineage is represented as (tuple index, step, art tuple)
+    lineages = [(i, currentStep, art_tuple) for i, art_tuple in enumerate(art_tuples)]
+    depth = 0
+
+    while lineages:
+        DryRun.record_depth(depth)
+        _batch_get(
+            lims, [art for _, _, art_tuple in lineages for art in _arts(art_tuple)]
+        )
+
+        if depth > 0 or use_current is True:
+            for i, step, art_tuple in lineages:
+                input_art, output_art = _arts(art_tuple, keep_none=True)
+                for key, target_udfs in targets.items():
+                    if key in results[i]:
+                        continue
+                    for art in [output_art, input_art]:
+                        if art is None:
+                            continue
+                        found = [udf for udf in target_udfs if udf in art.udf]
+                        if found:
+                            results[i][key] = (art.udf[found[0]], step, depth)
+                            break
+
+        # Cycle to previous step for lineages which are still missing UDFs
+        pp_tuples_by_art_id: dict[str, dict] = {}
+        next_lineages = []
+        for i, _step, art_tuple in lineages:
+            input_art = _arts(art_tuple, keep_none=True)[0]
+            if len(results[i]) == len(targets) or input_art is None:
+                continue
+            pp = input_art.parent_process
+            if pp is None:
+                continue
+
+            if pp.id not in pp_tuples_by_art_id:
+                pp_tuples_by_art_id[pp.id] = _index_tuples_by_art_id(pp)
+            matching_tuples = pp_tuples_by_art_id[pp.id].get(input_art.id, [])
+
+            if len(matching_tuples) == 1:
+                next_lineages.append((i, pp, matching_tuples[0]))
+
+        lineages = next_lineages
+        depth += 1
+
+    return results
+
+
+def _arts(art_tuple: tuple, keep_none=False) -> list:
+    """Return the [input, output] artifacts of an I/O tuple."""
+    arts = [io["uri"] if io else None for io in art_tuple]
+    if keep_none:
+        return arts
+    return [art for art in arts if art is not None]
+
+
+def _batch_get(lims, arts: list):
+    """Load all artifacts that are not already cached using a single batch call."""
+    to_get = list({art.id: art for art in arts if art.root is None}.values())
+    if to_get:
+        lims.get_batch(to_get)
+
+
+def _index_tuples_by_art_id(step: Process) -> dict[str, list]:
+    """Map the artifact IDs of a step to the analyte I/O tuples they take part in."""
+    _batch_get(
+        step.lims,
+        [art for art_tuple in step.input_output_maps for art in _arts(art_tuple)],
+    )
+    tuples_by_art_id: dict[str, list] = {}
+    for art_tuple in get_art_tuples(step):
+        for art_id in {art.id for art in _arts(art_tuple)}:
+            tuples_by_art_id.setdefault(art_id, []).append(art_tuple)
+    return tuples_by_art_id
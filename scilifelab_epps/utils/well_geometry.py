@@ -0,0 +1,123 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+DESC = """This is a submodule for translating between the well names, coordinates and
+numbers of container types, e.g. "B:1" <--> (2, 1) <--> 2 (column-wise) or 13 (row-wise).
+
+Geometries are computed once per container type and convert whole columns of wells at once.
+"""
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+class WellGeometry:
+    """Precomputed well geometry of a container type.
+
+    Well names have the format "<row>:<col>". Rows and columns are numbered from 1, as are
+    well numbers, which count either row-wise (A:1, A:2, ...) or column-wise (A:1, B:1, ...).
+    """
+
+    def __init__(
+        self,
+        n_rows: int,
+        n_cols: int,
+        row_alpha: bool = True,
+        row_offset: int = 0,
+        col_alpha: bool = False,
+        col_offset: int = 1,
+    ):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+
+        self.row_labels = _labels(n_rows, row_alpha, row_offset)
+        self.col_labels = _labels(n_cols, col_alpha, col_offset)
+
+        # Row-wise arrays of all wells
+        self.rows = np.repeat(np.arange(1, n_rows + 1), n_cols)
+        self.cols = np.tile(np.arange(1, n_cols + 1), n_rows)
+        self.names = np.array(
+            [
+                f"{self.row_labels[row - 1]}:{self.col_labels[col - 1]}"
+                for row, col in zip(self.rows, self.cols)
+            ]
+        )
+        self._index = pd.Index(self.names)
+
+        # Well numbers of the row-wise arrays, for both ways of counting
+        self.numbers = {
+            "row": (self.rows - 1) * n_cols + self.cols,
+            "col": (self.cols - 1) * n_rows + self.rows,
+        }
+
+    def __repr__(self):
+        return f"WellGeometry({self.n_rows} x {self.n_cols}, {self.names[0]} - {self.names[-1]})"
+
+    def positions(self, names) -> np.ndarray:
+        """Return the row-wise positions of well names, e.g. a dataframe column."""
+        positions = self._index.get_indexer(pd.Index(names, dtype=object))
+        if (positions == -1).any():
+            invalid = [name for name, pos in zip(names, positions) if pos == -1]
+            raise AssertionError(f"Invalid well name(s) for {self}: {invalid}")
+        return positions
+
+    def rowcol(self, names) -> tuple[np.ndarray, np.ndarray]:
+        """Translate well names to arrays of row and column numbers."""
+        positions = self.positions(names)
+        return self.rows[positions], self.cols[positions]
+
+    def well_numbers(self, names, count_per: str) -> np.ndarray:
+        """Translate well names to well numbers, counting per "row" or "col"."""
+        assert count_per in ["row", "col"], "Invalid function argument"
+        return self.numbers[count_per][self.positions(names)]
+
+    def well_names(self, numbers, count_per: str) -> np.ndarray:
+        """Translate well numbers, counting per "row" or "col", to well names."""
+        return self.ordered_names(count_per)[np.asarray(numbers, dtype=int) - 1]
+
+    def ordered_names(self, count_per: str) -> np.ndarray:
+        """Return all well names, ordered row-wise or column-wise."""
+        assert count_per in ["row", "col"], "Invalid function argument"
+        return self.names[np.argsort(self.numbers[count_per])]
+
+
+def _labels(size: int, alpha: bool, offset: int) -> list[str]:
+    if alpha:
+        assert offset + size <= len(ALPHABET), "Too many lettered rows or columns"
+        return list(ALPHABET[offset : offset + size])
+    return [str(i + offset) for i in range(size)]
+
+
+@lru_cache(maxsize=None)
+def get_geometry(
+    n_rows: int,
+    n_cols: int,
+    row_alpha: bool = True,
+    row_offset: int = 0,
+    col_alpha: bool = False,
+    col_offset: int = 1,
+) -> WellGeometry:
+    """Return the geometry of the given dimensions, computed once and then cached."""
+    return WellGeometry(n_rows, n_cols, row_alpha, row_offset, col_alpha, col_offset)
+
+
+def for_container_type(container_type) -> WellGeometry:
+    """Return the geometry of a LIMS container type."""
+    y_dim = container_type.y_dimension
+    x_dim = container_type.x_dimension
+    return get_geometry(
+        y_dim["size"],
+        x_dim["size"],
+        y_dim["is_alpha"],
+        y_dim["offset"],
+        x_dim["is_alpha"],
+        x_dim["offset"],
+    )
+
+
+PLATE_96 = get_geometry(8, 12)
+PLATE_384 = get_geometry(16, 24)
+STRIP_8 = get_geometry(8, 1)
+# Flowcell lanes are placed in wells "1:1", "2:1", ...
+FLOWCELL_LANES_8 = get_geometry(8, 1, row_alpha=False, row_offset=1)
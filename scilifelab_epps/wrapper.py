@@ -59,6 +59,19 @@ def epp_decorator(script_path: str, timestamp: str):
             )
             logging.info(f"Script called with arguments: \n\t{args_str}")
 
+            def upload_log(log_filename: str):
+                """Upload the log to LIMS, or keep it on disk during a dry run."""
+                if getattr(args, "dry_run", False):
+                    sys.stderr.write(f"Dry run, log kept at '{log_filename}'.\n")
+                    return
+                upload_file(
+                    file_path=log_filename,
+                    file_slot=args.log,
+                    process=process,
+                    lims=lims,
+                )
+                os.remove(log_filename)
+
             # Run
             try:
                 script_main(args)
@@ -68,13 +81,7 @@ def epp_decorator(script_path: str, timestamp: str):
                 # Post error to LIMS GUI
                 logging.error(str(e), exc_info=True)
                 logging.shutdown()
-                upload_file(
-                    file_path=log_filename,
-                    file_slot=args.log,
-                    process=process,
-                    lims=lims,
-                )
-                os.remove(log_filename)
+                upload_log(log_filename)
                 sys.stderr.write(str(e))
                 sys.exit(2)
 
@@ -82,15 +89,9 @@ def epp_decorator(script_path: str, timestamp: str):
             else:
                 logging.info("Script completed successfully.")
                 logging.shutdown()
-                upload_file(
-                    file_path=log_filename,
-                    file_slot=args.log,
-                    process=process,
-                    lims=lims,
-                )
                 # Check log for errors and warnings
                 log_content = open(log_filename).read()
-                os.remove(log_filename)
+                upload_log(log_filename)
                 if "ERROR:" in log_content or "WARNING:" in log_content:
                     sys.stderr.write(
                         "Script finished successfully, but log contains errors or warnings, please have a look."
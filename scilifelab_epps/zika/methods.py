@@ -12,6 +12,7 @@ import numpy as np
 import pandas as pd
 
 from scilifelab_epps import zika
+from scilifelab_epps.utils.dry_run import DryRun
 from scilifelab_epps.utils.udf_tools import is_filled
 
 
@@ -57,17 +58,8 @@ def pool_fixed_vol(
         "dst_id": "art_tuple[1]['uri'].location[0].id",
         "dst_well": "art_tuple[1]['uri'].location[1]",
     }
-    df_all = zika.utils.fetch_sample_data(currentStep, to_fetch)
-
-    # Define deck, a dictionary mapping plate names to deck positions
-    assert len(df_all.src_id.unique()) <= 4, "Only one to four input plates allowed"
-    assert len(df_all.dst_id.unique()) == 1, "Only one output plate allowed"
-    deck = {}
-    deck[df_all.dst_name.unique()[0]] = 3
-    available = [2, 4, 1, 5][0 : len(df_all.src_name.unique())]
-    # TODO assign deck positions to minimize travel distance
-    for plate, pos in zip(df_all.src_name.unique(), available):
-        deck[plate] = pos
+    with DryRun.phase("Fetch sample data"):
+        df_all = zika.utils.fetch_sample_data(currentStep, to_fetch)
 
     # Populate worklist
     df_wl = pd.DataFrame()
@@ -76,23 +68,28 @@ def pool_fixed_vol(
         df_pool["transfer_vol"] = fixed_vol
         df_wl = pd.concat([df_wl, df_pool], axis=0)
 
-    # Format worklist
-    df_formatted = zika.utils.format_worklist(df_wl.copy(), deck)
+    # Partition transfers into worklists, each with a deck dictionary mapping plate names to deck positions
+    worklists = []
+    for df_part, deck in zika.utils.partition_transfers(df_wl):
+        df_formatted = zika.utils.format_worklist(df_part.copy(), deck)
+        worklists.append((df_formatted, deck, None))
     wl_filename, log_filename = zika.utils.get_filenames(
         method_name="pool", pid=currentStep.id
     )
-
-    # Write the output files
-    zika.utils.write_worklist(
-        df=df_formatted.copy(),
-        deck=deck,
-        wl_filename=wl_filename,
-    )
-    zika.utils.write_log(log, log_filename)
-
-    # Upload files
-    zika.utils.upload_csv(currentStep, lims, wl_filename)
-    zika.utils.upload_log(currentStep, lims, log_filename)
+    if len(worklists) > 1:
+        log.append(f"Transfers are split across {len(worklists)} worklists")
+
+    # Render and upload the output files
+    upload_filename, wl_content = zika.utils.render_worklists(worklists, wl_filename)
+    with DryRun.phase("Upload files"):
+        zika.utils.upload_outputs(
+            currentStep,
+            lims,
+            {
+                "Mosquito CSV File": (upload_filename, wl_content),
+                "Mosquito Log": (log_filename, zika.utils.render_log(log)),
+            },
+        )
 
     # Issue warnings, if any
     if any("WARNING" in entry for entry in log):
@@ -150,6 +147,8 @@ def pool(
             - If a sample does not have enough accessible volume to reach the target representation in the pool
                 --> Let it be under-represented
 
+    If the source and destination plates do not fit on a single deck, the transfers are
+    split across multiple worklists, which are uploaded together as a zip archive.
     """
 
     try:
@@ -187,7 +186,8 @@ def pool(
             if v:
                 to_fetch[k] = f"art_tuple[1]['uri'].udf['{v}']"
 
-        df_all = zika.utils.fetch_sample_data(currentStep, to_fetch)
+        with DryRun.phase("Fetch sample data"):
+            df_all = zika.utils.fetch_sample_data(currentStep, to_fetch)
 
         # All samples should have accessible volume
         assert all(
@@ -202,255 +202,321 @@ def pool(
         df_all["full_vol"] = df_all.vol.copy()
         df_all.loc[:, "vol"] = df_all.vol - well_dead_vol
 
-        # Define deck, a dictionary mapping plate names to deck positions
-        assert len(df_all.src_id.unique()) <= 4, "Only one to four input plates allowed"
-        assert len(df_all.dst_id.unique()) == 1, "Only one output plate allowed"
-        deck = {}
-        deck[df_all.dst_name.unique()[0]] = 3
-        available = [2, 4, 1, 5][0 : len(df_all.src_name.unique())]
-        # TODO assign deck positions to minimize travel distance
-        for plate, pos in zip(df_all.src_name.unique(), available):
-            deck[plate] = pos
-
-        # Work through the pools one at a time
-        df_wl = pd.DataFrame()
-        buffer_vols = {}
-        errors = False
-        for pool in pools:
-            try:
-                # === PREPARE CALCULATION INPUTS ===
-
-                # Subset data to current pool
-                df_pool = df_all[df_all.target_name == pool.name].copy()
-
-                # Find target parameters, amount and conentration will be either in ng and ng/ul or fmol and nM
-                target_pool_vol = df_pool.target_vol.unique()[0]
-                if udfs["target_conc"] == "Pool Conc. (nM)":
-                    target_pool_conc = df_pool.target_conc.values[0]
-                    target_amt_taken = target_pool_conc * target_pool_vol / len(df_pool)
-                    amt_unit = "fmol"
-                    conc_unit = "nM"
-                elif udfs["target_amt"] == "Amount for prep (ng)":
-                    target_amt_taken = df_pool.target_amt.unique()[0]
-                    target_pool_conc = target_amt_taken * len(df_pool) / target_pool_vol
-                    amt_unit = "ng"
-                    conc_unit = "ng/ul"
-                else:
-                    raise AssertionError("Could not make sense of input UDFs")
-                assert all(
-                    df_all.conc_units == conc_unit
-                ), "Samples and pools have different conc units"
-
-                # Append target parameters to log
-                log.append(f"\n\nPooling {len(df_pool)} samples into {pool.name}...")
-                log.append("Target parameters:")
-                log.append(
-                    f" - Amount per sample: {round(target_amt_taken, 2)} {amt_unit}"
-                )
-                log.append(f" - Pool volume: {round(target_pool_vol, 1)} ul")
-                log.append(
-                    f" - Pool concentration: {round(target_pool_conc, 2)} {conc_unit}"
-                )
+        # === PREPARE CALCULATION INPUTS ===
 
-                # Set any negative or negligible concentrations to 0.01 and flag in log
-                conc_floor = 0.01
-                if not df_pool.loc[df_pool.conc < conc_floor, "conc"].empty:
-                    neg_conc_sample_names = df_pool.loc[
-                        df_pool.conc < conc_floor, "sample_name"
-                    ].sort_values()
-                    df_pool.loc[df_pool.conc < conc_floor, "conc"] = conc_floor
-                    log.append(
-                        f"\nWARNING: The following {len(neg_conc_sample_names)} sample(s) fell short of, and will be treated as, "
-                        + f"{conc_floor} {conc_unit}: {', '.join(neg_conc_sample_names)}"
-                    )
-                    log.append(
-                        "Low concentration samples will warrant high transfer volumes and may cause pool overflow."
-                    )
-
-                # === CALCULATE SAMPLE RANGES ===
+        # Find target parameters, amount and conentration will be either in ng and ng/ul or fmol and nM
+        if udfs["target_conc"] == "Pool Conc. (nM)":
+            amt_unit = "fmol"
+            conc_unit = "nM"
+        elif udfs["target_amt"] == "Amount for prep (ng)":
+            amt_unit = "ng"
+            conc_unit = "ng/ul"
+        else:
+            raise AssertionError("Could not make sense of input UDFs")
+        assert all(
+            df_all.conc_units == conc_unit
+        ), "Samples and pools have different conc units"
+
+        # All pools are solved at once, operating on a copy of the sample data grouped by pool
+        df = df_all[df_all.target_name.isin([pool.name for pool in pools])].copy()
+        by_pool = df.groupby("target_name", sort=False)
+
+        df["n_samples"] = by_pool.sample_name.transform("size")
+        df["target_pool_vol"] = by_pool.target_vol.transform("first")
+        if amt_unit == "fmol":
+            df["target_pool_conc"] = by_pool.target_conc.transform("first")
+            df["target_amt_taken"] = (
+                df.target_pool_conc * df.target_pool_vol / df.n_samples
+            )
+        else:
+            df["target_amt_taken"] = by_pool.target_amt.transform("first")
+            df["target_pool_conc"] = (
+                df.target_amt_taken * df.n_samples / df.target_pool_vol
+            )
 
-                # Calculate the range of transferrable amount for each sample
-                df_pool["min_amount"] = zika_min_vol * df_pool.conc
-                df_pool["max_amount"] = df_pool.vol * df_pool.conc
+        # Set any negative or negligible concentrations to 0.01, they are flagged in the log
+        conc_floor = 0.01
+        df["below_conc_floor"] = df.conc < conc_floor
+        df.loc[df.below_conc_floor, "conc"] = conc_floor
 
-                # === CALCULATE POSSIBLE OUTCOMES AND MAKE ADJUSTMENTS ===
+        # === CALCULATE SAMPLE RANGES ===
 
-                # Isolate highest concentrated sample
-                highest_conc_sample = df_pool.sort_values(
-                    by="conc", ascending=False
-                ).iloc[0]
+        # Calculate the range of transferrable amount for each sample
+        df["min_amount"] = zika_min_vol * df.conc
+        df["max_amount"] = df.vol * df.conc
 
-                # Given the input samples, can an even pool be produced? I.e. is there an overlap in the transfer amount ranges of all samples?
-                even_pool_is_possible = max(df_pool.min_amount) < min(
-                    df_pool.max_amount
-                )
+        # Given the input samples, can an even pool be produced? I.e. is there an overlap in the transfer amount ranges of all samples?
+        by_pool = df.groupby("target_name", sort=False)
+        df["lowest_common_amount"] = by_pool.min_amount.transform("max")
+        df["highest_common_amount"] = by_pool.max_amount.transform("min")
 
-                if even_pool_is_possible:
-                    lowest_common_amount = max(df_pool.min_amount)
-                    highest_common_amount = min(df_pool.max_amount)
+        # Sample volumes at the common amounts (even pool) or accounting for sample depletion (uneven pool)
+        df["min_sample_vol"] = df.lowest_common_amount / df.conc
+        df["max_sample_vol"] = df.highest_common_amount / df.conc
+        df["real_min_amt"] = np.minimum(df.lowest_common_amount, df.max_amount)
+        df["real_min_sample_vol"] = np.minimum(
+            df.lowest_common_amount / df.conc, df.vol
+        )
 
-                    # Calculate pool limits given samples
-                    pool_min_amt = lowest_common_amount * len(df_pool)
-                    pool_min_sample_vol = sum(lowest_common_amount / df_pool.conc)
-                    pool_max_sample_vol = sum(highest_common_amount / df_pool.conc)
-                    if pool_max_sample_vol < well_max_vol:
-                        pool_max_sample_amt = highest_common_amount * len(df_pool)
-                    else:
-                        # If the max amount corresponds to a volume higher than max, scale it down accordingly
-                        pool_max_sample_amt = (
-                            highest_common_amount
-                            * len(df_pool)
-                            * well_max_vol
-                            / pool_max_sample_vol
-                        )
-                    pool_min_conc = pool_min_amt / well_max_vol
-                    pool_max_conc = (
-                        pool_min_amt / pool_min_sample_vol
-                    )  # also equals pool_max_amt / pool_max_sample_vol because amt / vol proportions are the same between samples
-
-                    # Ensure that pool will not overflow
-                    if pool_min_sample_vol > well_max_vol:
-                        log.append(
-                            f"\nERROR: Overflow in {pool.name}. Decrease number of samples or dilute highly concentrated outliers"
-                        )
-                        log.append(
-                            f"Highest concentrated sample: {highest_conc_sample.sample_name} at {round(highest_conc_sample.conc,2)} {conc_unit}"
-                        )
-                        log.append(
-                            f"Pooling cannot be normalized to less than {round(pool_min_sample_vol,1)} ul"
-                        )
+        # === CALCULATE POSSIBLE OUTCOMES AND MAKE ADJUSTMENTS ===
+
+        # Summarize to one row per pool
+        df_pools = df.groupby("target_name", sort=False).agg(
+            n_samples=("n_samples", "first"),
+            target_pool_vol=("target_pool_vol", "first"),
+            target_pool_conc=("target_pool_conc", "first"),
+            target_amt_taken=("target_amt_taken", "first"),
+            lowest_common_amount=("lowest_common_amount", "first"),
+            highest_common_amount=("highest_common_amount", "first"),
+            pool_min_sample_vol=("min_sample_vol", "sum"),
+            pool_max_sample_vol=("max_sample_vol", "sum"),
+            pool_real_min_amt=("real_min_amt", "sum"),
+            pool_real_min_sample_vol=("real_min_sample_vol", "sum"),
+        )
+        p = df_pools
+
+        even_pool_is_possible = p.lowest_common_amount < p.highest_common_amount
+
+        # A) Even pool, calculate pool limits given samples
+        p["pool_min_amt"] = p.lowest_common_amount * p.n_samples
+        p["pool_max_sample_amt"] = np.where(
+            p.pool_max_sample_vol < well_max_vol,
+            p.highest_common_amount * p.n_samples,
+            # If the max amount corresponds to a volume higher than max, scale it down accordingly
+            p.highest_common_amount
+            * p.n_samples
+            * well_max_vol
+            / p.pool_max_sample_vol,
+        )
+        p["pool_min_conc"] = p.pool_min_amt / well_max_vol
+        # Also equals pool_max_amt / pool_max_sample_vol because amt / vol proportions are the same between samples
+        p["pool_max_conc"] = p.pool_min_amt / p.pool_min_sample_vol
+
+        # Nudge conc, if necessary
+        even_conc = np.where(
+            p.target_pool_conc > p.pool_max_conc,
+            # Pool conc. has to be decreased from target to the maximum possible, given samples
+            p.pool_max_conc,
+            np.where(
+                p.target_pool_conc < p.pool_min_conc,
+                # Pool conc. has to be increased from target to the minimum possible, given samples
+                p.pool_min_conc,
+                p.target_pool_conc,
+            ),
+        )
 
-                        errors = True
-                        raise zika.utils.VolumeOverflow
+        # Nudge vol, if necessary
+        pool_min_vol = p.pool_min_amt / even_conc
+        pool_max_vol = p.highest_common_amount * p.n_samples / even_conc
+        pool_min_vol_given_conc = np.minimum(pool_min_vol, well_max_vol)
+        pool_max_vol_given_conc = np.minimum(pool_max_vol, well_max_vol)
+        even_vol = np.where(
+            p.target_pool_vol < pool_min_vol_given_conc,
+            pool_min_vol_given_conc,
+            np.where(
+                p.target_pool_vol > pool_max_vol_given_conc,
+                pool_max_vol_given_conc,
+                p.target_pool_vol,
+            ),
+        )
+        # Keep track of pools whose volume is capped by the well volume
+        even_vol_is_capped = np.where(
+            p.target_pool_vol < pool_min_vol_given_conc,
+            pool_min_vol > well_max_vol,
+            (p.target_pool_vol > pool_max_vol_given_conc)
+            & (pool_max_vol > well_max_vol),
+        )
 
-                    log.append(
-                        "\nAn even pool can be created within the following parameter ranges:"
-                    )
-                    log.append(
-                        f" - Amount per sample {round(lowest_common_amount,2)} - {round(pool_max_sample_amt / len(df_pool),2)} {amt_unit}"
-                    )
-                    log.append(
-                        f" - Pool volume {round(pool_min_sample_vol,1)} - {round(well_max_vol,1)} ul"
-                    )
-                    log.append(
-                        f" - Pool concentration {round(pool_min_conc,2)} - {round(pool_max_conc,2)} {conc_unit}"
-                    )
+        # B) Uneven pool, use the minimum transfer amount of the most concentrated sample as the common transfer amount
+        p["pool_real_max_conc"] = p.pool_real_min_amt / p.pool_real_min_sample_vol
+        p["pool_real_min_conc"] = p.pool_real_min_amt / well_max_vol
+        # Use the flawed target parameters for comparison and ignore sample depletion
+        uneven_conc = np.where(
+            p.target_pool_conc > p.pool_real_max_conc,
+            p.pool_real_max_conc,
+            np.where(
+                p.target_pool_conc < p.pool_real_min_conc,
+                p.pool_real_min_conc,
+                p.target_pool_conc,
+            ),
+        )
 
-                    # Nudge conc, if necessary
-                    if target_pool_conc > pool_max_conc:
-                        # Pool conc. has to be decreased from target to the maximum possible, given samples
-                        pool_conc = pool_max_conc
-                    elif target_pool_conc < pool_min_conc:
-                        # Pool conc. has to be increased from target to the minimum possible, given samples
-                        pool_conc = pool_min_conc
-                    else:
-                        # Pool conc. can be set to target
-                        pool_conc = target_pool_conc
+        # Combine outcomes
+        p["pool_conc"] = np.where(even_pool_is_possible, even_conc, uneven_conc)
+        # No volume expansion is allowed for uneven pools, so pool volume is set to the minimum, given the conc
+        p["pool_vol"] = np.where(
+            even_pool_is_possible, even_vol, p.pool_real_min_sample_vol
+        )
+        p["target_transfer_amt"] = np.where(
+            even_pool_is_possible,
+            p.pool_vol * p.pool_conc / p.n_samples,
+            p.lowest_common_amount,
+        )
+        p["min_pool_vol"] = np.where(
+            even_pool_is_possible, p.pool_min_sample_vol, p.pool_real_min_sample_vol
+        )
+        # Ensure that pools will not overflow
+        overflow = p.min_pool_vol > well_max_vol
+        vol_is_capped = even_pool_is_possible & even_vol_is_capped
+
+        # === STORE FINAL CALCULATION RESULTS ===
+
+        # Append transfer volumes and corresponding fraction of target conc. for each sample
+        df["pool_vol"] = df.target_name.map(p.pool_vol)
+        df["target_transfer_amt"] = df.target_name.map(p.target_transfer_amt)
+        df["transfer_vol"] = np.minimum(df.target_transfer_amt / df.conc, df.vol)
+        df["transfer_amt"] = df.transfer_vol * df.conc
+        df["final_amt_fraction"] = round(
+            (df.transfer_vol * df.conc / df.pool_vol)
+            / (df.target_transfer_amt / df.pool_vol),
+            2,
+        )
 
-                    # Nudge vol, if necessary
-                    pool_min_vol_given_conc = min(
-                        pool_min_amt / pool_conc, well_max_vol
-                    )
-                    pool_max_vol_given_conc = min(
-                        highest_common_amount * len(df_pool) / pool_conc, well_max_vol
-                    )
-                    if target_pool_vol < pool_min_vol_given_conc:
-                        # Pool vol has to be increased from target to minimum possible, given samples
-                        pool_vol = pool_min_vol_given_conc
-                    elif target_pool_vol > pool_max_vol_given_conc:
-                        # Pool vol has to be decreased from target to maximum possible, given samples
-                        pool_vol = pool_max_vol_given_conc
-                    else:
-                        # Pool vol can be set to target
-                        pool_vol = target_pool_vol
+        # Calculate total sample volumes
+        p["total_sample_vol"] = df.groupby("target_name", sort=False).transfer_vol.sum()
+
+        # Keep the sample columns, drop the intermediate calculation columns
+        below_conc_floor = df.below_conc_floor
+        df = df[
+            list(df_all.columns)
+            + [
+                "min_amount",
+                "max_amount",
+                "transfer_vol",
+                "transfer_amt",
+                "final_amt_fraction",
+            ]
+        ]
+        pool_dfs = dict(list(df.groupby("target_name", sort=False)))
 
-                    target_transfer_amt = pool_vol * pool_conc / len(df_pool)
+        # === REPORT RESULTS ===
 
+        # Work through the pools one at a time
+        buffer_vols = {}
+        pools_ok = []
+        errors = False
+        for pool in pools:
+            df_pool = pool_dfs[pool.name]
+            r = p.loc[pool.name]
+
+            # Target parameters are numpy floats, values derived from them are kept as Python floats,
+            # since the two round ties differently and the log should read the same as before
+            target_pool_vol = p.at[pool.name, "target_pool_vol"]
+            target_pool_conc = p.at[pool.name, "target_pool_conc"]
+            target_amt_taken = p.at[pool.name, "target_amt_taken"]
+            pool_conc = (
+                target_pool_conc
+                if r.pool_conc == target_pool_conc
+                else float(r.pool_conc)
+            )
+            if even_pool_is_possible[pool.name]:
+                if r.pool_vol == target_pool_vol:
+                    pool_vol = target_pool_vol
+                elif vol_is_capped[pool.name]:
+                    pool_vol = well_max_vol
                 else:
-                    # There is no common transfer amount, and sample volumes can NOT be expanded without worsening the even-ness of the pool
+                    pool_vol = float(r.pool_vol)
+                target_transfer_amt = pool_vol * pool_conc / len(df_pool)
+            else:
+                pool_vol = float(r.pool_vol)
+                target_transfer_amt = float(r.target_transfer_amt)
+
+            # Append target parameters to log
+            log.append(f"\n\nPooling {len(df_pool)} samples into {pool.name}...")
+            log.append("Target parameters:")
+            log.append(f" - Amount per sample: {round(target_amt_taken, 2)} {amt_unit}")
+            log.append(f" - Pool volume: {round(target_pool_vol, 1)} ul")
+            log.append(
+                f" - Pool concentration: {round(target_pool_conc, 2)} {conc_unit}"
+            )
 
-                    # Use the minimum transfer amount of the most concentrated sample as the common transfer amount
-                    target_transfer_amt = max(df_pool.min_amount)
+            # Flag negative or negligible concentrations
+            pool_below_conc_floor = below_conc_floor[df_pool.index]
+            if pool_below_conc_floor.any():
+                neg_conc_sample_names = df_pool.loc[
+                    pool_below_conc_floor, "sample_name"
+                ].sort_values()
+                log.append(
+                    f"\nWARNING: The following {len(neg_conc_sample_names)} sample(s) fell short of, and will be treated as, "
+                    + f"{conc_floor} {conc_unit}: {', '.join(neg_conc_sample_names)}"
+                )
+                log.append(
+                    "Low concentration samples will warrant high transfer volumes and may cause pool overflow."
+                )
 
-                    df_low = df_pool[df_pool.max_amount < target_transfer_amt]
+            # Isolate highest concentrated sample
+            highest_conc_sample = df_pool.sort_values(by="conc", ascending=False).iloc[
+                0
+            ]
 
-                    log.append("\nWARNING: The samples cannot be evenly pooled!")
+            if even_pool_is_possible[pool.name]:
+                if overflow[pool.name]:
                     log.append(
-                        f"The minimum transfer amount of the highest concentrated sample {highest_conc_sample.sample_name} ({round(highest_conc_sample.conc, 2)} {highest_conc_sample.conc_units}) exceeds the maximum transfer amount of the following samples:"
+                        f"\nERROR: Overflow in {pool.name}. Decrease number of samples or dilute highly concentrated outliers"
                     )
-                    for i, r in df_low.iterrows():
-                        log.append(
-                            f"{r.sample_name} ({round(r.conc,2)} {r.conc_units}, {round(r.vol,2)} uL accessible volume)"
-                        )
                     log.append(
-                        "The above samples will be depleted and under-represented in the final pool."
-                    )
-
-                    # Calculate pool limits taking into account sample depletion
-                    pool_real_min_amt = sum(
-                        np.minimum(target_transfer_amt, df_pool.max_amount)
+                        f"Highest concentrated sample: {highest_conc_sample.sample_name} at {round(highest_conc_sample.conc,2)} {conc_unit}"
                     )
-                    pool_real_min_sample_vol = sum(
-                        np.minimum(target_transfer_amt / df_pool.conc, df_pool.vol)
+                    log.append(
+                        f"Pooling cannot be normalized to less than {round(float(r.pool_min_sample_vol), 1)} ul"
                     )
-                    pool_real_max_conc = pool_real_min_amt / pool_real_min_sample_vol
-                    pool_real_min_conc = pool_real_min_amt / well_max_vol
+                    errors = True
+                    continue
 
-                    # Ensure that pool will not overflow
-                    if pool_real_min_sample_vol > well_max_vol:
-                        log.append(
-                            f"\nERROR: Overflow in {pool.name}. Decrease number of samples or dilute highly concentrated outliers"
-                        )
-                        log.append(
-                            f"Highest concentrated sample: {highest_conc_sample.sample_name} at {round(highest_conc_sample.conc,2)} {conc_unit}"
-                        )
-                        log.append(
-                            f"Pooling cannot be normalized to less than {round(pool_real_min_sample_vol,1)} ul"
-                        )
+                log.append(
+                    "\nAn even pool can be created within the following parameter ranges:"
+                )
+                log.append(
+                    f" - Amount per sample {round(float(r.lowest_common_amount), 2)} - {round(float(r.pool_max_sample_amt) / len(df_pool), 2)} {amt_unit}"
+                )
+                log.append(
+                    f" - Pool volume {round(float(r.pool_min_sample_vol), 1)} - {round(well_max_vol, 1)} ul"
+                )
+                log.append(
+                    f" - Pool concentration {round(float(r.pool_min_conc), 2)} - {round(float(r.pool_max_conc), 2)} {conc_unit}"
+                )
 
-                        errors = True
-                        raise zika.utils.VolumeOverflow
+            else:
+                # There is no common transfer amount, and sample volumes can NOT be expanded without worsening the even-ness of the pool
+                df_low = df_pool[df_pool.max_amount < target_transfer_amt]
 
+                log.append("\nWARNING: The samples cannot be evenly pooled!")
+                log.append(
+                    f"The minimum transfer amount of the highest concentrated sample {highest_conc_sample.sample_name} ({round(highest_conc_sample.conc, 2)} {highest_conc_sample.conc_units}) exceeds the maximum transfer amount of the following samples:"
+                )
+                for i, row in df_low.iterrows():
                     log.append(
-                        "\nWill try to create a pool that is as even as possible. Accounting for sample depletion, a pool can be created with the following parameter ranges: "
+                        f"{row.sample_name} ({round(row.conc, 2)} {row.conc_units}, {round(row.vol, 2)} uL accessible volume)"
                     )
+                log.append(
+                    "The above samples will be depleted and under-represented in the final pool."
+                )
+
+                if overflow[pool.name]:
                     log.append(
-                        f" - Target amount per sample {round(target_transfer_amt,2)}"
+                        f"\nERROR: Overflow in {pool.name}. Decrease number of samples or dilute highly concentrated outliers"
                     )
                     log.append(
-                        f" - Pool volume {round(pool_real_min_sample_vol,1)}-{round(well_max_vol,1)} ul"
+                        f"Highest concentrated sample: {highest_conc_sample.sample_name} at {round(highest_conc_sample.conc,2)} {conc_unit}"
                     )
                     log.append(
-                        f" - Pool concentration {round(pool_real_min_conc,2)}-{round(pool_real_max_conc,2)} {conc_unit}"
+                        f"Pooling cannot be normalized to less than {round(float(r.pool_real_min_sample_vol), 1)} ul"
                     )
+                    errors = True
+                    continue
 
-                    # Nudge conc, if necessary
-                    # Use the flawed target parameters for comparison and ignore sample depletion
-                    if target_pool_conc > pool_real_max_conc:
-                        pool_conc = pool_real_max_conc
-                    elif target_pool_conc < pool_real_min_conc:
-                        pool_conc = pool_real_min_conc
-                    else:
-                        pool_conc = target_pool_conc
-
-                    # No volume expansion is allowed, so pool volume is set to the minimum, given the conc
-                    pool_vol = pool_real_min_sample_vol
-
-            except zika.utils.VolumeOverflow:
-                continue
-
-            # === STORE FINAL CALCULATION RESULTS ===
-
-            # Append transfer volumes and corresponding fraction of target conc. for each sample
-            df_pool["transfer_vol"] = np.minimum(
-                target_transfer_amt / df_pool.conc, df_pool.vol
-            )
-            df_pool["transfer_amt"] = df_pool.transfer_vol * df_pool.conc
-            df_pool["final_amt_fraction"] = round(
-                (df_pool.transfer_vol * df_pool.conc / pool_vol)
-                / (target_transfer_amt / pool_vol),
-                2,
-            )
+                log.append(
+                    "\nWill try to create a pool that is as even as possible. Accounting for sample depletion, a pool can be created with the following parameter ranges: "
+                )
+                log.append(
+                    f" - Target amount per sample {round(target_transfer_amt,2)}"
+                )
+                log.append(
+                    f" - Pool volume {round(float(r.pool_real_min_sample_vol), 1)}-{round(well_max_vol, 1)} ul"
+                )
+                log.append(
+                    f" - Pool concentration {round(float(r.pool_real_min_conc), 2)}-{round(float(r.pool_real_max_conc), 2)} {conc_unit}"
+                )
 
             # Report adjustments in log
             log.append("\nAdjustments:")
@@ -472,7 +538,7 @@ def pool(
                 )
 
             # Calculate and store pool buffer volume
-            total_sample_vol = sum(df_pool["transfer_vol"])
+            total_sample_vol = float(r.total_sample_vol)
             buffer_vol = (
                 pool_vol - total_sample_vol
                 if pool_vol - total_sample_vol > zika_min_vol
@@ -500,14 +566,14 @@ def pool(
                 for name, frac in outlier_samples.values:
                     log.append(f" - {name}\t{round(frac,2)}")
 
-            df_wl = pd.concat([df_wl, df_pool], axis=0)
+            pools_ok.append(pool)
 
             # Update UDFs
             pool.udf["Final Volume (uL)"] = float(round(pool_vol, 1))
             if amt_unit == "fmol":
                 pool.udf["Pool Conc. (nM)"] = float(round(pool_conc, 2))
             elif amt_unit == "ng":
-                if even_pool_is_possible:
+                if even_pool_is_possible[pool.name]:
                     pool.udf["Amount for prep (ng)"] = float(
                         round(df_pool["transfer_amt"].unique()[0], 2)
                     )
@@ -524,32 +590,51 @@ def pool(
         if errors:
             raise zika.utils.CheckLog(log, log_filename, lims, currentStep)
 
-        # Format worklist
-        df_formatted = zika.utils.format_worklist(df_wl.copy(), deck)
+        # Collect the transfers of all successfully solved pools
+        df_wl = pd.concat([pool_dfs[pool.name] for pool in pools_ok], axis=0)
+
+        # Partition transfers into worklists, each with a deck dictionary mapping plate names to deck positions
+        worklists = []
+        dst_plates_commented = set()
+        for df_part, deck in zika.utils.partition_transfers(df_wl):
+            # Format worklist
+            df_formatted = zika.utils.format_worklist(df_part.copy(), deck)
+
+            # Comments to attach to the worklist header
+            comments = [
+                f"This worklist will enact pooling of {len(df_part)} samples",
+                "For detailed parameters see the worklist log",
+            ]
+            # Buffer additions are listed once per destination plate
+            dst_name = df_part.dst_name.iloc[0]
+            if dst_name not in dst_plates_commented:
+                dst_plates_commented.add(dst_name)
+                for pool in pools_ok:
+                    if (
+                        buffer_vols[pool.name] > 0
+                        and pool_dfs[pool.name].dst_name.iloc[0] == dst_name
+                    ):
+                        comments.append(
+                            f"Add {round(buffer_vols[pool.name],1)} ul buffer to pool {pool.name} (well {pool.location[1]})"
+                        )
 
-        # Comments to attach to the worklist header
-        comments = [
-            f"This worklist will enact pooling of {len(df_all)} samples",
-            "For detailed parameters see the worklist log",
-        ]
-        for pool in pools:
-            if buffer_vols[pool.name] > 0:
-                comments.append(
-                    f"Add {round(buffer_vols[pool.name],1)} ul buffer to pool {pool.name} (well {pool.location[1]})"
-                )
+            worklists.append((df_formatted, deck, comments))
+        if len(worklists) > 1:
+            log.append(f"\nTransfers are split across {len(worklists)} worklists")
 
-        # Write the output files
-        zika.utils.write_worklist(
-            df=df_formatted.copy(),
-            deck=deck,
-            wl_filename=wl_filename,
-            comments=comments,
+        # Render and upload the output files
+        upload_filename, wl_content = zika.utils.render_worklists(
+            worklists, wl_filename
         )
-        zika.utils.write_log(log, log_filename)
-
-        # Upload files
-        zika.utils.upload_csv(currentStep, lims, wl_filename)
-        zika.utils.upload_log(currentStep, lims, log_filename)
+        with DryRun.phase("Upload files"):
+            zika.utils.upload_outputs(
+                currentStep,
+                lims,
+                {
+                    "Mosquito CSV File": (upload_filename, wl_content),
+                    "Mosquito Log": (log_filename, zika.utils.render_log(log)),
+                },
+            )
 
         # Issue warnings, if any
         if any("WARNING" in entry for entry in log):
@@ -656,7 +741,8 @@ def norm(
             if v:
                 to_fetch[k] = f"art_tuple[1]['uri'].udf['{v}']"
 
-        df = zika.utils.fetch_sample_data(currentStep, to_fetch)
+        with DryRun.phase("Fetch sample data"):
+            df = zika.utils.fetch_sample_data(currentStep, to_fetch)
 
         conc_unit = "ng/ul" if use_customer_metrics else df.conc_units[0]
         amt_unit = "ng" if conc_unit == "ng/ul" else "fmol"
@@ -672,15 +758,6 @@ def norm(
         df["full_vol"] = df.vol.copy()
         df.loc[:, "vol"] = df.vol - well_dead_vol
 
-        # Define deck
-        assert len(df.src_id.unique()) == 1, "Only one input plate allowed"
-        assert len(df.dst_id.unique()) == 1, "Only one output plate allowed"
-        deck = {
-            df.src_name.unique()[0]: 2,
-            df.dst_name.unique()[0]: 3,
-            "buffer_plate": 4,
-        }
-
         # Make calculations
         df["target_conc"] = df.target_amt / df.target_vol
         df["min_transfer_amt"] = np.minimum(df.vol, zika_min_vol) * df.conc
@@ -785,38 +862,54 @@ def norm(
         # Join dict to dataframe
         df = df.join(pd.DataFrame(d))
 
-        # Comments to attach to the worklist header
-        wl_comments = []
-
-        # Resolve buffer transfers
-        df_buffer, wl_comments = zika.utils.resolve_buffer_transfers(
-            df=df.copy(), wl_comments=wl_comments
-        )
-
-        # Format worklist
-        df_formatted = zika.utils.format_worklist(df_buffer.copy(), deck=deck)
-        wl_comments.append(
-            f"This worklist will enact normalization of {len(df)} samples. For detailed parameters see the worklist log"
-        )
-
-        # Write files
-
         wl_filename, log_filename = zika.utils.get_filenames(
             method_name="norm", pid=currentStep.id
         )
 
-        zika.utils.write_worklist(
-            df=df_formatted.copy(),
-            deck=deck,
-            wl_filename=wl_filename,
-            comments=wl_comments,
-        )
+        # Partition transfers into worklists, each with a deck dictionary mapping plate names to deck positions
+        worklists = []
+        # The same buffer plate is used throughout all worklists
+        buffer_plate = zika.utils.BufferPlate()
+        for df_part, deck in zika.utils.partition_transfers(df, buffer_plate=True):
+            # Comments to attach to the worklist header
+            wl_comments = []
+
+            # Resolve buffer transfers
+            df_buffer, wl_comments = zika.utils.resolve_buffer_transfers(
+                df=df_part.copy(),
+                wl_comments=wl_comments,
+                buffer_plate=buffer_plate,
+            )
 
-        zika.utils.write_log(log, log_filename)
+            # Format worklist
+            df_formatted = zika.utils.format_worklist(df_buffer.copy(), deck=deck)
+            wl_comments.append(
+                f"This worklist will enact normalization of {len(df_part)} samples. For detailed parameters see the worklist log"
+            )
+            worklists.append((df_formatted, deck, wl_comments))
+        # The buffer plate is filled once, before the first worklist
+        worklists[0][2].insert(0, buffer_plate.fill_comment())
+        for _, _, wl_comments in worklists[1:]:
+            wl_comments.insert(
+                0,
+                "Keep the buffer plate of the previous worklist, without refilling it.",
+            )
+        if len(worklists) > 1:
+            log.append(f"Transfers are split across {len(worklists)} worklists")
 
-        # Upload files
-        zika.utils.upload_csv(currentStep, lims, wl_filename)
-        zika.utils.upload_log(currentStep, lims, log_filename)
+        # Render and upload the output files
+        upload_filename, wl_content = zika.utils.render_worklists(
+            worklists, wl_filename
+        )
+        with DryRun.phase("Upload files"):
+            zika.utils.upload_outputs(
+                currentStep,
+                lims,
+                {
+                    "Mosquito CSV File": (upload_filename, wl_content),
+                    "Mosquito Log": (log_filename, zika.utils.render_log(log)),
+                },
+            )
 
         # Issue warnings, if any
         if any("WARNING" in entry for entry in log):
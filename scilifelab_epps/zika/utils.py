@@ -10,14 +10,21 @@ applications of the instrument.
 Written by Alfred Kedhammar
 """
 
+import io
+import os
+import re
 import sys
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
 
 import numpy as np
 import pandas as pd
 from genologics.entities import Process
 
-from scilifelab_epps.utils.udf_tools import fetch_last
+from scilifelab_epps.utils.udf_tools import fetch_last_batch
+from scilifelab_epps.utils.well_geometry import PLATE_96, PLATE_384
 
 
 def verify_step(currentStep, targets=None):
@@ -69,8 +76,9 @@ def verify_step(currentStep, targets=None):
 
 class CheckLog(Exception):
     def __init__(self, log, log_filename, lims, currentStep):
-        write_log(log, log_filename)
-        upload_log(currentStep, lims, log_filename)
+        upload_outputs(
+            currentStep, lims, {"Mosquito Log": (log_filename, render_log(log))}
+        )
 
         sys.stderr.write("ERROR: Check log for more info.")
         sys.exit(2)
@@ -85,17 +93,42 @@ def fetch_sample_data(currentStep: Process, to_fetch: dict) -> pd.DataFrame:
     In the dictionary "to_fetch":
     - Dict keys will be the column names in the returned df
     - Dict items are either...
-       1) an expression to be evaulated to fetch the info
+       1) an accessor expression, starting with "art_tuple", to fetch the info
        2) the name of a UDF to fetch recursively
 
     Examples of dictionary contents:
     to_fetch = {
-        "vol"   : "art_tuple[0]['uri'].udf['Final Volume (uL)']",       # Eval string
-        "conc"  : "art_tuple[0]['uri'].udf['Final Concentration']",     # Eval string
+        "vol"   : "art_tuple[0]['uri'].udf['Final Volume (uL)']",       # Accessor expression
+        "conc"  : "art_tuple[0]['uri'].udf['Final Concentration']",     # Accessor expression
         "size"  : 'Size (bp)'                                           # UDF name, to fetch recursively
     }
+
+    Accessor expressions are compiled once and the required artifacts, containers and
+    samples are fetched in batch, rather than one request per row.
     """
 
+    # Compile accessor expressions, keep recursive UDF names
+    accessors = {
+        col_name: compile_accessor(udf_query)
+        for col_name, udf_query in to_fetch.items()
+        if "art_tuple" in udf_query
+    }
+    recursive_udfs = {
+        col_name: udf_query
+        for col_name, udf_query in to_fetch.items()
+        if col_name not in accessors
+    }
+
+    # Fetch all artifacts of the step in a single batch call
+    lims = currentStep.lims
+    io_arts = [
+        io["uri"]
+        for art_tuple in currentStep.input_output_maps
+        for io in art_tuple
+        if io
+    ]
+    lims.get_batch(list({art.id: art for art in io_arts}.values()))
+
     # Fetch all input/output sample tuples
     art_tuples = [
         art_tuple
@@ -103,26 +136,83 @@ def fetch_sample_data(currentStep: Process, to_fetch: dict) -> pd.DataFrame:
         if art_tuple[0]["uri"].type == art_tuple[1]["uri"].type == "Analyte"
     ]
 
-    # Fetch all target data
-    rows = []
-    for art_tuple in art_tuples:
-        row = {}
-        for col_name, udf_query in to_fetch.items():
-            if "art_tuple" in udf_query:
-                try:
-                    row[col_name] = eval(udf_query)
-                except KeyError:
-                    row[col_name] = None
-            else:
-                row[col_name] = fetch_last(currentStep, art_tuple, udf_query)
-        rows.append(row)
+    # Fetch the containers and samples referenced by the accessors in batch
+    arts = [io["uri"] for art_tuple in art_tuples for io in art_tuple]
+    for attr, get_entity in [
+        ("location", lambda art: art.location[0] if art.location else None),
+        ("samples", lambda art: art.samples[0]),
+    ]:
+        if any(attr in udf_query for udf_query in to_fetch.values()):
+            entities = {entity.id: entity for entity in map(get_entity, arts) if entity}
+            lims.get_batch(list(entities.values()))
+
+    # Fetch all target data, column by column
+    columns: dict[str, list] = {col_name: [] for col_name in to_fetch}
+    for col_name, accessor in accessors.items():
+        for art_tuple in art_tuples:
+            try:
+                columns[col_name].append(accessor(art_tuple))
+            except KeyError:
+                columns[col_name].append(None)
+
+    # Resolve all recursive UDFs in one lineage pass
+    if recursive_udfs:
+        recursive_values = fetch_last_batch(currentStep, art_tuples, recursive_udfs)
+        for col_name, udf_query in recursive_udfs.items():
+            for art_tuple, values in zip(art_tuples, recursive_values):
+                if col_name not in values:
+                    raise AssertionError(
+                        f"Could not find matching UDF(s) [{udf_query}] for artifact tuple {art_tuple}"
+                    )
+                columns[col_name].append(values[col_name][0])
 
     # Transform to dataframe
-    df = pd.DataFrame(rows)
+    df = pd.DataFrame(columns)
 
     return df
 
 
+def compile_accessor(expression: str):
+    """
+    Compile an accessor expression such as "art_tuple[0]['uri'].udf['Volume (ul)']"
+    into a function taking an I/O tuple, without evaluating arbitrary code.
+
+    Supported are item lookups using integers or quoted strings and attribute lookups.
+    """
+
+    token_pattern = re.compile(
+        r"""\[\s*(?P<int>-?\d+)\s*\]"""
+        r"""|\[\s*(?P<quote>['"])(?P<str>.*?)(?P=quote)\s*\]"""
+        r"""|\.(?P<attr>[A-Za-z_]\w*)"""
+    )
+
+    assert expression.startswith("art_tuple"), f"Invalid accessor '{expression}'"
+
+    steps: list[tuple[bool, str | int]] = []
+    pos = len("art_tuple")
+    while pos < len(expression):
+        match = token_pattern.match(expression, pos)
+        if not match:
+            raise AssertionError(
+                f"Invalid accessor '{expression}' at position {pos}: '{expression[pos:]}'"
+            )
+        if match.group("int") is not None:
+            steps.append((False, int(match.group("int"))))
+        elif match.group("str") is not None:
+            steps.append((False, match.group("str")))
+        else:
+            steps.append((True, match.group("attr")))
+        pos = match.end()
+
+    def accessor(art_tuple):
+        value = art_tuple
+        for is_attr, key in steps:
+            value = getattr(value, key) if is_attr else value[key]
+        return value
+
+    return accessor
+
+
 def format_worklist(df, deck):
     """
     - Add columns in Mosquito-intepretable format
@@ -198,8 +288,40 @@ def format_worklist(df, deck):
     return df_split
 
 
-class VolumeOverflow(Exception):
-    pass
+class BufferPlate:
+    """Column-wise allocation of buffer wells in a 96-well buffer plate.
+
+    A single buffer plate is shared by all worklists of a run, so that each worklist
+    continues where the previous one left off, instead of draining the same wells again.
+    """
+
+    def __init__(self, well_dead_vol=5, well_max_vol=180):
+        self.well_dead_vol = well_dead_vol
+        self.well_max_vol = well_max_vol
+        self.well_iter = iter(PLATE_96.ordered_names("col"))
+        # Start at first well
+        self.current_well = self._next_well()
+        self.current_well_vol = well_dead_vol
+
+    def _next_well(self):
+        try:
+            return next(self.well_iter)
+        except StopIteration:
+            raise AssertionError("Total buffer volume exceeds plate capacity.")
+
+    def allocate(self, vol_to_add):
+        """Return the buffer well to take the given volume from."""
+        # TODO support switching buffer wells in the middle of subtransfer block
+        if self.current_well_vol + vol_to_add > self.well_max_vol:
+            # Start on the next well
+            self.current_well = self._next_well()
+            self.current_well_vol = self.well_dead_vol
+
+        self.current_well_vol += vol_to_add
+        return self.current_well
+
+    def fill_comment(self):
+        return f"Fill up the buffer plate column-wise up to well {self.current_well} with {self.well_max_vol} uL buffer."
 
 
 def resolve_buffer_transfers(
@@ -209,10 +331,15 @@ def resolve_buffer_transfers(
     well_dead_vol=5,
     well_max_vol=180,
     zika_max_vol=5,
+    buffer_plate=None,
 ):
     """
     Melt buffer and sample information onto separate rows to
     produce a "one row <-> one transfer" dataframe.
+
+    If a BufferPlate is given, buffer wells are allocated from it and the caller is
+    responsible for commenting how to fill the plate. Otherwise a new plate is used
+    and the fill-up instruction is appended to the worklist comments.
     """
 
     # Pivot buffer transfers
@@ -227,9 +354,7 @@ def resolve_buffer_transfers(
     )
 
     # Sort df
-    split_dst_well = df.dst_well.str.split(":", expand=True)
-    df["dst_well_row"] = split_dst_well[0]
-    df["dst_well_col"] = split_dst_well[1].apply(int)
+    df["dst_well_row"], df["dst_well_col"] = PLATE_384.rowcol(df.dst_well)
 
     df.sort_values(by=["src_type", "dst_well_col", "dst_well_row"], inplace=True)
 
@@ -250,40 +375,21 @@ def resolve_buffer_transfers(
         ].apply(lambda x: x[0:-1] + "1")
 
     elif buffer_strategy == "adaptive":
-        # Make well iterator
-        wells = []
-        for col in range(1, 13):
-            for row in list("ABCDEFGH"):
-                wells.append(f"{row}:{col}")
-        well_iter = iter(wells)
+        comment_fill = buffer_plate is None
+        if buffer_plate is None:
+            buffer_plate = BufferPlate(well_dead_vol, well_max_vol)
 
         # Start "filling up" buffer wells based on transfer list
-        try:
-            # Start at first well
-            current_well = next(well_iter)
-            current_well_vol = well_dead_vol
-
-            for idx, row in df[df.src_type == "buffer"].iterrows():
-                # How many subtransfers will be needed?
-                n_transfers = (row.transfer_vol // zika_max_vol) + 1
-                # Estimate 0.2 ul loss per transfer due to overaspiration
-                vol_to_add = row.transfer_vol + 0.2 * n_transfers
+        for idx, row in df[df.src_type == "buffer"].iterrows():
+            # How many subtransfers will be needed?
+            n_transfers = (row.transfer_vol // zika_max_vol) + 1
+            # Estimate 0.2 ul loss per transfer due to overaspiration
+            vol_to_add = row.transfer_vol + 0.2 * n_transfers
 
-                # TODO support switching buffer wells in the middle of subtransfer block
-                if current_well_vol + vol_to_add > well_max_vol:
-                    # Start on the next well
-                    current_well = next(well_iter)
-                    current_well_vol = well_dead_vol
+            df.loc[idx, "src_well"] = buffer_plate.allocate(vol_to_add)
 
-                current_well_vol += vol_to_add
-                df.loc[idx, "src_well"] = current_well
-
-        except StopIteration:
-            raise AssertionError("Total buffer volume exceeds plate capacity.")
-
-        wl_comments.append(
-            f"Fill up the buffer plate column-wise up to well {current_well} with {well_max_vol} uL buffer."
-        )
+        if comment_fill:
+            wl_comments.append(buffer_plate.fill_comment())
 
     else:
         raise Exception("No buffer strategy defined")
@@ -295,19 +401,52 @@ def well2rowcol(well_iter):
     """
     Translates iterable of well names to list of row/column integer tuples to specify
     well location in Mosquito worklists.
+
+    Row letters are not limited to A-H, so that 384-well plates (A-P) are supported.
+    All well names are translated at once, using the precomputed 384-well plate geometry.
     """
 
     # In an advanced worklist: startcol, endcol, row
-    rows = []
-    cols = []
-    for well in well_iter:
-        [row_letter, col_number] = str.split(well, sep=":")
-        rowdict = {}
-        for l, n in zip("ABCDEFGH", "12345678"):
-            rowdict[l] = n
-        rows.append(int(rowdict[row_letter]))
-        cols.append(int(col_number))
-    return rows, cols
+    rows, cols = PLATE_384.rowcol(pd.Series(well_iter, dtype=object).str.upper())
+    return rows.tolist(), cols.tolist()
+
+
+def partition_transfers(df, buffer_plate=False):
+    """
+    Partition transfers into deck-feasible chunks, each of which can be run as one worklist.
+
+    The Mosquito deck has five positions. Each chunk gets a single destination plate at position 3,
+    the buffer plate at position 4 (if used) and as many source plates as fit on the remaining positions.
+
+    Returns a list of (df, deck) tuples, where the deck is a dictionary mapping plate names to deck positions.
+    """
+
+    dst_pos = 3
+    buffer_pos = 4
+    # TODO assign deck positions to minimize travel distance
+    src_positions = [
+        pos for pos in [2, 4, 1, 5] if not (buffer_plate and pos == buffer_pos)
+    ]
+
+    partitions = []
+    for dst_name in df.dst_name.unique():
+        df_dst = df[df.dst_name == dst_name]
+        # Samples already in the destination plate need no extra position
+        src_names = [name for name in df_dst.src_name.unique() if name != dst_name]
+
+        for i in range(0, max(len(src_names), 1), len(src_positions)):
+            chunk = src_names[i : i + len(src_positions)]
+            deck = {dst_name: dst_pos}
+            if buffer_plate:
+                deck["buffer_plate"] = buffer_pos
+            for plate, pos in zip(chunk, src_positions):
+                deck[plate] = pos
+
+            partitions.append(
+                (df_dst[df_dst.src_name.isin(chunk + [dst_name])].copy(), deck)
+            )
+
+    return partitions
 
 
 def get_filenames(method_name, pid):
@@ -319,9 +458,42 @@ def get_filenames(method_name, pid):
     return wl_filename, log_filename
 
 
-def write_worklist(df, deck, wl_filename, comments=None, max_transfers_per_tip=10):
+def render_worklists(worklists, wl_filename):
     """
-    Write a Mosquito-interpretable advanced worklist.
+    Render one or more worklists, supplied as a list of (df, deck, comments) tuples.
+
+    A single worklist is rendered as CSV text. Multiple worklists are numbered and
+    bundled into an in-memory zip archive, so they can be uploaded together.
+
+    Returns a tuple of the name of the file to upload and its contents.
+    """
+
+    if len(worklists) == 1:
+        df, deck, comments = worklists[0]
+        content = render_worklist(
+            df=df, deck=deck, wl_filename=wl_filename, comments=comments
+        )
+        return wl_filename, content
+
+    zip_filename = wl_filename.replace(".csv", ".zip")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for i, (df, deck, comments) in enumerate(worklists, start=1):
+            part_filename = wl_filename.replace(".csv", f"_{i}of{len(worklists)}.csv")
+            content = render_worklist(
+                df=df,
+                deck=deck,
+                wl_filename=part_filename,
+                comments=[f"Worklist {i} of {len(worklists)}"] + (comments or []),
+            )
+            zf.writestr(part_filename, content)
+
+    return zip_filename, buffer.getvalue()
+
+
+def render_worklist(df, deck, wl_filename, comments=None, max_transfers_per_tip=10):
+    """
+    Render a Mosquito-interpretable advanced worklist and return it as a string.
     """
 
     # Replace all commas with semi-colons, so they can be printed without truncating the worklist
@@ -371,7 +543,7 @@ def write_worklist(df, deck, wl_filename, comments=None, max_transfers_per_tip=1
         df.loc[:, c] = df[c].apply(str)
 
     # Write worklist
-    with open(wl_filename, "w") as wl:
+    with io.StringIO() as wl:
         wl.write("worklist,\n")
 
         # Define variables
@@ -433,6 +605,8 @@ def write_worklist(df, deck, wl_filename, comments=None, max_transfers_per_tip=1
 
         wl.write("COMMENT, Done")
 
+        return wl.getvalue()
+
 
 def get_deck_comment(deck):
     """Convert the plate:position 'decktionary' into a worklist comment"""
@@ -449,22 +623,51 @@ def get_deck_comment(deck):
     return deck_comment
 
 
-def write_log(log, log_filename):
-    with open(log_filename, "w") as logContext:
-        logContext.write("\n".join(log))
+def render_log(log):
+    return "\n".join(log)
 
 
-def upload_log(currentStep, lims, log_filename):
-    for out in currentStep.all_outputs():
-        if out.name == "Mosquito Log":
-            for f in out.files:
-                lims.request_session.delete(f.uri)
-            lims.upload_new_file(out, log_filename)
+def upload_from_memory(lims, entity, filename, content):
+    """
+    Upload file contents held in memory and attach them to the provided entity.
+
+    The contents are written to a temporary file of the given name, which is uploaded
+    with Lims.upload_new_file.
+    """
+
+    mode = "w" if isinstance(content, str) else "wb"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, os.path.basename(filename))
+        with open(path, mode) as f:
+            f.write(content)
+        return lims.upload_new_file(entity, path)
 
 
-def upload_csv(currentStep, lims, wl_filename):
-    for out in currentStep.all_outputs():
-        if out.name == "Mosquito CSV File":
-            for f in out.files:
-                lims.request_session.delete(f.uri)
-            lims.upload_new_file(out, wl_filename)
+def upload_outputs(currentStep, lims, files):
+    """
+    Upload in-memory files to the step output slots of the same name.
+
+    The "files" dict maps output names, e.g. "Mosquito CSV File", to tuples of filename
+    and contents. Slots are resolved in a single pass over the step outputs, after which
+    any previous files are deleted and the new files uploaded concurrently.
+    """
+
+    slots = [out for out in currentStep.all_outputs() if out.name in files]
+    lims.get_batch(slots)
+
+    with ThreadPoolExecutor() as executor:
+        deletions = [
+            executor.submit(lims.request_session.delete, f.uri)
+            for out in slots
+            for f in out.files
+        ]
+        # Wait for the previous files to be deleted before uploading
+        for deletion in deletions:
+            deletion.result()
+
+        uploads = [
+            executor.submit(upload_from_memory, lims, out, *files[out.name])
+            for out in slots
+        ]
+        for upload in uploads:
+            upload.result()
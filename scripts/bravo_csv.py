@@ -1,11 +1,16 @@
 #!/usr/bin/env python
 
+import csv
+import io
+import json
 import logging
 import os
 import re
 import sys
+import time
 from argparse import ArgumentParser
 
+import numpy as np
 import pandas as pd
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
@@ -13,6 +18,7 @@ from genologics.lims import Lims
 
 from scilifelab_epps import zika
 from scilifelab_epps.epp import attach_file
+from scilifelab_epps.utils.dry_run import DryRun
 
 DESC = """EPP used to create csv files for the bravo robot"""
 
@@ -23,85 +29,151 @@ QPCR_DILUTION_VOLUME = 40
 # Three values are minimum required conc for setup workset, maximum conc for dilution and minimum volume for dilution
 Dilution_preset = {"Smarter pico": [1.25, 375.0, 10.0]}
 
+# Parsed normalization CSV files, keyed by file LIMS id
+NORMALIZATION_CACHE_DIR = os.path.expanduser(
+    "~/.cache/scilifelab_epps/bravo_normalization"
+)
+# Cached files not used for this long are removed
+NORMALIZATION_CACHE_MAX_AGE_DAYS = 90
+
 # Pre-compile regexes in global scope:
 IDX_PAT = re.compile("([ATCG]{4,})-?([ATCG]*)")
 TENX_PAT = re.compile("SI-GA-[A-H][1-9][0-2]?")
+RE_STAGE_WORKFLOW = re.compile("workflows/([0-9]+)/stages")
 
 
 def obtain_previous_volumes(currentStep, lims):
     samples_volumes = {}
-    re_well = re.compile("([A-H]):?0?([0-9]{1,2})")
-    previous_steps = set()
-    for input_artifact in currentStep.all_inputs():
-        previous_steps.add(input_artifact.parent_process)
-    for pp in previous_steps:
-        for output in pp.all_outputs():
-            if output.name == "EPP Generated Bravo CSV File for Normalization":
-                try:
-                    fid = output.files[0].id
-                except:
-                    raise RuntimeError(
-                        "Cannot access the normalisation CSV file to read the volumes."
-                    )
-                else:
-                    file_contents = lims.get_file_contents(id=fid)
-                    if isinstance(file_contents, bytes):
-                        file_contents = file_contents.decode("utf-8")
-                    genologics_format = False
-                    well_idx = 4
-                    plate_idx = 3
-                    source_vol_idx = 2
-                    buffer_vol_idx = 5
-                    for line in file_contents.split("\n"):
-                        # Skip some lines:
-                        if not line.rstrip():
-                            continue
-                        elif "Date of file generation:" in line:
-                            continue
-                        elif "Generated by:" in line:
-                            continue
-                        elif "Sample Name" in line:
-                            # This is Genologics format and the header line
-                            # so change column indices:
-                            genologics_format = True
-                            elements = line.split(",")
-                            for idx, el in enumerate(elements):
-                                if el == "Source Volume (uL)":
-                                    source_vol_idx = idx
-                                elif el == "Volume of Dilution Buffer (uL)":
-                                    buffer_vol_idx = idx
-                                elif el == "Destination Well":
-                                    well_idx = idx
-                                elif el == "Destination Plate":
-                                    plate_idx = idx
-                                elif el == "Sample Name":
-                                    name_idx = idx
-                        else:
-                            elements = line.split(",")
-                            well = elements[well_idx]
-                            matches = re_well.search(well)
-                            if matches:
-                                well = ":".join(x for x in matches.groups())
-                            plate = elements[plate_idx]
-                            srcvol = elements[source_vol_idx]
-                            bufvol = elements[buffer_vol_idx]
-                            # Remove any quotes:
-                            (plate, srcvol, bufvol) = (
-                                s.replace('"', "") for s in (plate, srcvol, bufvol)
-                            )
-                            srcvol = float(srcvol)
-                            bufvol = float(bufvol)
-                            totvol = bufvol
-                            # For Genologics format compability:
-                            if genologics_format:
-                                totvol += srcvol
-                                name = elements[name_idx].replace('"', "")
-                                samples_volumes[name] = totvol
-                            else:
-                                samples_volumes.setdefault(plate, {})[well] = totvol
+    # Scan the outputs of each unique parent process once
+    previous_steps = {
+        input_artifact.parent_process.id: input_artifact.parent_process
+        for input_artifact in currentStep.all_inputs(resolve=True)
+    }
+    outputs = [
+        output
+        for pp in previous_steps.values()
+        for output in pp.all_outputs(unique=True)
+    ]
+    lims.get_batch(outputs)
+    for output in outputs:
+        if output.name == "EPP Generated Bravo CSV File for Normalization":
+            try:
+                fid = output.files[0].id
+            except:
+                raise RuntimeError(
+                    "Cannot access the normalisation CSV file to read the volumes."
+                )
+            else:
+                for key, value in get_normalization_volumes(lims, fid).items():
+                    if isinstance(value, dict):
+                        samples_volumes.setdefault(key, {}).update(value)
+                    else:
+                        samples_volumes[key] = value
     return samples_volumes
 
 
+def get_normalization_volumes(lims, fid):
+    """Return the volumes of a normalization CSV file, cached locally by file LIMS id.
+
+    Files are immutable once uploaded, so a cached parsing result never goes stale.
+    """
+    cache_path = os.path.join(NORMALIZATION_CACHE_DIR, f"{fid}.json")
+    try:
+        with open(cache_path) as f:
+            volumes = json.load(f)
+        # Mark the entry as recently used, so that it is kept when pruning
+        os.utime(cache_path)
+        return volumes
+    except (OSError, ValueError):
+        pass
+
+    file_contents = lims.get_file_contents(id=fid)
+    if isinstance(file_contents, bytes):
+        file_contents = file_contents.decode("utf-8")
+    volumes = parse_normalization_csv(io.StringIO(file_contents))
+
+    # Write to a temporary file first, so that concurrent readers never see a partial cache
+    try:
+        os.makedirs(NORMALIZATION_CACHE_DIR, exist_ok=True)
+        with open(f"{cache_path}.{os.getpid()}.tmp", "w") as f:
+            json.dump(volumes, f)
+        os.replace(f"{cache_path}.{os.getpid()}.tmp", cache_path)
+    except OSError:
+        logging.warning(f"Unable to cache the normalization volumes of file {fid}")
+    else:
+        prune_normalization_cache()
+
+    return volumes
+
+
+def prune_normalization_cache():
+    """Remove cached normalization volumes that have not been used for a while."""
+    cutoff = time.time() - NORMALIZATION_CACHE_MAX_AGE_DAYS * 24 * 3600
+    for entry in os.scandir(NORMALIZATION_CACHE_DIR):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            # Removed by a concurrent run
+            pass
+
+
+def parse_normalization_csv(stream):
+    """Parse the volumes of a normalization CSV file from a text stream.
+
+    In the Genologics format, a header line gives the column indices and the volumes are
+    mapped by sample name. Otherwise the default column indices are used and the volumes
+    are mapped by destination plate and well.
+    """
+    volumes = {}
+    re_well = re.compile("([A-H]):?0?([0-9]{1,2})")
+    genologics_format = False
+    well_idx = 4
+    plate_idx = 3
+    source_vol_idx = 2
+    buffer_vol_idx = 5
+    for elements in csv.reader(stream):
+        line = ",".join(elements)
+        # Skip some lines:
+        if not line.rstrip():
+            continue
+        elif "Date of file generation:" in line:
+            continue
+        elif "Generated by:" in line:
+            continue
+        elif not genologics_format and "Sample Name" in line:
+            # This is Genologics format and the header line
+            # so change column indices:
+            genologics_format = True
+            for idx, el in enumerate(elements):
+                if el == "Source Volume (uL)":
+                    source_vol_idx = idx
+                elif el == "Volume of Dilution Buffer (uL)":
+                    buffer_vol_idx = idx
+                elif el == "Destination Well":
+                    well_idx = idx
+                elif el == "Destination Plate":
+                    plate_idx = idx
+                elif el == "Sample Name":
+                    name_idx = idx
+        else:
+            well = elements[well_idx]
+            matches = re_well.search(well)
+            if matches:
+                well = ":".join(x for x in matches.groups())
+            plate = elements[plate_idx]
+            srcvol = float(elements[source_vol_idx])
+            bufvol = float(elements[buffer_vol_idx])
+            totvol = bufvol
+            # For Genologics format compability:
+            if genologics_format:
+                totvol += srcvol
+                volumes[elements[name_idx]] = totvol
+            else:
+                volumes.setdefault(plate, {})[well] = totvol
+    return volumes
+
+
 def make_datastructure(currentStep, lims, log):
     data = []
     samples_volumes = {}
@@ -152,86 +224,104 @@ def make_datastructure(currentStep, lims, log):
     return data
 
 
-""" LAZY WAY
- Just divide the total with the number of samples, it is implied that the final
- conc and the conc of every input is the same:
-"""
-
-
-def lazy_volumes(samples, final_vol):
-    return [final_vol / len(samples) for s in samples]
-
-
-""" OTHER WAY
- Iteratively reduce the smallest input volume until we are close to the desired
- total volume. This works when the inputs have different concentrations, the
- final pool concentration will then end up somewhere between the conc of the
- highest and the lowest input concentration:
-"""
-
-
-def optimize_volumes(samples, final_vol, limit_vol=2):
-    # Create a list we can sort to get the min/max values:
-    l = [(s["conc"] * s["vol"], s["conc"], s["vol"]) for s in samples]
-    # Find the min/max values by sorting on the different values:
-    max_conc = sorted(l, key=lambda x: x[1])[-1][1]
-    min_vol = sorted(l, key=lambda x: x[2])[0][2]
-    # The volume of the input with lowest amount:
-    min_amount = sorted(l)[0][2]
+def pool_volumes(df, final_vols, limit_vol=2):
+    """Compute the volume to take of each input, for all pools at once.
+
+    The rows of "df" are inputs with the columns "pool_id", "conc" and "vol", and
+    "final_vols" maps pool ids to the desired final pool volume.
+
+    LAZY WAY
+    If all inputs of a pool have the same conc, just divide the final volume with the
+    number of inputs.
+
+    OTHER WAY
+    Take a volume u of the input with the highest conc and u * max_conc / conc of the
+    others, so that the amount of each input is the same. The final pool conc will then
+    end up somewhere between the conc of the highest and the lowest input concentration.
+
+    Reducing u lowers the total pool volume u * max_conc * sum(1 / conc), and u is also
+    the lowest volume pipetted. It is therefore minimized analytically as
+
+        u = max(limit_vol, final_vol / (max_conc * sum(1 / conc)))
+
+    i.e. the lowest volume that pipettes at least limit_vol and keeps the total pool
+    volume at least final_vol. As before, u never exceeds the starting volume: the
+    smallest volume of any input or, if lower, the volume of the input with the lowest
+    amount.
+
+    This replaces a search reducing u by 10% steps, which stopped at up to 10% above
+    the optimum. See benchmarks/bravo_pooling_benchmark.py for the comparison.
+    """
+    df = df[["pool_id", "conc", "vol"]].copy()
+    df["final_vol"] = df.pool_id.map(final_vols)
+    df["amount"] = df.conc * df.vol
+    df["inv_conc"] = 1 / df.conc
+
+    # Single grouping pass over all pools
+    g = df.groupby("pool_id", sort=False)
+    n_inputs = g.conc.transform("size")
+    is_even = g.conc.transform("nunique") == 1
+    max_conc = g.conc.transform("max")
+    min_vol = g.vol.transform("min")
+    sum_inv_conc = g.inv_conc.transform("sum")
+    # The volume of the input with lowest amount, ties broken by conc and vol
+    min_amount_vol = df.pool_id.map(
+        df.sort_values(["amount", "conc", "vol"])
+        .groupby("pool_id", sort=False)
+        .vol.first()
+    )
 
-    def _minimize_vol(vol, final_vol=final_vol, limit_vol=limit_vol, reduce=0.9):
-        try_vol = reduce * vol
-        # The lowest volume to take would then be (sample(s) w highest conc):
-        low_vol = min(try_vol * max_conc / s["conc"] for s in samples)
-        # Total pool volume if we were to take this amount of all samples:
-        tot_vol = sum(try_vol * max_conc / s["conc"] for s in samples)
-        # We don't want to pipette less than limit_vol
-        # while keeping total volume above final_vol:
-        if low_vol >= limit_vol and tot_vol >= final_vol and try_vol >= limit_vol:
-            return _minimize_vol(try_vol)
-        else:
-            # We can't improve anymore within the given limits...
-            return vol
+    start_vol = np.minimum(min_amount_vol, min_vol)
+    use_vol = np.minimum(
+        start_vol, np.maximum(limit_vol, df.final_vol / (max_conc * sum_inv_conc))
+    )
 
-    # Start from whichever is the smallest volume:
-    use_vol = _minimize_vol(min(min_amount, min_vol))
-    # Calculate the volume to take of each input:
-    return [(use_vol * max_conc / s["conc"]) for s in samples]
+    return pd.Series(
+        np.where(
+            is_even,
+            df.final_vol / n_inputs,
+            use_vol * max_conc / df.conc,
+        ),
+        index=df.index,
+    )
 
 
 def compute_transfer_volume(currentStep, lims, log):
     data = make_datastructure(currentStep, lims, log)
+    pools = [
+        pool for pool in currentStep.all_outputs(resolve=True) if pool.type == "Analyte"
+    ]
+
+    df = pd.DataFrame(data)
+    df["vol_to_take"] = pool_volumes(
+        df,
+        # Get the "desired" pool volume, which is which?
+        {pool.id: float(pool.udf["Final Volume (uL)"]) for pool in pools},
+        MIN_WARNING_VOLUME,
+    )
+    pool_dfs = dict(list(df.groupby("pool_id", sort=False)))
+
     returndata = []
-    for pool in currentStep.all_outputs():
-        if pool.type == "Analyte":
-            valid_inputs = [x for x in data if x["pool_id"] == pool.id]
-            # Set the output conc of the pool and also get the "desired" pool
-            # volume, which is which?
-            final_vol = float(pool.udf["Final Volume (uL)"])
-            conc = valid_inputs[0]["conc"]
-            # If all inputs are of the same conc use the trivial algorithm,
-            # else try to optimize:
-            if all(s["conc"] == conc for s in valid_inputs):
-                vols = lazy_volumes(valid_inputs, final_vol)
-                if sum(vols) > MAX_WARNING_VOLUME:
-                    log.append(
-                        f"ERROR: Total volume of pool {pool.name} is too high: {sum(vols)}. Redo the calculations manually!"
-                    )
-                pool.udf["Normalized conc. (nM)"] = conc
-            else:
-                vols = optimize_volumes(valid_inputs, final_vol, MIN_WARNING_VOLUME)
-                # Calculate and add the theoretical pool conc:
-                if sum(vols) > MAX_WARNING_VOLUME:
-                    log.append(
-                        f"ERROR: Total volume of pool {pool.name} is too high: {sum(vols)}. Redo the calculations manually!"
-                    )
-                z = list(zip([s["conc"] for s in valid_inputs], vols))
-                v = sum(x[0] * x[1] for x in z) / sum(vols)
-                pool.udf["Normalized conc. (nM)"] = v
-            pool.put()
-            for s, vol in zip(valid_inputs, vols):
-                s["vol_to_take"] = vol
-                returndata.append(s)
+    for pool in pools:
+        df_pool = pool_dfs[pool.id]
+        vols = [float(vol) for vol in df_pool.vol_to_take]
+        if sum(vols) > MAX_WARNING_VOLUME:
+            log.append(
+                f"ERROR: Total volume of pool {pool.name} is too high: {sum(vols)}. Redo the calculations manually!"
+            )
+        # Set the output conc of the pool
+        conc = float(df_pool.conc.iloc[0])
+        if (df_pool.conc == conc).all():
+            pool.udf["Normalized conc. (nM)"] = conc
+        else:
+            # Calculate and add the theoretical pool conc:
+            z = list(zip(df_pool.conc, vols))
+            v = sum(float(x[0]) * x[1] for x in z) / sum(vols)
+            pool.udf["Normalized conc. (nM)"] = v
+        pool.put()
+        for i, vol in zip(df_pool.index, vols):
+            data[i]["vol_to_take"] = vol
+            returndata.append(data[i])
 
     return returndata
 
@@ -418,63 +508,34 @@ def default_bravo(lims, currentStep, with_total_vol=True):
     else:
         checkTheLog = [False]
         dest_plate = []
+        # Load all artifacts of the step in one batch, then filter out result files
+        lims.get_batch(
+            list(
+                {
+                    art["uri"]
+                    for art_tuple in currentStep.input_output_maps
+                    for art in art_tuple
+                }
+            )
+        )
+        art_tuples = [
+            art_tuple
+            for art_tuple in currentStep.input_output_maps
+            if art_tuple[0]["uri"].type == "Analyte"
+            and art_tuple[1]["uri"].type == "Analyte"
+        ]
+        prefetched = prefetch_calc_vol_data(lims, art_tuples)
         with open("bravo.csv", "w") as csvContext:
             with open("bravo.log", "w") as logContext:
-                # working directly with the map allows easier input/output handling
-                for art_tuple in currentStep.input_output_maps:
-                    # filter out result files
-                    if (
-                        art_tuple[0]["uri"].type == "Analyte"
-                        and art_tuple[1]["uri"].type == "Analyte"
-                    ):
-                        source_fc = art_tuple[0]["uri"].location[0].name
-                        source_well = art_tuple[0]["uri"].location[1]
-                        dest_fc = art_tuple[1]["uri"].location[0].id
-                        dest_well = art_tuple[1]["uri"].location[1]
-                        dest_fc_name = art_tuple[1]["uri"].location[0].name
-                        dest_plate.append(dest_fc_name)
-                        if with_total_vol:
-                            if art_tuple[1]["uri"].udf.get("Total Volume (uL)"):
-                                (
-                                    art_workflows,
-                                    volume,
-                                    final_volume,
-                                    amount_for_prep,
-                                    amount_taken_from_plate,
-                                    total_volume,
-                                ) = calc_vol(art_tuple, logContext, checkTheLog)
-                                # Update Amount for prep (ng), Total Volume (uL) and Amount taken from plate (ng) in LIMS
-                                if not any(
-                                    x == "#ERROR#"
-                                    for x in [
-                                        volume,
-                                        final_volume,
-                                        amount_for_prep,
-                                        amount_taken_from_plate,
-                                        total_volume,
-                                    ]
-                                ):
-                                    art_tuple[1]["uri"].udf["Amount for prep (ng)"] = (
-                                        float(amount_for_prep)
-                                    )
-                                    art_tuple[1]["uri"].udf["Total Volume (uL)"] = (
-                                        float(final_volume)
-                                    )
-                                    art_tuple[1]["uri"].udf[
-                                        "Amount taken from plate (ng)"
-                                    ] = float(amount_taken_from_plate)
-                                    art_tuple[1]["uri"].put()
-                                csvContext.write(
-                                    f"{source_fc},{source_well},{volume},{dest_fc},{dest_well},{final_volume}\n"
-                                )
-                            else:
-                                logContext.write(
-                                    "No Total Volume found for sample {}\n".format(
-                                        art_tuple[0]["uri"].samples[0].name
-                                    )
-                                )
-                                checkTheLog[0] = True
-                        else:
+                for art_tuple in art_tuples:
+                    source_fc = art_tuple[0]["uri"].location[0].name
+                    source_well = art_tuple[0]["uri"].location[1]
+                    dest_fc = art_tuple[1]["uri"].location[0].id
+                    dest_well = art_tuple[1]["uri"].location[1]
+                    dest_fc_name = art_tuple[1]["uri"].location[0].name
+                    dest_plate.append(dest_fc_name)
+                    if with_total_vol:
+                        if art_tuple[1]["uri"].udf.get("Total Volume (uL)"):
                             (
                                 art_workflows,
                                 volume,
@@ -482,10 +543,60 @@ def default_bravo(lims, currentStep, with_total_vol=True):
                                 amount_for_prep,
                                 amount_taken_from_plate,
                                 total_volume,
-                            ) = calc_vol(art_tuple, logContext, checkTheLog)
+                            ) = calc_vol(
+                                art_tuple,
+                                logContext,
+                                checkTheLog,
+                                prefetched[art_tuple[0]["uri"].id],
+                            )
+                            # Update Amount for prep (ng), Total Volume (uL) and Amount taken from plate (ng) in LIMS
+                            if not any(
+                                x == "#ERROR#"
+                                for x in [
+                                    volume,
+                                    final_volume,
+                                    amount_for_prep,
+                                    amount_taken_from_plate,
+                                    total_volume,
+                                ]
+                            ):
+                                art_tuple[1]["uri"].udf["Amount for prep (ng)"] = float(
+                                    amount_for_prep
+                                )
+                                art_tuple[1]["uri"].udf["Total Volume (uL)"] = float(
+                                    final_volume
+                                )
+                                art_tuple[1]["uri"].udf[
+                                    "Amount taken from plate (ng)"
+                                ] = float(amount_taken_from_plate)
+                                art_tuple[1]["uri"].put()
                             csvContext.write(
-                                f"{source_fc},{source_well},{volume},{dest_fc},{dest_well}\n"
+                                f"{source_fc},{source_well},{volume},{dest_fc},{dest_well},{final_volume}\n"
                             )
+                        else:
+                            logContext.write(
+                                "No Total Volume found for sample {}\n".format(
+                                    art_tuple[0]["uri"].samples[0].name
+                                )
+                            )
+                            checkTheLog[0] = True
+                    else:
+                        (
+                            art_workflows,
+                            volume,
+                            final_volume,
+                            amount_for_prep,
+                            amount_taken_from_plate,
+                            total_volume,
+                        ) = calc_vol(
+                            art_tuple,
+                            logContext,
+                            checkTheLog,
+                            prefetched[art_tuple[0]["uri"].id],
+                        )
+                        csvContext.write(
+                            f"{source_fc},{source_well},{volume},{dest_fc},{dest_well}\n"
+                        )
 
         df = pd.read_csv("bravo.csv", header=None)
         df["dest_row"] = df.apply(lambda row: row[4].split(":")[0], axis=1)
@@ -1048,12 +1159,69 @@ def main(lims, args):
         default_bravo(lims, currentStep)
 
 
-def calc_vol(art_tuple, logContext, checkTheLog):
-    # Fetch workflow name
-    art_workflows = []
-    for stage in art_tuple[0]["uri"].workflow_stages_and_statuses:
-        if stage[1] == "IN_PROGRESS":
-            art_workflows.append(stage[0].workflow.name)
+def get_workflow_names(lims):
+    """Return a dict mapping workflow ids to names, fetched from a single listing."""
+    workflow_names = {}
+    root = lims.get(lims.get_uri("configuration", "workflows"))
+    while True:
+        for node in root.findall("workflow"):
+            workflow_id = node.attrib["uri"].rstrip("/").split("/")[-1]
+            workflow_names[workflow_id] = node.attrib["name"]
+        next_page = root.find("next-page")
+        if next_page is None:
+            break
+        root = lims.get(next_page.attrib["uri"])
+    return workflow_names
+
+
+def prefetch_calc_vol_data(lims, art_tuples):
+    """Fetch all data needed by calc_vol for a list of input-output tuples in batches.
+
+    Returns a dict mapping input artifact ids to the names of their in-progress workflows
+    and the type name of their parent process.
+    """
+    inputs = list(dict.fromkeys(art_tuple[0]["uri"] for art_tuple in art_tuples))
+    outputs = list(dict.fromkeys(art_tuple[1]["uri"] for art_tuple in art_tuples))
+    lims.get_batch(inputs + outputs)
+    lims.get_batch(
+        list(
+            {art.location[0] for art in inputs + outputs if art.location[0] is not None}
+        )
+    )
+    lims.get_batch(list({art.samples[0] for art in outputs}))
+
+    workflow_names = None
+    process_type_names = {}
+    prefetched = {}
+    for art in inputs:
+        art_workflows = []
+        for stage in art.workflow_stages_and_statuses:
+            if stage[1] == "IN_PROGRESS":
+                workflow_id = RE_STAGE_WORKFLOW.search(stage[0].uri).group(1)
+                if workflow_names is None:
+                    workflow_names = get_workflow_names(lims)
+                if workflow_id not in workflow_names:
+                    workflow_names[workflow_id] = stage[0].workflow.name
+                art_workflows.append(workflow_names[workflow_id])
+
+        if art.parent_process is None:
+            parent_process_type = None
+        else:
+            if art.parent_process.id not in process_type_names:
+                process_type_names[art.parent_process.id] = art.parent_process.type.name
+            parent_process_type = process_type_names[art.parent_process.id]
+
+        prefetched[art.id] = {
+            "workflows": art_workflows,
+            "parent_process_type": parent_process_type,
+        }
+
+    return prefetched
+
+
+def calc_vol(art_tuple, logContext, checkTheLog, prefetched):
+    """Calculate the volumes of a dilution, using data from prefetch_calc_vol_data."""
+    art_workflows = prefetched["workflows"]
     try:
         # not handling different units yet. Might be needed at some point.
         assert art_tuple[0]["uri"].udf["Conc. Units"] in ["ng/ul", "ng/uL"]
@@ -1071,14 +1239,10 @@ def calc_vol(art_tuple, logContext, checkTheLog):
                 f"NOTE! Total dilution volume higher than {MAX_WARNING_VOLUME}!"
             )
 
-        try:
-            if art_tuple[0]["uri"].parent_process.type.name == "Diluting Samples":
-                conc = art_tuple[0]["uri"].udf["Final Concentration"]
-                org_vol = art_tuple[0]["uri"].udf["Final Volume (uL)"]
-            else:
-                conc = art_tuple[0]["uri"].udf["Concentration"]
-                org_vol = art_tuple[0]["uri"].udf["Volume (ul)"]
-        except AttributeError:
+        if prefetched["parent_process_type"] == "Diluting Samples":
+            conc = art_tuple[0]["uri"].udf["Final Concentration"]
+            org_vol = art_tuple[0]["uri"].udf["Final Volume (uL)"]
+        else:
             conc = art_tuple[0]["uri"].udf["Concentration"]
             org_vol = art_tuple[0]["uri"].udf["Volume (ul)"]
         volume = float(amount_for_prep) / float(conc)
@@ -1242,8 +1406,21 @@ def find_barcode(artifact):
 if __name__ == "__main__":
     parser = ArgumentParser(description=DESC)
     parser.add_argument("--pid", help="Lims id for current Process")
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Run against the step without writing to LIMS, and report the requests made",
+    )
     args = parser.parse_args()
 
     lims = Lims(BASEURI, USERNAME, PASSWORD)
     lims.check_version()
-    main(lims, args)
+    if args.dry_run:
+        dry_run = DryRun(lims)
+        try:
+            with dry_run:
+                main(lims, args)
+        finally:
+            print(dry_run.report())
+    else:
+        main(lims, args)
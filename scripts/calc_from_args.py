@@ -1,5 +1,7 @@
 #!/usr/bin/env python
-from argparse import ArgumentParser
+import logging
+from argparse import ArgumentParser, Namespace
+from contextlib import nullcontext
 from datetime import datetime as dt
 
 from genologics.config import BASEURI, PASSWORD, USERNAME
@@ -7,6 +9,8 @@ from genologics.entities import Process
 from genologics.lims import Lims
 
 from scilifelab_epps.calc_from_args import calculation_methods
+from scilifelab_epps.utils.dry_run import DryRun
+from scilifelab_epps.utils.udf_tools import StepSnapshot
 from scilifelab_epps.wrapper import epp_decorator
 
 DESC = """UDF-agnostic script to perform calculations across all artifacts of a step.
@@ -14,12 +18,26 @@ DESC = """UDF-agnostic script to perform calculations across all artifacts of a
 The script is written with the intention of reusability,
 so the script arguments specify which UDFs to use and
 from where their values should be fetched.
+
+Several calculations can be run in order by a single invocation,
+sharing one in-memory snapshot of the step.
 """
 
 TIMESTAMP: str = dt.now().strftime("%y%m%d_%H%M%S")
 
+# UDFs to use for calculations
+UDF_ARGS: list[str] = [
+    "vol_in",
+    "size_in",
+    "conc_in",
+    "conc_units_in",
+    "amt_out",
+    "vol_out",
+    "size_out",
+]
+
 
-def parse_udf_arg(arg_string: str) -> dict:
+def parse_udf_arg(arg_string: str) -> dict | None:
     """Parse UDF argument string into a dictionary.
 
     Example:
@@ -37,7 +55,12 @@ def parse_udf_arg(arg_string: str) -> dict:
             }
 
     The keys "source" and "recursive" have default values "output" and False respectively.
+
+    The argument string "None" leaves the argument unset, e.g. for one of several calculations.
     """
+    if arg_string == "None":
+        return None
+
     kv_pairs: list[str] = arg_string.split(",")
 
     arg_dict: dict[str, str | bool] = {}
@@ -67,6 +90,27 @@ def parse_udf_arg(arg_string: str) -> dict:
     return arg_dict
 
 
+def get_calc_args(args: Namespace, udf_args: list[str]) -> list[Namespace]:
+    """Split the script arguments into one namespace per calculation.
+
+    Each UDF argument is given either once, to be used by all calculations,
+    or once per calculation, in the same order as the calculations.
+    """
+    calc_args = [Namespace(**vars(args)) for _ in args.calc]
+
+    for i, calc in enumerate(args.calc):
+        calc_args[i].calc = calc
+        for udf_arg in udf_args:
+            values = getattr(args, udf_arg) or [None]
+            assert len(values) in (
+                1,
+                len(args.calc),
+            ), f"Argument '--{udf_arg}' must be given once or once per calculation."
+            setattr(calc_args[i], udf_arg, values[0] if len(values) == 1 else values[i])
+
+    return calc_args
+
+
 @epp_decorator(script_path=__file__, timestamp=TIMESTAMP)
 def main(args):
     f"""Set up log, LIMS instance and parse args.
@@ -119,14 +163,44 @@ def main(args):
         --amt_out       udf='Amount (fmol)' \
         --vol_out       udf='Total Volume (uL)'
 
+    Example 5, running several calculations in order, with UDF args given once or per calculation:
+
+        python {__file__} \
+        --pid		    '24-885762' \
+        --calc          'amount' 'volume_to_use' \
+        --log           'Calculate input volume log' \
+        --vol_in        udf='Volume (ul)',source='input' \
+        --conc_in       udf='Concentration',source='input' \
+        --conc_units_in udf='Conc. Units',source='input' \
+        --size_in       udf='Size (bp)',source='output',recursive=True \
+        --amt_out       udf='Amount (fmol)',source='input' udf='Input Amount (fmol)' \
+        --vol_out       None udf='Input Volume (uL)'
+
     """
 
     # Set up LIMS
     lims = Lims(BASEURI, USERNAME, PASSWORD)
     process = Process(lims, id=args.pid)
 
-    function_to_use = getattr(calculation_methods, args.calc)
-    function_to_use(process, args)
+    calc_args = get_calc_args(args, UDF_ARGS)
+
+    # During a dry run, all writes are captured instead of sent
+    with DryRun(lims) if args.dry_run else nullcontext() as dry_run:
+        # Writes are staged in the snapshot and flushed once all calculations are done
+        with StepSnapshot(process):
+            for i, calc_arg in enumerate(calc_args):
+                if len(calc_args) > 1:
+                    logging.info("")
+                    logging.info(
+                        f"Running calculation '{calc_arg.calc}' ({i + 1}/{len(calc_args)})..."
+                    )
+                function_to_use = getattr(calculation_methods, calc_arg.calc)
+                with DryRun.phase(f"Calculation '{calc_arg.calc}'"):
+                    function_to_use(process, calc_arg)
+
+    if dry_run:
+        logging.info("")
+        logging.info(dry_run.report())
 
 
 if __name__ == "__main__":
@@ -136,23 +210,20 @@ if __name__ == "__main__":
     parser.add_argument(
         "--calc",
         type=str,
+        nargs="+",
         choices=["volume_to_use", "amount", "equimolar_pooling", "summarize_pooling"],
-        help="Which function to use for calculations",
+        help="Which function(s) to use for calculations, run in the given order",
     )
     parser.add_argument("--log", type=str, help="Which log file slot to use")
+    parser.add_argument(
+        "--dry_run",
+        action="store_true",
+        help="Run against the step without writing to LIMS, and report the requests made",
+    )
 
-    # UDFs to use for calculations
-    udf_args = [
-        "vol_in",
-        "size_in",
-        "conc_in",
-        "conc_units_in",
-        "amt_out",
-        "vol_out",
-        "size_out",
-    ]
-    for udf_arg in udf_args:
-        parser.add_argument(f"--{udf_arg}", type=parse_udf_arg)
+    # UDFs to use for calculations, given once or once per calculation
+    for udf_arg in UDF_ARGS:
+        parser.add_argument(f"--{udf_arg}", type=parse_udf_arg, nargs="+")
 
     args = parser.parse_args()
 
@@ -11,23 +11,45 @@ Flags samples as QC PASSED/FAILED based on thresholds
 
 Written by Isak Sylvin; isak.sylvin@scilifelab.se"""
 
-import csv
 import logging
 import os
 import re
 import sys
+import threading
 from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from shutil import move
 
 import flowcell_parser.classes as classes
+import numpy as np
+import pandas as pd
 from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
 from genologics.lims import Lims
 from manage_demux_stats_thresholds import Thresholds
 
+from scilifelab_epps.epp import put_in_batches
+
 logger = logging.getLogger("demux_logger")
 
 
+SEQ_PROCESSES = {
+    "MiSeq Run (MiSeq) 4.0",
+    "AUTOMATED - NovaSeq Run (NovaSeq 6000 v2.0)",
+    "Illumina Sequencing (NextSeq) v1.0",
+    "NovaSeqXPlus Run v1.0",
+    "AVITI Run v1.0",
+}
+
+# LIMS lookups shared by the functions of a run, keyed by the id of the demux process
+run_cache: dict[str, dict] = {"inputs": {}, "seq_process": {}}
+
+# Lanes resolved concurrently, sharing a limit of concurrent requests toward LIMS
+LANE_WORKERS = 8
+lims_requests = threading.BoundedSemaphore(4)
+
+
 def my_float(value):
     if value == "":
         return 0.0
@@ -46,22 +68,78 @@ def problem_handler(type, message):
         logger.info(message)
 
 
-def get_process_stats(demux_process):
-    """Fetches overarching process info"""
-    seq_processes = {
-        "MiSeq Run (MiSeq) 4.0",
-        "AUTOMATED - NovaSeq Run (NovaSeq 6000 v2.0)",
-        "Illumina Sequencing (NextSeq) v1.0",
-        "NovaSeqXPlus Run v1.0",
-        "AVITI Run v1.0",
+def get_inputs(demux_process):
+    """Fetches the input pools of the process, once per run"""
+    if demux_process.id not in run_cache["inputs"]:
+        run_cache["inputs"][demux_process.id] = demux_process.all_inputs()
+    return run_cache["inputs"][demux_process.id]
+
+
+def get_seq_process(demux_process, by_container=False):
+    """Fetches the parent sequencing process, once per run
+
+    By default, LIMS is queried for the sequencing steps containing the first input
+    artifact of this step. If by_container, the sequencing step is instead looked up by
+    the artifacts placed in the flowcell container of the first input, which must all
+    belong to a single sequencing step.
+    """
+    if demux_process.id not in run_cache["seq_process"]:
+        try:
+            first_input = get_inputs(demux_process)[0]
+            if by_container:
+                placed = first_input.location[0].placements.values()
+                seq_processes = {
+                    process.id: process
+                    for process in lims.get_processes(
+                        inputartifactlimsid=[art.id for art in placed],
+                        type=SEQ_PROCESSES,
+                    )
+                }
+                assert (
+                    len(seq_processes) == 1
+                ), f"Found {len(seq_processes)} sequencing steps for container {first_input.location[0].name}"
+                seq_process = list(seq_processes.values())[0]
+            else:
+                # Query LIMS for all steps containing the first input artifact of this step and match to the set of sequencing steps
+                seq_process = lims.get_processes(
+                    inputartifactlimsid=first_input.id, type=SEQ_PROCESSES
+                )[0]
+        except Exception as e:
+            problem_handler(
+                "exit", f"Undefined prior workflow step (run type): {str(e)}"
+            )
+        run_cache["seq_process"][demux_process.id] = seq_process
+    return run_cache["seq_process"][demux_process.id]
+
+
+def resolve_lane_outputs(demux_process, pools):
+    """Starts resolving the result files of all lanes concurrently
+
+    Returns a dict of futures per pool id, so that the lanes can still be processed and
+    logged in order.
+    """
+    executor = ThreadPoolExecutor(max_workers=LANE_WORKERS)
+    lane_outputs = {
+        pool.id: executor.submit(resolve_outputs, demux_process, pool) for pool in pools
     }
-    try:
-        # Query LIMS for all steps containing the first input artifact of this step and match to the set of sequencing steps
-        seq_process = lims.get_processes(
-            inputartifactlimsid=demux_process.all_inputs()[0].id, type=seq_processes
-        )[0]
-    except Exception as e:
-        problem_handler("exit", f"Undefined prior workflow step (run type): {str(e)}")
+    executor.shutdown(wait=False)
+    return lane_outputs
+
+
+def resolve_outputs(demux_process, pool):
+    """Fetches the result files of a lane and their samples, using batch calls"""
+    outarts = demux_process.outputs_per_input(pool.id, ResultFile=True)
+    with lims_requests:
+        lims.get_batch(outarts)
+    samples = {sample.uri: sample for art in outarts for sample in art.samples}
+    with lims_requests:
+        lims.get_batch(list(samples.values()))
+    return outarts
+
+
+def get_process_stats(demux_process, by_container=False):
+    """Fetches overarching process info"""
+    seq_process = get_seq_process(demux_process, by_container)
     # Copies LIMS sequencing step content
     proc_stats = dict(list(seq_process.udf.items()))
     # Instrument is denoted the way it is since it is also used to find
@@ -244,7 +322,41 @@ def fill_process_fields(demux_process, process_stats):
         problem_handler("exit", f"Failed to apply process thresholds to LIMS: {str(e)}")
 
 
-def set_sample_values(demux_process, parser_struct, process_stats):
+def index_demux_table(demux_table, proj_pattern):
+    """Indexes the rows of the demux table once, by lane and by sample within each lane
+
+    Returns the sample name of each row and a dict of the row positions of each lane,
+    in total, per sample, for noIndex rows and for undetermined rows.
+    """
+    # Finds name subset "P Anything Underscore Digits", once per distinct sample
+    short_names = []
+    for sample in demux_table["Sample"].cat.categories:
+        if sample != "Undetermined":
+            try:
+                sample = proj_pattern.search(sample).group(0)
+            # PhiX cases for AVITI
+            except AttributeError:
+                pass
+        short_names.append(sample)
+    samples = list(np.array(short_names, dtype=object)[demux_table["Sample"].cat.codes])
+    unknown = (demux_table["Barcode sequence"] == "unknown").to_numpy()
+
+    lanes = defaultdict(
+        lambda: {"all": [], "samples": {}, "noindex": [], "undetermined": []}
+    )
+    for position, (lane_no, sample) in enumerate(zip(demux_table["Lane"], samples)):
+        lane = lanes[lane_no]
+        lane["all"].append(position)
+        lane["samples"].setdefault(sample, []).append(position)
+        if unknown[position] and sample != "Undetermined":
+            lane["noindex"].append(position)
+        elif sample == "Undetermined":
+            lane["undetermined"].append(position)
+
+    return samples, lanes
+
+
+def set_sample_values(demux_process, demux_table, process_stats):
     """Sets artifact = sample values"""
 
     thresholds = Thresholds(
@@ -257,22 +369,31 @@ def set_sample_values(demux_process, parser_struct, process_stats):
     undet_included = False
     noIndex = False
     undet_lanes = list()
+    updated_files = dict()
     proj_pattern = re.compile(r"(P\w+_\d+)")
+    samples, lanes = index_demux_table(demux_table, proj_pattern)
+    lane_col = demux_table["Lane"].to_numpy()
+    sample_col = demux_table["Sample"].to_numpy()
+    barcodes = demux_table["Barcode sequence"].to_numpy()
+    clusters = demux_table["# Clusters"].to_numpy()
+    def_atr = {
+        "% of thelane": "% of Raw Clusters Per Lane",
+        "% Perfectbarcode": "% Perfect Index Read",
+        "% One mismatchbarcode": "% One Mismatch Reads (Index)",
+        "Yield (Mbases)": "Yield PF (Gb)",
+        "% PFClusters": "%PF",
+        "Mean QualityScore": "Ave Q Score",
+        "% >= Q30bases": "% Bases >=Q30",
+    }
+    # Metric columns of the demux table, indexed by row position
+    metrics = {
+        old_attr: demux_table[old_attr].to_numpy()
+        for old_attr in def_atr
+        if old_attr in demux_table
+    }
 
     # Necessary for noindexruns, should always resolve
-    try:
-        seq_processes = {
-            "MiSeq Run (MiSeq) 4.0",
-            "AUTOMATED - NovaSeq Run (NovaSeq 6000 v2.0)",
-            "Illumina Sequencing (NextSeq) v1.0",
-            "NovaSeqXPlus Run v1.0",
-            "AVITI Run v1.0",
-        }
-        seq_process = lims.get_processes(
-            inputartifactlimsid=demux_process.all_inputs()[0].id, type=seq_processes
-        )[0]
-    except Exception as e:
-        problem_handler("exit", f"Undefined prior workflow step (run type): {str(e)}")
+    seq_process = get_seq_process(demux_process)
 
     if "Lanes to include undetermined" in demux_process.udf:
         try:
@@ -286,14 +407,17 @@ def set_sample_values(demux_process, parser_struct, process_stats):
                 "Unable to typecast included undetermined lanes. Possibly non-number in list",
             )
 
-    for pool in demux_process.all_inputs():
+    pools = get_inputs(demux_process)
+    lane_outputs = resolve_lane_outputs(demux_process, pools)
+
+    for pool in pools:
         undet_reads = 0
         lane_reads = 0
         undet_lane_reads = 0
         samplesum = dict()
 
         try:
-            outarts_per_lane = demux_process.outputs_per_input(pool.id, ResultFile=True)
+            outarts_per_lane = lane_outputs[pool.id].result()
         except Exception as e:
             problem_handler("exit", f"Unable to fetch artifacts of process: {str(e)}")
         if process_stats["Instrument"] == "miseq":
@@ -326,6 +450,16 @@ def set_sample_values(demux_process, parser_struct, process_stats):
             )
         logger.info(f"Expected sample clusters for this lane: {exp_smp_per_lne}")
 
+        lane = lanes[lane_no]
+        if len(lane["all"]) > len(lane["undetermined"]) and int(lane_no) in undet_lanes:
+            # All rows of the lane take part in the sanity check for including undetermined
+            shared_positions = set(lane["all"])
+        else:
+            # Rows flagging a noIndex lane, undetermined rows and the last row of the lane
+            shared_positions = set(
+                lane["noindex"] if undet_included else lane["noindex"][:1]
+            ).union(lane["undetermined"], lane["all"][-1:])
+
         # Artifacts in each lane
         for target_file in outarts_per_lane:
             try:
@@ -335,364 +469,318 @@ def set_sample_values(demux_process, parser_struct, process_stats):
                     "exit",
                     f"Unable to determine sample name. Incorrect sample variable in process: {str(e)}",
                 )
-            for entry in parser_struct:
-                if lane_no == entry["Lane"]:
-                    sample = entry["Sample"]
-                    # Finds name subset "P Anything Underscore Digits"
-                    if sample != "Undetermined":
-                        try:
-                            sample = proj_pattern.search(sample).group(0)
-                        # PhiX cases for AVITI
-                        except AttributeError:
-                            pass
-
+            # Besides the rows of the sample, visit the rows shared by all samples of the lane
+            for current_index in sorted(
+                shared_positions.union(lane["samples"].get(current_name, []))
+            ):
+                sample = samples[current_index]
+
+                if barcodes[current_index] == "unknown" and sample != "Undetermined":
+                    noIndex = True
+                    if undet_included:
+                        problem_handler(
+                            "error",
+                            "Logical error, undetermined cannot be included for a noIndex lane!",
+                        )
+
+                # Bracket for adding undetermined to results
+                if not sample == "Undetermined" and int(lane_no) in undet_lanes:
+                    undet_included = True
+                    # Sanity check for including undetermined
+                    # Next entry is undetermined and previous is for a different lane
                     if (
-                        entry["Barcode sequence"] == "unknown"
-                        and sample != "Undetermined"
+                        sample_col[current_index + 1] == "Undetermined"
+                        and lane_col[current_index - 1] != lane_no
                     ):
-                        noIndex = True
-                        if undet_included:
-                            problem_handler(
-                                "error",
-                                "Logical error, undetermined cannot be included for a noIndex lane!",
+                        try:
+                            # Paired runs are divided by two within flowcell parser
+                            if process_stats["Paired"]:
+                                undet_reads = int(clusters[current_index + 1]) * 2
+                            # Since a single ended run has no pairs, pairs is set to equal reads
+                            else:
+                                undet_reads = int(clusters[current_index + 1])
+                            logger.info(
+                                f"Included undetermined for lane number {lane_no}"
                             )
-
-                    # Bracket for adding undetermined to results
-                    if not sample == "Undetermined" and int(lane_no) in undet_lanes:
-                        undet_included = True
-                        # Sanity check for including undetermined
-                        # Next entry is undetermined and previous is for a different lane
-                        current_index = parser_struct.index(entry)
-                        undet = parser_struct[current_index + 1]
-                        if (
-                            undet["Sample"] == "Undetermined"
-                            and parser_struct[current_index - 1]["Lane"] != lane_no
-                        ):
-                            try:
-                                clusterType = None
-                                if "PF Clusters" in undet:
-                                    clusterType = "PF Clusters"
-                                else:
-                                    clusterType = "Clusters"
-                                # Paired runs are divided by two within flowcell parser
-                                if process_stats["Paired"]:
-                                    undet_reads = (
-                                        int(undet[clusterType].replace(",", "")) * 2
-                                    )
-                                # Since a single ended run has no pairs, pairs is set to equal reads
-                                else:
-                                    undet_reads = int(
-                                        undet[clusterType].replace(",", "")
-                                    )
-                                logger.info(
-                                    f"Included undetermined for lane number {lane_no}"
-                                )
-                            except Exception as e:
-                                problem_handler(
-                                    "exit",
-                                    f"Unable to set values for undetermined #Reads and #Read Pairs: {str(e)}",
-                                )
-                        else:
+                        except Exception as e:
                             problem_handler(
                                 "exit",
-                                f"Undetermined for lane {lane_no} requested, which has more than one sample",
+                                f"Unable to set values for undetermined #Reads and #Read Pairs: {str(e)}",
                             )
+                    else:
+                        problem_handler(
+                            "exit",
+                            f"Undetermined for lane {lane_no} requested, which has more than one sample",
+                        )
+
+                # Bracket for adding typical sample info
+                if sample == current_name:
+                    # Sample samplesum construction
+                    if sample not in samplesum:
+                        samplesum[sample] = dict()
+                        samplesum[sample]["count"] = 1
+                    else:
+                        samplesum[sample]["count"] += 1
+
+                    try:
+                        for old_attr, attr in def_atr.items():
+                            value = (
+                                metrics[old_attr][current_index]
+                                if old_attr in metrics
+                                else None
+                            )
+                            # Sets default value for unwritten fields, skipping fields missing from the row
+                            if pd.notna(value):
+                                if value == "" or value == "NaN":
+                                    if old_attr == "% of Raw Clusters Per Lane":
+                                        default_value = 100.0
+                                    else:
+                                        default_value = 0.0
 
-                    # Bracket for adding typical sample info
-                    if sample == current_name:
-                        # Sample samplesum construction
-                        if sample not in samplesum:
-                            samplesum[sample] = dict()
-                            samplesum[sample]["count"] = 1
-                        else:
-                            samplesum[sample]["count"] += 1
-
-                        try:
-                            def_atr = {
-                                "% of thelane": "% of Raw Clusters Per Lane",
-                                "% Perfectbarcode": "% Perfect Index Read",
-                                "% One mismatchbarcode": "% One Mismatch Reads (Index)",
-                                "Yield (Mbases)": "Yield PF (Gb)",
-                                "% PFClusters": "%PF",
-                                "Mean QualityScore": "Ave Q Score",
-                                "% >= Q30bases": "% Bases >=Q30",
-                            }
-                            for old_attr, attr in def_atr.items():
-                                # Sets default value for unwritten fields
-                                if old_attr in entry.keys():
-                                    if (
-                                        entry[old_attr] == ""
-                                        or entry[old_attr] == "NaN"
-                                    ):
-                                        if old_attr == "% of Raw Clusters Per Lane":
-                                            default_value = 100.0
-                                        else:
-                                            default_value = 0.0
+                                    samplesum[sample][attr] = (
+                                        default_value
+                                        if attr not in samplesum[sample]
+                                        else samplesum[sample][attr] + default_value
+                                    )
+                                    logger.info(
+                                        f"{attr} field not found. Setting default value: {default_value}"
+                                    )
 
+                                else:
+                                    # Yields needs division by 1K, is also non-percentage
+                                    if old_attr == "Yield (Mbases)":
                                         samplesum[sample][attr] = (
-                                            default_value
+                                            my_float(value.replace(",", "")) / 1000
                                             if attr not in samplesum[sample]
-                                            else samplesum[sample][attr] + default_value
+                                            else samplesum[sample][attr]
+                                            + my_float(value.replace(",", "")) / 1000
                                         )
-                                        logger.info(
-                                            f"{attr} field not found. Setting default value: {default_value}"
+                                    else:
+                                        samplesum[sample][attr] = (
+                                            my_float(value)
+                                            if attr not in samplesum[sample]
+                                            else samplesum[sample][attr]
+                                            + my_float(value)
                                         )
 
-                                    else:
-                                        # Yields needs division by 1K, is also non-percentage
-                                        if old_attr == "Yield (Mbases)":
-                                            samplesum[sample][attr] = (
-                                                my_float(
-                                                    entry[old_attr].replace(",", "")
-                                                )
-                                                / 1000
-                                                if attr not in samplesum[sample]
-                                                else samplesum[sample][attr]
-                                                + my_float(
-                                                    entry[old_attr].replace(",", "")
-                                                )
-                                                / 1000
+                    except Exception as e:
+                        problem_handler(
+                            "exit",
+                            f"Unable to set artifact values. Check laneBarcode.html for odd values: {str(e)}",
+                        )
+
+                    # Fetches clusters from laneBarcode.html file
+                    if noIndex:
+                        # For the case of NovaSeq run, parse lane yield from the ResultsFile of all_outputs.
+                        if seq_process.type.name in [
+                            "AUTOMATED - NovaSeq Run (NovaSeq 6000 v2.0)",
+                            "Illumina Sequencing (NextSeq) v1.0",
+                            "NovaSeqXPlus Run v1.0",
+                            "AVITI Run v1.0",
+                        ]:
+                            try:
+                                for inp in seq_process.all_outputs():
+                                    if (
+                                        inp.output_type == "ResultFile"
+                                        and inp.name.split(" ")[1] == lane_no
+                                        and "Reads PF (M) R1" in inp.udf
+                                    ):
+                                        if process_stats["Paired"]:
+                                            target_file.udf["# Reads"] = (
+                                                inp.udf["Reads PF (M) R1"] * 1000000 * 2
+                                            )
+                                            target_file.udf["# Read Pairs"] = (
+                                                target_file.udf["# Reads"] / 2
                                             )
                                         else:
-                                            samplesum[sample][attr] = (
-                                                my_float(entry[old_attr])
-                                                if attr not in samplesum[sample]
-                                                else samplesum[sample][attr]
-                                                + my_float(entry[old_attr])
+                                            target_file.udf["# Reads"] = (
+                                                inp.udf["Reads PF (M) R1"] * 1000000
                                             )
-
-                        except Exception as e:
-                            problem_handler(
-                                "exit",
-                                f"Unable to set artifact values. Check laneBarcode.html for odd values: {str(e)}",
-                            )
-
-                        # Fetches clusters from laneBarcode.html file
-                        if noIndex:
-                            # For the case of NovaSeq run, parse lane yield from the ResultsFile of all_outputs.
-                            if seq_process.type.name in [
-                                "AUTOMATED - NovaSeq Run (NovaSeq 6000 v2.0)",
-                                "Illumina Sequencing (NextSeq) v1.0",
-                                "NovaSeqXPlus Run v1.0",
-                                "AVITI Run v1.0",
-                            ]:
-                                try:
-                                    for inp in seq_process.all_outputs():
-                                        if (
-                                            inp.output_type == "ResultFile"
-                                            and inp.name.split(" ")[1] == lane_no
-                                            and "Reads PF (M) R1" in inp.udf
-                                        ):
-                                            if process_stats["Paired"]:
-                                                target_file.udf["# Reads"] = (
-                                                    inp.udf["Reads PF (M) R1"]
-                                                    * 1000000
-                                                    * 2
-                                                )
-                                                target_file.udf["# Read Pairs"] = (
-                                                    target_file.udf["# Reads"] / 2
-                                                )
-                                            else:
-                                                target_file.udf["# Reads"] = (
-                                                    inp.udf["Reads PF (M) R1"] * 1000000
-                                                )
-                                                target_file.udf["# Read Pairs"] = (
-                                                    target_file.udf["# Reads"]
-                                                )
-                                    logger.info(
-                                        "{}# Reads".format(target_file.udf["# Reads"])
-                                    )
-                                    logger.info(
-                                        "{}# Read Pairs".format(
-                                            target_file.udf["# Read Pairs"]
-                                        )
-                                    )
-                                except Exception as e:
-                                    problem_handler(
-                                        "exit",
-                                        f"Unable to set values for #Reads and #Read Pairs for perceived noIndex lane: {str(e)}",
-                                    )
-                            # For all other cases, parse lane yield from all_inputs
-                            else:
-                                try:
-                                    for inp in seq_process.all_inputs():
-                                        # If reads in seq step, and the lane is equal to the current lane
-                                        # Handle special case for MiSeq with noIndex case:
-                                        inp_location = (
-                                            "1"
-                                            if inp.location[1][0] == "A"
-                                            else inp.location[1][0]
-                                        )
-                                        if (
-                                            inp_location == lane_no
-                                            and "Clusters PF R1" in inp.udf
-                                        ):
-                                            if process_stats["Paired"]:
-                                                target_file.udf["# Reads"] = (
-                                                    inp.udf["Clusters PF R1"] * 2
-                                                )
-                                                target_file.udf["# Read Pairs"] = (
-                                                    target_file.udf["# Reads"] / 2
-                                                )
-                                            else:
-                                                target_file.udf["# Reads"] = inp.udf[
-                                                    "Clusters PF R1"
-                                                ]
-                                                target_file.udf["# Read Pairs"] = (
-                                                    target_file.udf["# Reads"]
-                                                )
-                                    logger.info(
-                                        "{}# Reads".format(target_file.udf["# Reads"])
-                                    )
-                                    logger.info(
-                                        "{}# Read Pairs".format(
-                                            target_file.udf["# Read Pairs"]
-                                        )
-                                    )
-                                except Exception as e:
-                                    problem_handler(
-                                        "exit",
-                                        f"Unable to set values for #Reads and #Read Pairs for perceived noIndex lane: {str(e)}",
-                                    )
-
-                        elif not noIndex:
-                            try:
-                                clusterType = None
-                                if "PF Clusters" in entry:
-                                    clusterType = "PF Clusters"
-                                else:
-                                    clusterType = "Clusters"
-                                # Paired runs are divided by two within flowcell parser
-                                basenumber = int(entry[clusterType].replace(",", ""))
-                                if process_stats["Paired"]:
-                                    # Undet always 0 unless manually included
-                                    samplesum[sample]["# Reads"] = (
-                                        basenumber * 2 + undet_reads
-                                        if "# Reads" not in samplesum[sample]
-                                        else samplesum[sample]["# Reads"]
-                                        + basenumber * 2
-                                        + undet_reads
-                                    )
-
-                                    samplesum[sample]["# Read Pairs"] = (
-                                        basenumber + undet_reads / 2
-                                        if "# Read Pairs" not in samplesum[sample]
-                                        else samplesum[sample]["# Read Pairs"]
-                                        + basenumber
-                                        + undet_reads / 2
-                                    )
-                                # Since a single ended run has no pairs, pairs is set to equal reads
-                                else:
-                                    # Undet always 0 unless manually included
-                                    samplesum[sample]["# Reads"] = (
-                                        basenumber + undet_reads
-                                        if "# Reads" not in samplesum[sample]
-                                        else samplesum[sample]["# Reads"]
-                                        + basenumber
-                                        + undet_reads
-                                    )
-
-                                    samplesum[sample]["# Read Pairs"] = (
-                                        samplesum[sample]["# Reads"]
-                                        if "# Read Pairs" not in samplesum[sample]
-                                        else samplesum[sample]["# Read Pairs"]
-                                        + samplesum[sample]["# Reads"]
+                                            target_file.udf["# Read Pairs"] = (
+                                                target_file.udf["# Reads"]
+                                            )
+                                logger.info(
+                                    "{}# Reads".format(target_file.udf["# Reads"])
+                                )
+                                logger.info(
+                                    "{}# Read Pairs".format(
+                                        target_file.udf["# Read Pairs"]
                                     )
+                                )
                             except Exception as e:
                                 problem_handler(
                                     "exit",
-                                    f"Unable to set values for #Reads and #Read Pairs: {str(e)}",
+                                    f"Unable to set values for #Reads and #Read Pairs for perceived noIndex lane: {str(e)}",
                                 )
-
-                        # Spools samplesum into samples
-                        try:
-                            if samplesum[sample]["count"] > 1:
-                                logger.info("Iteratively pooling samples in same lane.")
-                            for thing in samplesum:
-                                for k, v in samplesum[thing].items():
-                                    if thing == sample and thing == current_name:
-                                        if k == "count":
-                                            logger.info(
-                                                f"Setting values for sample {thing} of lane {lane_no}"
-                                            )
-                                        # Average for percentages
-                                        elif k in [
-                                            "% One Mismatch Reads (Index)",
-                                            "% Perfect Index Read",
-                                            "Ave Q Score",
-                                            "%PF",
-                                            "% of Raw Clusters Per Lane",
-                                            "% Bases >=Q30",
-                                        ]:
-                                            target_file.udf[k] = (
-                                                v / samplesum[thing]["count"]
+                        # For all other cases, parse lane yield from all_inputs
+                        else:
+                            try:
+                                for inp in seq_process.all_inputs():
+                                    # If reads in seq step, and the lane is equal to the current lane
+                                    # Handle special case for MiSeq with noIndex case:
+                                    inp_location = (
+                                        "1"
+                                        if inp.location[1][0] == "A"
+                                        else inp.location[1][0]
+                                    )
+                                    if (
+                                        inp_location == lane_no
+                                        and "Clusters PF R1" in inp.udf
+                                    ):
+                                        if process_stats["Paired"]:
+                                            target_file.udf["# Reads"] = (
+                                                inp.udf["Clusters PF R1"] * 2
                                             )
-                                        elif k != "count":
-                                            target_file.udf[k] = samplesum[thing][k]
-                                        if samplesum[sample]["count"] > 1:
-                                            logger.info(
-                                                f"Pooled total for {k} of sample {thing} is set to {v}"
+                                            target_file.udf["# Read Pairs"] = (
+                                                target_file.udf["# Reads"] / 2
                                             )
                                         else:
-                                            logger.info(
-                                                f"Attribute {k} of sample {thing} is set to {v}"
+                                            target_file.udf["# Reads"] = inp.udf[
+                                                "Clusters PF R1"
+                                            ]
+                                            target_file.udf["# Read Pairs"] = (
+                                                target_file.udf["# Reads"]
                                             )
-                        except Exception as e:
-                            problem_handler(
-                                "exit",
-                                f"Unable to set artifact values. Check laneBarcode.html for odd values: {str(e)}",
-                            )
+                                logger.info(
+                                    "{}# Reads".format(target_file.udf["# Reads"])
+                                )
+                                logger.info(
+                                    "{}# Read Pairs".format(
+                                        target_file.udf["# Read Pairs"]
+                                    )
+                                )
+                            except Exception as e:
+                                problem_handler(
+                                    "exit",
+                                    f"Unable to set values for #Reads and #Read Pairs for perceived noIndex lane: {str(e)}",
+                                )
 
-                        # Applies thresholds to samples
+                    elif not noIndex:
                         try:
-                            if (
-                                demux_process.udf["Threshold for % bases >= Q30"]
-                                <= my_float(entry["% >= Q30bases"])
-                                and int(exp_smp_per_lne)
-                                <= target_file.udf["# Read Pairs"]
-                            ):
-                                target_file.udf["Include reads"] = "YES"
-                                target_file.qc_flag = "PASSED"
+                            # Paired runs are divided by two within flowcell parser
+                            basenumber = int(clusters[current_index])
+                            if process_stats["Paired"]:
+                                # Undet always 0 unless manually included
+                                samplesum[sample]["# Reads"] = (
+                                    basenumber * 2 + undet_reads
+                                    if "# Reads" not in samplesum[sample]
+                                    else samplesum[sample]["# Reads"]
+                                    + basenumber * 2
+                                    + undet_reads
+                                )
+
+                                samplesum[sample]["# Read Pairs"] = (
+                                    basenumber + undet_reads / 2
+                                    if "# Read Pairs" not in samplesum[sample]
+                                    else samplesum[sample]["# Read Pairs"]
+                                    + basenumber
+                                    + undet_reads / 2
+                                )
+                            # Since a single ended run has no pairs, pairs is set to equal reads
                             else:
-                                target_file.udf["Include reads"] = "NO"
-                                target_file.qc_flag = "FAILED"
-                                failed_entries = failed_entries + 1
-                            logger.info(
-                                "Q30 %: {}% found, minimum at {}%".format(
-                                    my_float(entry["% >= Q30bases"]),
-                                    demux_process.udf["Threshold for % bases >= Q30"],
+                                # Undet always 0 unless manually included
+                                samplesum[sample]["# Reads"] = (
+                                    basenumber + undet_reads
+                                    if "# Reads" not in samplesum[sample]
+                                    else samplesum[sample]["# Reads"]
+                                    + basenumber
+                                    + undet_reads
                                 )
-                            )
-                            logger.info(
-                                "Expected reads: {} found, minimum at {}".format(
-                                    target_file.udf["# Read Pairs"],
-                                    int(exp_smp_per_lne),
+
+                                samplesum[sample]["# Read Pairs"] = (
+                                    samplesum[sample]["# Reads"]
+                                    if "# Read Pairs" not in samplesum[sample]
+                                    else samplesum[sample]["# Read Pairs"]
+                                    + samplesum[sample]["# Reads"]
                                 )
-                            )
-                            logger.info(
-                                f"Sample QC status set to {target_file.qc_flag}"
-                            )
                         except Exception as e:
                             problem_handler(
                                 "exit",
-                                f"Unable to set QC status for sample: {str(e)}",
+                                f"Unable to set values for #Reads and #Read Pairs: {str(e)}",
                             )
 
-                        lane_reads = lane_reads + target_file.udf["# Reads"]
-
-                    # Counts undetermined
-                    elif sample == "Undetermined":
-                        if "PF Clusters" in entry:
-                            clusterType = "PF Clusters"
+                    # Spools samplesum into samples
+                    try:
+                        if samplesum[sample]["count"] > 1:
+                            logger.info("Iteratively pooling samples in same lane.")
+                        for thing in samplesum:
+                            for k, v in samplesum[thing].items():
+                                if thing == sample and thing == current_name:
+                                    if k == "count":
+                                        logger.info(
+                                            f"Setting values for sample {thing} of lane {lane_no}"
+                                        )
+                                    # Average for percentages
+                                    elif k in [
+                                        "% One Mismatch Reads (Index)",
+                                        "% Perfect Index Read",
+                                        "Ave Q Score",
+                                        "%PF",
+                                        "% of Raw Clusters Per Lane",
+                                        "% Bases >=Q30",
+                                    ]:
+                                        target_file.udf[k] = (
+                                            v / samplesum[thing]["count"]
+                                        )
+                                    elif k != "count":
+                                        target_file.udf[k] = samplesum[thing][k]
+                                    if samplesum[sample]["count"] > 1:
+                                        logger.info(
+                                            f"Pooled total for {k} of sample {thing} is set to {v}"
+                                        )
+                                    else:
+                                        logger.info(
+                                            f"Attribute {k} of sample {thing} is set to {v}"
+                                        )
+                    except Exception as e:
+                        problem_handler(
+                            "exit",
+                            f"Unable to set artifact values. Check laneBarcode.html for odd values: {str(e)}",
+                        )
+
+                    # Applies thresholds to samples
+                    try:
+                        q30 = metrics["% >= Q30bases"][current_index]
+                        if pd.isna(q30):
+                            raise KeyError("% >= Q30bases")
+                        if (
+                            demux_process.udf["Threshold for % bases >= Q30"]
+                            <= my_float(q30)
+                            and int(exp_smp_per_lne) <= target_file.udf["# Read Pairs"]
+                        ):
+                            target_file.udf["Include reads"] = "YES"
+                            target_file.qc_flag = "PASSED"
                         else:
-                            clusterType = "Clusters"
-
-                        if process_stats["Paired"]:
-                            undet_lane_reads = (
-                                int(entry[clusterType].replace(",", "")) * 2
+                            target_file.udf["Include reads"] = "NO"
+                            target_file.qc_flag = "FAILED"
+                            failed_entries = failed_entries + 1
+                        logger.info(
+                            "Q30 %: {}% found, minimum at {}%".format(
+                                my_float(q30),
+                                demux_process.udf["Threshold for % bases >= Q30"],
                             )
-                        else:
-                            undet_lane_reads = int(entry[clusterType].replace(",", ""))
+                        )
+                        logger.info(
+                            "Expected reads: {} found, minimum at {}".format(
+                                target_file.udf["# Read Pairs"],
+                                int(exp_smp_per_lne),
+                            )
+                        )
+                        logger.info(f"Sample QC status set to {target_file.qc_flag}")
+                    except Exception as e:
+                        problem_handler(
+                            "exit",
+                            f"Unable to set QC status for sample: {str(e)}",
+                        )
+
+                    lane_reads = lane_reads + target_file.udf["# Reads"]
+
+                # Counts undetermined
+                elif sample == "Undetermined":
+                    if process_stats["Paired"]:
+                        undet_lane_reads = int(clusters[current_index]) * 2
+                    else:
+                        undet_lane_reads = int(clusters[current_index])
 
             if list(target_file.udf.items()) == [] and current_name != "Undetermined":
                 problem_handler(
@@ -700,14 +788,8 @@ def set_sample_values(demux_process, parser_struct, process_stats):
                     f'Lanebarcode mismatch. Expected sample "{current_name}" of lane "{lane_no}", found "{sample}"',
                 )
 
-            # Push lane into lims
-            try:
-                target_file.put()
-            except Exception as e:
-                problem_handler(
-                    "exit",
-                    f"Failed to apply artifact data to LIMS. Possibly due to data in laneBarcode.html; {str(e)}",
-                )
+            # Collect lane, to be pushed into lims with all other lanes
+            updated_files[target_file.uri] = target_file
 
         # Counts undetermined per lane
         if not undet_included:
@@ -739,6 +821,20 @@ def set_sample_values(demux_process, parser_struct, process_stats):
                         f"Found {undet_lane_reads} ({found_undet}%) undemultiplexed reads for lane {lane_no}."
                     )
 
+    # Push all lanes into lims, using batch calls
+    try:
+        failed = put_in_batches(lims, list(updated_files.values()))
+    except Exception as e:
+        failed = [(None, e)]
+    if failed:
+        problem_handler(
+            "exit",
+            "Failed to apply artifact data to LIMS. Possibly due to data in laneBarcode.html; "
+            + "; ".join(
+                f"{art.name}: {str(e)}" if art else str(e) for art, e in failed
+            ),
+        )
+
     if undet_included:
         problem_handler("warning", "Undetermined reads included in read count!")
 
@@ -746,6 +842,82 @@ def set_sample_values(demux_process, parser_struct, process_stats):
         problem_handler("warning", f"{failed_entries} entries failed automatic QC")
 
 
+def load_lanebarcode(lanebc_path):
+    """Loads the sample rows of laneBarcode.html into a demux table
+
+    The table has one column per field of the flowcell parser rows, with lane, sample,
+    project and index columns as categoricals. The clusters are parsed once into the
+    integer column "# Clusters".
+    """
+    laneBC = classes.LaneBarcodeParser(lanebc_path)
+    table = pd.DataFrame(laneBC.sample_data)
+
+    # Rows without PF clusters fall back to clusters
+    clusters = table["PF Clusters"] if "PF Clusters" in table else table["Clusters"]
+    if "PF Clusters" in table and "Clusters" in table:
+        clusters = clusters.fillna(table["Clusters"])
+    table["# Clusters"] = parse_clusters(clusters)
+
+    return as_categories(table)
+
+
+def load_index_assignment(lanebc_path):
+    """Loads IndexAssignment.csv into a demux table, in one pass
+
+    The fields are translated to those of laneBarcode.html, leaving out the rows of
+    combined lanes. Like load_lanebarcode, the clusters are parsed into "# Clusters".
+    """
+    rows = pd.read_csv(lanebc_path, dtype=str, keep_default_na=False)
+    rows = rows[~rows["Lane"].str.contains("+", regex=False)]
+
+    def column(name, default):
+        return rows[name] if name in rows else pd.Series(default, index=rows.index)
+
+    index = column("I1", "")
+    index = index.where(column("I2", "") == "", index + "-" + column("I2", ""))
+    mismatch = column("PercentMismatch", "0").astype(float)
+
+    table = pd.DataFrame(
+        {
+            "Lane": column("Lane", ""),
+            "Sample": column("SampleName", ""),
+            "Project": column("Project", ""),
+            "Barcode sequence": index,
+            "PF Clusters": column("NumPoloniesAssigned", "0"),
+            "% of thelane": column("PercentPoloniesAssigned", "0").astype(float),
+            "% >= Q30bases": column("PercentQ30", "0").astype(float),
+            "Mean QualityScore": column("QualityScoreMean", "0").astype(float),
+            "% Perfectbarcode": 100 - mismatch,
+            "% One mismatchbarcode": mismatch,
+            "Yield (Mbases)": (column("Yield(Gb)", "0").astype(float) * 1000).astype(
+                str
+            ),
+        }
+    ).reset_index(drop=True)
+    table["# Clusters"] = parse_clusters(table["PF Clusters"])
+
+    return as_categories(table)
+
+
+def parse_clusters(clusters):
+    """Parses a column of cluster strings with thousands separators into integers"""
+    parsed = pd.to_numeric(clusters.astype(str).str.replace(",", ""), errors="coerce")
+    if parsed.isna().any():
+        problem_handler(
+            "exit",
+            f"Unable to parse clusters: {list(clusters[parsed.isna()])}",
+        )
+    return parsed.astype("int64")
+
+
+def as_categories(table):
+    """Stores the lane, sample, project and index columns of a demux table as categoricals"""
+    for col in ["Lane", "Sample", "Project", "Barcode sequence"]:
+        if col in table:
+            table[col] = table[col].astype("category")
+    return table
+
+
 def write_demuxfile(process_stats, demux_id):
     """Creates demux_{FCID}.csv and attaches it to process"""
     # Includes windows drive letter support
@@ -762,7 +934,7 @@ def write_demuxfile(process_stats, demux_id):
         "laneBarcode.html",
     )
     try:
-        laneBC = classes.LaneBarcodeParser(lanebc_path)
+        demux_table = load_lanebarcode(lanebc_path)
     except Exception as e:
         problem_handler(
             "exit",
@@ -771,49 +943,28 @@ def write_demuxfile(process_stats, demux_id):
     fname = "{}_demuxstats_{}.csv".format(demux_id, process_stats["Flow Cell ID"])
 
     # Writes less undetermined info than undemultiplex_index.py. May cause problems downstreams
-    with open(fname, "w") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(
-            [
-                "Project",
-                "Sample ID",
-                "Lane",
-                "# Reads",
-                "Index",
-                "Index name",
-                "% of >= Q30 Bases (PF)",
-            ]
+    try:
+        demux_csv = pd.DataFrame(
+            {
+                "Project": demux_table["Project"],
+                "Sample ID": demux_table["Sample"],
+                "Lane": demux_table["Lane"],
+                "# Reads": demux_table["# Clusters"]
+                * (2 if process_stats["Paired"] else 1),
+                "Index": demux_table["Barcode sequence"],
+                "Index name": "",
+                "% of >= Q30 Bases (PF)": demux_table["% >= Q30bases"],
+            }
         )
-        for entry in laneBC.sample_data:
-            index_name = ""
-            if "PF Clusters" in entry:
-                reads = entry["PF Clusters"]
-            else:
-                reads = entry["Clusters"]
-
-            if process_stats["Paired"]:
-                reads = int(reads.replace(",", "")) * 2
-            else:
-                reads = int(reads.replace(",", ""))
+        assert not demux_csv.isna().any().any(), "Missing fields"
+    except Exception as e:
+        problem_handler(
+            "exit",
+            f"Flowcell parser is unable to fetch all necessary fields for demux file: {str(e)}",
+        )
+    demux_csv.to_csv(fname, index=False, lineterminator="\r\n")
 
-            try:
-                writer.writerow(
-                    [
-                        entry["Project"],
-                        entry["Sample"],
-                        entry["Lane"],
-                        reads,
-                        entry["Barcode sequence"],
-                        index_name,
-                        entry["% >= Q30bases"],
-                    ]
-                )
-            except Exception as e:
-                problem_handler(
-                    "exit",
-                    f"Flowcell parser is unable to fetch all necessary fields for demux file: {str(e)}",
-                )
-    return laneBC.sample_data
+    return demux_table
 
 
 def write_demuxfile_aviti(process_stats, demux_id):
@@ -833,41 +984,7 @@ def write_demuxfile_aviti(process_stats, demux_id):
     )
 
     try:
-        laneBC = {}
-        laneBC["sample_data"] = []
-        with open(lanebc_path) as lanebc_file:
-            reader = csv.DictReader(lanebc_file)
-            for row in reader:
-                if "+" not in row["Lane"]:
-                    index = row.get("I1", "")
-                    if row.get("I2"):
-                        index += "-"
-                        index += row["I2"]
-
-                    laneBC["sample_data"].append(
-                        {
-                            "Lane": row.get("Lane", ""),
-                            "Sample": row.get("SampleName", ""),
-                            "Project": row.get("Project", ""),
-                            "Barcode sequence": index,
-                            "PF Clusters": str(row.get("NumPoloniesAssigned", "0")),
-                            "% of thelane": float(
-                                row.get("PercentPoloniesAssigned", "0")
-                            ),
-                            "% >= Q30bases": float(row.get("PercentQ30", "0")),
-                            "Mean QualityScore": float(
-                                row.get("QualityScoreMean", "0")
-                            ),
-                            "% Perfectbarcode": 100
-                            - float(row.get("PercentMismatch", "0")),
-                            "% One mismatchbarcode": float(
-                                row.get("PercentMismatch", "0")
-                            ),
-                            "Yield (Mbases)": str(
-                                float(row.get("Yield(Gb)", "0")) * 1000
-                            ),
-                        }
-                    )
+        demux_table = load_index_assignment(lanebc_path)
     except Exception as e:
         problem_handler(
             "exit",
@@ -877,54 +994,26 @@ def write_demuxfile_aviti(process_stats, demux_id):
     fname = "{}_demuxstats_{}.csv".format(demux_id, process_stats["Flow Cell ID"])
 
     # Writes less undetermined info than undemultiplex_index.py. May cause problems downstreams
-    with open(fname, "w") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(
-            [
-                "Project",
-                "Sample ID",
-                "Lane",
-                "# Reads",
-                "Index",
-                "% of >= Q30 Bases (PF)",
-                "Mean QualityScore",
-                "% Perfectbarcode",
-                "% One mismatchbarcode",
-                "Yield (Mbases)",
-            ]
-        )
-        for entry in laneBC["sample_data"]:
-            reads = entry["PF Clusters"]
+    pd.DataFrame(
+        {
+            "Project": demux_table["Project"],
+            "Sample ID": demux_table["Sample"],
+            "Lane": demux_table["Lane"],
+            "# Reads": demux_table["# Clusters"]
+            * (2 if process_stats["Paired"] else 1),
+            "Index": demux_table["Barcode sequence"],
+            "% of >= Q30 Bases (PF)": demux_table["% >= Q30bases"],
+            "Mean QualityScore": demux_table["Mean QualityScore"],
+            "% Perfectbarcode": demux_table["% Perfectbarcode"],
+            "% One mismatchbarcode": demux_table["% One mismatchbarcode"],
+            "Yield (Mbases)": demux_table["Yield (Mbases)"],
+        }
+    ).to_csv(fname, index=False, lineterminator="\r\n")
 
-            if process_stats["Paired"]:
-                reads = int(reads.replace(",", "")) * 2
-            else:
-                reads = int(reads.replace(",", ""))
+    return demux_table
 
-            try:
-                writer.writerow(
-                    [
-                        entry["Project"],
-                        entry["Sample"],
-                        entry["Lane"],
-                        reads,
-                        entry["Barcode sequence"],
-                        entry["% >= Q30bases"],
-                        entry["Mean QualityScore"],
-                        entry["% Perfectbarcode"],
-                        entry["% One mismatchbarcode"],
-                        entry["Yield (Mbases)"],
-                    ]
-                )
-            except Exception as e:
-                problem_handler(
-                    "exit",
-                    f"Flowcell parser is unable to fetch all necessary fields for demux file: {str(e)}",
-                )
-    return laneBC["sample_data"]
 
-
-def main(process_lims_id, demux_id, log_id):
+def main(process_lims_id, demux_id, log_id, by_container=False):
     # Sets up logger
     basic_name = f"{log_id}_logfile.txt"
     logger.setLevel(logging.DEBUG)
@@ -947,19 +1036,19 @@ def main(process_lims_id, demux_id, log_id):
     demux_process = Process(lims, id=process_lims_id)
 
     # Fetches info on "workflow" level
-    process_stats = get_process_stats(demux_process)
+    process_stats = get_process_stats(demux_process, by_container)
 
     # Sets up the process values
     fill_process_fields(demux_process, process_stats)
 
     # Create the demux output file
     if "AVITI" in demux_process.type.name:
-        parser_struct = write_demuxfile_aviti(process_stats, demux_id)
+        demux_table = write_demuxfile_aviti(process_stats, demux_id)
     else:
-        parser_struct = write_demuxfile(process_stats, demux_id)
+        demux_table = write_demuxfile(process_stats, demux_id)
 
     # Alters artifacts
-    set_sample_values(demux_process, parser_struct, process_stats)
+    set_sample_values(demux_process, demux_table, process_stats)
 
     # Changing log file name, can't do this step earlier since proc_stats is made during runtime.
     new_name = "{}_logfile_{}.txt".format(log_id, process_stats["Flow Cell ID"])
@@ -983,7 +1072,15 @@ if __name__ == "__main__":
     parser.add_argument(
         "--log_id", required=True, dest="log_id", help=("Id prefix for logfile")
     )
+    parser.add_argument(
+        "--by_container",
+        action="store_true",
+        help=(
+            "Look up the sequencing step by the Flow Cell ID of the input container, "
+            "instead of by the input artifacts"
+        ),
+    )
     args = parser.parse_args()
     lims = Lims(BASEURI, USERNAME, PASSWORD)
     lims.check_version()
-    main(args.process_lims_id, args.demux_id, args.log_id)
+    main(args.process_lims_id, args.demux_id, args.log_id, args.by_container)
@@ -61,76 +61,48 @@ def main(lims, args):
             "nm",
         ], f'Unsupported conc. units "{conc_units}" for art {art_in.name}'
 
-        # Calculate volume to take, based on supplied info
-        if udf_tools.is_filled(art_out, "ONT flow cell loading amount (fmol)"):
-            log.append(
-                f"Basing calculations on 'ONT flow cell loading amount (fmol)': {round(udf_tools.fetch(art_out, 'ONT flow cell loading amount (fmol)'),2)}"
-            )
-            if conc_units.lower() == "nm":
-                vol_to_take = min(
-                    udf_tools.fetch(art_out, "ONT flow cell loading amount (fmol)")
-                    / conc,
-                    vol,
-                )
-            elif conc_units.lower() == "ng/ul":
-                assert size_bp is not None, "Missing size."
-                vol_to_take = min(
-                    formula.fmol_to_ng(
-                        udf_tools.fetch(art_out, "ONT flow cell loading amount (fmol)"),
-                        size_bp,
-                    )
-                    / conc,
-                    vol,
-                )
-        elif udf_tools.is_filled(art_out, "Amount (fmol)"):
-            log.append(
-                f"Basing calculations on 'Amount (fmol): {round(udf_tools.fetch(art_out, 'Amount (fmol)'),2)}'"
-            )
-            if conc_units.lower() == "nm":
-                vol_to_take = min(udf_tools.fetch(art_out, "Amount (fmol)") / conc, vol)
-            elif conc_units.lower() == "ng/ul":
-                assert size_bp is not None, "Missing size."
+        conc_units = formula.parse_unit(conc_units)
+
+        # Calculate volume to take, based on the first supplied target metric
+        for target_udf, target_unit in [
+            ("ONT flow cell loading amount (fmol)", "fmol"),
+            ("Amount (fmol)", "fmol"),
+            ("Amount (ng)", "ng"),
+            ("Volume to take (uL)", "ul"),
+        ]:
+            if udf_tools.is_filled(art_out, target_udf):
+                target = udf_tools.fetch(art_out, target_udf)
+                log.append(f"Basing calculations on '{target_udf}': {round(target, 2)}")
                 vol_to_take = min(
-                    formula.fmol_to_ng(
-                        udf_tools.fetch(art_out, "Amount (fmol)"), size_bp
-                    )
-                    / conc,
+                    formula.convert(
+                        target,
+                        target_unit,
+                        "ul",
+                        bp=size_bp,
+                        conc=conc,
+                        conc_unit=conc_units,
+                    ),
                     vol,
                 )
-        elif udf_tools.is_filled(art_out, "Amount (ng)"):
-            log.append(
-                f"Basing calculations on 'Amount (ng)': {round(udf_tools.fetch(art_out, 'Amount (ng)'),2)}"
-            )
-            if conc_units.lower() == "ng/ul":
-                vol_to_take = min(udf_tools.fetch(art_out, "Amount (ng)") / conc, vol)
-            elif conc_units.lower() == "nm":
-                assert size_bp is not None, "Missing size."
-                vol_to_take = min(
-                    formula.ng_to_fmol(udf_tools.fetch(art_out, "Amount (ng)"), size_bp)
-                    / conc,
-                    vol,
-                )
-        elif udf_tools.is_filled(art_out, "Volume to take (uL)"):
-            log.append(
-                f"Basing calculations on 'Volume to take (uL)': {round(udf_tools.fetch(art_out, 'Volume to take (uL)'),2)}"
-            )
-            vol_to_take = min(udf_tools.fetch(art_out, "Volume to take (uL)"), vol)
+                break
         else:
             raise AssertionError(f"No target metrics specified for {art_out.name}")
 
-        # Based on volume to take, calculate corresponding amounts
-        if conc_units.lower() == "nm":
-            amt_taken_fmol = conc * vol_to_take
-            if size_bp is not None:
-                amt_taken_ng = formula.fmol_to_ng(amt_taken_fmol, size_bp)
-            else:
-                amt_taken_ng = None
-        elif conc_units.lower() == "ng/ul":
-            amt_taken_ng = conc * vol_to_take
-            if size_bp is not None:
-                amt_taken_fmol = formula.ng_to_fmol(amt_taken_ng, size_bp)
+        # Based on volume to take, calculate corresponding amounts, if the size is known
+        amt_taken = {}
+        for amt_unit in ["fmol", "ng"]:
+            if size_bp is not None or amt_unit == formula.amount_unit(conc_units):
+                amt_taken[amt_unit] = formula.convert(
+                    vol_to_take,
+                    "ul",
+                    amt_unit,
+                    bp=size_bp,
+                    conc=conc,
+                    conc_unit=conc_units,
+                )
             else:
-                amt_taken_fmol = None
+                amt_taken[amt_unit] = None
+        amt_taken_fmol, amt_taken_ng = amt_taken["fmol"], amt_taken["ng"]
 
         log.append(f"--> 'Volume to take (uL)': {vol_to_take:.2f}")
         if amt_taken_ng:
@@ -47,12 +47,7 @@ def main(lims, args):
             [i in ["ng/ul", "nM"] for i in df.conc_units]
         ), "Some of the pool inputs have invalid concentration units."
 
-        df["conc_nM"] = df.apply(
-            lambda x: x
-            if x["conc_units"] == "nM"
-            else formula.ng_ul_to_nM(x["conc"], x["size_bp"]),
-            axis=1,
-        )
+        df["conc_nM"] = formula.convert(df.conc, df.conc_units, "nM", bp=df.size_bp)
 
         for pool in pools:
             log.append(f"{pool.name}")
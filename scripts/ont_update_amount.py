@@ -68,7 +68,7 @@ def main(lims, args):
             if conc_units == "nM" and size_bp:
                 conc_nM = udf_tools.fetch(art_out, "Concentration")
                 log.append(f"'Concentration': {conc_nM}")
-                conc_ng_ul = formula.nM_to_ng_ul(nM=conc_nM, bp=size_bp)
+                conc_ng_ul = formula.convert(conc_nM, "nM", "ng/ul", bp=size_bp)
                 log.append(f"--> Concentration (ng/ul): {conc_ng_ul}")
             elif conc_units == "ng/ul":
                 conc_ng_ul = udf_tools.fetch(art_out, "Concentration")
@@ -82,20 +82,9 @@ def main(lims, args):
             log.append(f"--> 'Amount (ng)': {amount_ng}")
 
             # Calculate and put fmol amount
-            amount_fmol = round(
-                formula.ng_to_fmol(amount_ng, size_bp),
-                2,
-            )
+            amount_fmol = round(formula.convert(amount_ng, "ng", "fmol", bp=size_bp), 2)
             log.append(f"--> 'Amount (fmol)': {amount_fmol}")
-            udf_tools.put(
-                art_out,
-                "Amount (fmol)",
-                round(
-                    formula.ng_to_fmol(amount_ng, size_bp),
-                    2,
-                ),
-                on_fail=None,
-            )
+            udf_tools.put(art_out, "Amount (fmol)", amount_fmol, on_fail=None)
             log.append("\n")
 
         # Write log
@@ -8,8 +8,10 @@ import logging
 import os
 from argparse import ArgumentParser
 
+import psycopg2
+import yaml
 from genologics.config import BASEURI, PASSWORD, USERNAME
-from genologics.entities import Process
+from genologics.entities import Containertype, Process
 from genologics.lims import Lims
 
 from scilifelab_epps.epp import EppLogger, attach_file
@@ -25,6 +27,151 @@ SEQUENCING = {
     "2612": "NovaSeqXPlus Run v1.0",
 }
 
+# Max number of samples per artifact query
+QUERY_CHUNK_SIZE = 100
+
+# Inputs of the parent process outputs, per output id, filled by fetch_fastq_reads
+parent_inputs: dict[str, set] = {}
+
+# Aggregates the "(FASTQ reads)" artifacts of the given samples like sumreads does.
+# Per sample and flowcell:lane, only the most recent artifact with "# Reads" and
+# "Include reads" is kept, and the reads of those included are summed. The paired-end
+# correction is taken from the sequencing run of the oldest kept artifact. Lanes are
+# returned as row positions of the flowcell, to be labelled by its container type.
+READS_QUERY = """
+    with fastq as (
+        select distinct
+            s.name as sample_name, art.artifactid, pro.processid,
+            pro.daterun::date as daterun,
+            reads.udfvalue as reads, incl.udfvalue as include
+        from artifact art
+        inner join artifact_sample_map asm on asm.artifactid = art.artifactid
+        inner join sample s on s.processid = asm.processid
+        inner join outputmapping opm on opm.outputartifactid = art.artifactid
+        inner join processiotracker pit on pit.trackerid = opm.trackerid
+        inner join process pro on pro.processid = pit.processid
+        inner join processtype pt on pt.typeid = pro.typeid
+        inner join artifact_udf_view reads on reads.artifactid = art.artifactid
+            and reads.udfname = '# Reads' and reads.udfvalue is not null
+        inner join artifact_udf_view incl on incl.artifactid = art.artifactid
+            and incl.udfname = 'Include reads' and incl.udfvalue is not null
+        where s.name = any(%(samples)s)
+            and art.name = s.name || ' (FASTQ reads)'
+            and pt.displayname = any(%(demultiplex)s)
+    ),
+    lanes as (
+        select distinct
+            f.*, ct.name as flowcell, ct.typeid as containertypeid, cp.wellyposition as lane
+        from fastq f
+        inner join outputmapping opm on opm.outputartifactid = f.artifactid
+        inner join processiotracker pit on pit.trackerid = opm.trackerid
+        inner join artifact_sample_map asm on asm.artifactid = pit.inputartifactid
+        inner join sample s on s.processid = asm.processid and s.name = f.sample_name
+        inner join containerplacement cp on cp.processartifactid = pit.inputartifactid
+        inner join container ct on ct.containerid = cp.containerid
+    ),
+    kept as (
+        select distinct on (sample_name, flowcell, lane) *
+        from lanes
+        order by sample_name, flowcell, lane, daterun desc, artifactid
+    ),
+    totals as (
+        select sample_name, sum(reads::float8) as total
+        from kept
+        where include = 'YES'
+        group by sample_name
+    ),
+    base_input as (
+        select distinct on (b.sample_name) b.sample_name, pit.inputartifactid
+        from (
+            select distinct on (sample_name) sample_name, processid
+            from kept
+            where include = 'YES'
+            order by sample_name, daterun, artifactid desc
+        ) b
+        inner join processiotracker pit on pit.processid = b.processid
+        inner join artifact_sample_map asm on asm.artifactid = pit.inputartifactid
+        inner join sample s on s.processid = asm.processid and s.name = b.sample_name
+        order by b.sample_name, pit.inputartifactid
+    ),
+    base_seq as (
+        select distinct on (bi.sample_name)
+            bi.sample_name,
+            exists (
+                select 1 from process_udf_view puv
+                where puv.processid = seq.processid
+                    and puv.udfname = 'Read 2 Cycles' and puv.udfvalue is not null
+            ) as paired
+        from base_input bi
+        inner join processiotracker pit on pit.inputartifactid = bi.inputartifactid
+        inner join process seq on seq.processid = pit.processid
+        inner join processtype pt on pt.typeid = seq.typeid
+        where pt.displayname = any(%(sequencing)s)
+        order by bi.sample_name, seq.processid
+    ),
+    lane_sets as (
+        select
+            sample_name, flowcell, containertypeid, array_agg(distinct lane) as lanes,
+            max(daterun) as last_run,
+            (array_agg(artifactid order by daterun desc, artifactid))[1] as first_art
+        from lanes
+        group by sample_name, flowcell, containertypeid
+    )
+    select
+        ls.sample_name, ls.flowcell, ls.containertypeid, ls.lanes, t.total,
+        bi.inputartifactid is not null as has_input, bs.paired
+    from lane_sets ls
+    left join totals t on t.sample_name = ls.sample_name
+    left join base_input bi on bi.sample_name = ls.sample_name
+    left join base_seq bs on bs.sample_name = ls.sample_name
+    order by ls.sample_name, ls.last_run desc, ls.first_art;
+"""
+
+
+class RunCache:
+    """LIMS lookups shared by demnumber and sumreads during a run, with hit statistics"""
+
+    def __init__(self):
+        # Sample name --> "(FASTQ reads)" artifacts
+        self.fastq_reads = {}
+        # Input artifact id --> sequencing processes
+        self.seq_processes = {}
+        # Lookup --> [hits, misses]
+        self.stats = {"FASTQ reads": [0, 0], "sequencing process": [0, 0]}
+
+    def get_fastq_reads(self, sample_name):
+        """Returns the "(FASTQ reads)" artifacts of a sample, queried once per run"""
+        if sample_name in self.fastq_reads:
+            self.stats["FASTQ reads"][0] += 1
+        else:
+            self.stats["FASTQ reads"][1] += 1
+            self.fastq_reads[sample_name] = lims.get_artifacts(
+                sample_name=sample_name,
+                process_type=list(DEMULTIPLEX.values()),
+                name=f"{sample_name} (FASTQ reads)",
+            )
+        return self.fastq_reads[sample_name]
+
+    def get_seq_processes(self, inart):
+        """Returns the sequencing processes of an input artifact, queried once per run"""
+        if inart.id in self.seq_processes:
+            self.stats["sequencing process"][0] += 1
+        else:
+            self.stats["sequencing process"][1] += 1
+            self.seq_processes[inart.id] = lims.get_processes(
+                type=list(SEQUENCING.values()), inputartifactlimsid=inart.id
+            )
+        return self.seq_processes[inart.id]
+
+    def log_stats(self):
+        for lookup, (hits, misses) in self.stats.items():
+            logging.info(
+                f"Cached {lookup} lookups: {hits} hits, {misses} queries to LIMS"
+            )
+
+
+cache = RunCache()
+
 
 def main(lims, args, logger):
     """This should be run at project summary level"""
@@ -33,13 +180,26 @@ def main(lims, args, logger):
     errnb = 0
     summary = {}
     logart = None
-    for output_artifact in p.all_outputs():
+    outputs = p.all_outputs(resolve=True)
+    # Fetch the FASTQ reads of all samples up front
+    samples = [
+        o.samples[0] for o in outputs if o.type == "Analyte" and len(o.samples) == 1
+    ]
+    lims.get_batch(samples)
+    sql_reads = {}
+    if args.backend == "sql":
+        sql_reads = sumreads_sql(samples)
+    fetch_fastq_reads([sample for sample in samples if sample.name not in sql_reads])
+    for output_artifact in outputs:
         # filter to only keep solo sample demultiplexing output artifacts
         if output_artifact.type == "Analyte" and len(output_artifact.samples) == 1:
             sample = output_artifact.samples[0]
             samplenb += 1
             # update the total number of reads
-            total_reads = sumreads(sample, summary)
+            if sample.name in sql_reads:
+                total_reads, summary[sample.name] = sql_reads[sample.name]
+            else:
+                total_reads = sumreads(sample, summary)
             sample.udf["Total Reads (M)"] = total_reads
             output_artifact.udf["Set Total Reads"] = total_reads
             logging.info(
@@ -97,6 +257,7 @@ def main(lims, args, logger):
                 view.append("{}:{}".format(fc, "|".join(summary[sample][fc])))
                 totlanes += len(summary[sample][fc])
             f.write("{},{},{},{}\n".format(sample, totfc, totlanes, ";".join(view)))
+    cache.log_stats()
     try:
         attach_file(os.path.join(os.getcwd(), "AggregationLog.csv"), logart)
         logging.info(f"updated {samplenb} samples with {errnb} errors")
@@ -107,28 +268,58 @@ def main(lims, args, logger):
 
 def demnumber(sample):
     """Returns the number of distinct demultiplexing processes tagged with "Include reads" for a given sample"""
-    expectedName = f"{sample.name} (FASTQ reads)"
     dem = set()
-    arts = lims.get_artifacts(
-        sample_name=sample.name,
-        process_type=list(DEMULTIPLEX.values()),
-        name=expectedName,
-    )
+    arts = cache.get_fastq_reads(sample.name)
     for a in arts:
         if a.udf["Include reads"] == "YES":
             dem.add(a.parent_process.id)
     return len(dem)
 
 
+def fetch_fastq_reads(samples):
+    """Fills the run cache with the "(FASTQ reads)" artifacts of all samples
+
+    The artifacts are fetched with a query per chunk of samples instead of per sample. The
+    parent processes are loaded once each and their inputs in a single batch call.
+    """
+    names = sorted({sample.name for sample in samples})
+    arts_per_sample = {name: [] for name in names}
+    cache.fastq_reads.update(arts_per_sample)
+    for i in range(0, len(names), QUERY_CHUNK_SIZE):
+        chunk = names[i : i + QUERY_CHUNK_SIZE]
+        arts = lims.get_artifacts(
+            sample_name=chunk,
+            process_type=list(DEMULTIPLEX.values()),
+            name=[f"{name} (FASTQ reads)" for name in chunk],
+            resolve=True,
+        )
+        for art in arts:
+            arts_per_sample[art.name.removesuffix(" (FASTQ reads)")].append(art)
+
+    # Index the inputs of each output of the parent processes
+    inputs = {}
+    for parent in {
+        art.parent_process.uri: art.parent_process
+        for sample_arts in arts_per_sample.values()
+        for art in sample_arts
+    }.values():
+        for i in parent.input_output_maps:
+            parent_inputs.setdefault(i[1]["uri"].id, set()).add(i[0]["uri"])
+            inputs[i[0]["uri"].uri] = i[0]["uri"]
+    lims.get_batch(list(inputs.values()))
+    containers = {
+        art.location[0].uri: art.location[0]
+        for art in inputs.values()
+        if art.location[0]
+    }
+    lims.get_batch(list(containers.values()))
+
+
 def sumreads(sample, summary):
+    """Returns the total reads (M) of a sample and adds its flowcells and lanes to the summary"""
     if sample.name not in summary:
         summary[sample.name] = {}
-    expectedName = f"{sample.name} (FASTQ reads)"
-    arts = lims.get_artifacts(
-        sample_name=sample.name,
-        process_type=list(DEMULTIPLEX.values()),
-        name=expectedName,
-    )
+    arts = cache.get_fastq_reads(sample.name)
     tot = 0
     fclanel = []
     filteredarts = []
@@ -172,9 +363,7 @@ def sumreads(sample, summary):
         for inart in base_art.parent_process.all_inputs():
             if sample.name in [s.name for s in inart.samples]:
                 try:
-                    sq = lims.get_processes(
-                        type=list(SEQUENCING.values()), inputartifactlimsid=inart.id
-                    )[0]
+                    sq = cache.get_seq_processes(inart)[0]
                 except TypeError:
                     logging.error(
                         f"Did not manage to get sequencing process for artifact {inart.id}"
@@ -196,7 +385,80 @@ def sumreads(sample, summary):
     return tot
 
 
+def row_label(containertype_id, row):
+    """Returns the label of a container row, e.g. the lane of a flowcell, as it is shown in the
+    "<row>:<column>" placements of the API"""
+    y_dimension = Containertype(lims, id=str(containertype_id)).y_dimension
+    if y_dimension["is_alpha"]:
+        return chr(ord("A") + row + y_dimension["offset"])
+    return str(row + y_dimension["offset"])
+
+
+def sumreads_sql(samples):
+    """Returns the total reads (M) and the flowcell lanes of the given samples, per sample name,
+    aggregated with a single query to the LIMS database
+
+    Returns an empty dict if the database is unavailable. Samples whose sequencing process cannot
+    be found are left out, to be handled by sumreads.
+    """
+    names = sorted({sample.name for sample in samples})
+    try:
+        with open("/opt/gls/clarity/users/glsai/config/genosqlrc.yaml") as f:
+            config = yaml.safe_load(f)
+        connection = psycopg2.connect(
+            user=config["username"],
+            host=config["url"],
+            database=config["db"],
+            password=config["password"],
+        )
+        # The connection context manager only ends the transaction, so it is closed explicitly
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    READS_QUERY,
+                    {
+                        "samples": names,
+                        "demultiplex": list(DEMULTIPLEX.values()),
+                        "sequencing": list(SEQUENCING.values()),
+                    },
+                )
+                query_output = cursor.fetchall()
+        finally:
+            connection.close()
+    except (OSError, KeyError, yaml.YAMLError, psycopg2.Error) as e:
+        logging.warning(
+            f"Could not query the LIMS database, using the API instead: {e}"
+        )
+        return {}
+
+    fclanes = {name: {} for name in names}
+    totals = {}
+    unresolved = set()
+    for sample_name, flowcell, type_id, rows, total, has_input, paired in query_output:
+        fclanes[sample_name][flowcell] = {row_label(type_id, row) for row in rows}
+        if total is None:
+            continue
+        if has_input and paired is None:
+            # No sequencing process found for the input, leave the sample to sumreads
+            unresolved.add(sample_name)
+        else:
+            totals[sample_name] = total / 2 if paired else total
+
+    reads = {}
+    for name in names:
+        if name in unresolved:
+            continue
+        if name not in totals:
+            logging.info(f"No demultiplexing processes found for sample {name}")
+        # total is displayed as millions
+        reads[name] = (totals.get(name, 0.0) / 1000000, fclanes[name])
+    return reads
+
+
 def getParentInputs(art):
+    if art.id in parent_inputs:
+        return parent_inputs[art.id]
+
     inp = set()
     for i in art.parent_process.input_output_maps:
         if i[1]["uri"].id == art.id:
@@ -209,6 +471,12 @@ if __name__ == "__main__":
     parser = ArgumentParser(description=DESC)
     parser.add_argument("--pid", help="Lims id for current Process")
     parser.add_argument("--log", help="Log file for runtime info and errors.")
+    parser.add_argument(
+        "--backend",
+        choices=["rest", "sql"],
+        default="rest",
+        help="Aggregate the reads through the API or with a query to the LIMS database",
+    )
     args = parser.parse_args()
 
     lims = Lims(BASEURI, USERNAME, PASSWORD)
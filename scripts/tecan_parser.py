@@ -9,6 +9,8 @@ from genologics.config import BASEURI, PASSWORD, USERNAME
 from genologics.entities import Process
 from genologics.lims import Lims
 
+from scilifelab_epps.utils.well_geometry import PLATE_96
+
 DESC = """EPP used to parse csv files from the Tecan plate reader
 Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
 """
@@ -80,10 +82,8 @@ def convert(file_in, file_out):
 
 # Convert an index to a plate coordinate, e.g. 8 => H1
 def index_to_well(index):
-    i = int(index)
-    row = chr(64 + ((i - 1) % 8 + 1))
-    col = int(((i - 1) - (i - 1) % 8) / 8 + 1)
-    return f"{row}{col}"
+    assert 1 <= int(index) <= 96, f"Well index {index} is outside a 96-well plate"
+    return PLATE_96.well_names([int(index)], "col")[0].replace(":", "")
 
 
 def dictionarize(datalist):
@@ -30,9 +30,12 @@ Written by Maya Brandi
 """
 import csv
 import glob
+import json
 import logging
+import re
 import sys
 from argparse import ArgumentParser
+from itertools import repeat
 
 import numpy as np
 from genologics.config import BASEURI, PASSWORD, USERNAME
@@ -40,10 +43,22 @@ from genologics.entities import Process
 from genologics.lims import Lims
 from scilifelab_parsers.qc.qc import FlowcellRunMetricsParser
 
-from scilifelab_epps.epp import EppLogger, set_field
+from data.Chromium_10X_indexes import Chromium_10X_indexes
+from data.ONT_barcodes import ONT_BARCODES
+from scilifelab_epps.epp import EppLogger, put_in_batches, set_field
+from scilifelab_epps.utils.barcode_index import BarcodeIndex
 
 # from qc_parsers import FlowcellRunMetricsParser
 
+# Max number of un expected indexes to report and identify per lane
+TOP_UN_EXP_IND = 10
+
+SMARTSEQ3_indexes_json = (
+    "/opt/gls/clarity/users/glsai/repos/scilifelab_epps/data/SMARTSEQ3_indexes.json"
+)
+with open(SMARTSEQ3_indexes_json) as file:
+    SMARTSEQ3_indexes = json.loads(file.read())
+
 
 class RunQC:
     def __init__(self, process):
@@ -68,6 +83,7 @@ class RunQC:
         self.file_path = None
         self.dem_stat = None
         self.undem_stat = None
+        self.identified = {}
 
         ##  Other variables
         self.single = True
@@ -167,10 +183,24 @@ class RunQC:
         try:
             fp_und = self.file_path + "Undemultiplexed_stats.metrics"
             self.undem_stat = FRMP.parse_undemultiplexed_barcode_metrics(fp_und)
+            self._make_undem_arrays()
             logging.info(f"Parsed file {fp_und}")
         except:
             sys.exit("Failed to find or parse Undemultiplexed_stats.metrics")
 
+    def _make_undem_arrays(self):
+        """Holds the undemultiplexed barcodes of each lane as arrays, with the counts
+        as integers, rather than as lists."""
+        for lane_stat in self.undem_stat.values():
+            barcodes = lane_stat["undemultiplexed_barcodes"]
+            barcodes["count"] = np.fromiter(
+                (int(x) for x in barcodes["count"]),
+                dtype=np.int64,
+                count=len(barcodes["count"]),
+            )
+            for key in ["sequence", "index_name", "lane"]:
+                barcodes[key] = np.asarray(barcodes[key], dtype=object)
+
     def _get_threshold_Q30(self):
         if "Threshold for % bases >= Q30" in self.user_def_tresh:
             self.Q30_treshold = self.user_def_tresh["Threshold for % bases >= Q30"]
@@ -212,6 +242,7 @@ class RunQC:
             self.Q30_treshold = Q30_threshold
 
     def run_QC(self):
+        updated_files = []
         for pool in self.input_pools:
             outarts_per_lane = self.process.outputs_per_input(pool.id, ResultFile=True)
             lane_number = "1" if self.run_type == "MiSeq" else pool.location[1][0]
@@ -232,11 +263,16 @@ class RunQC:
             self.nr_lane_samps_tot += LQC.nr_lane_samps
             self.nr_lane_samps_updat += LQC.nr_samps_updat
             self.QC_fail += LQC.QC_fail
+            updated_files += LQC.updated_files
             if LQC.high_lane_yield:
                 self.high_lane_yield.append(LQC.lane)
             if LQC.high_index_yield:
                 self.high_index_yield.append(LQC.lane)
 
+        ## Upload the target files of all lanes, using batch calls
+        for art, e in put_in_batches(self.process.lims, updated_files):
+            logging.warning(f"Error while updating element {art.name}: {e}")
+
         ## moove this part to logging???-->>
         if self.high_index_yield or self.high_lane_yield:
             warn = "WARNING: "
@@ -255,6 +291,27 @@ class RunQC:
             warn = warn + "Please check the Metrics file!"
             self.abstract.insert(0, warn)
 
+    def identify_undetermined(self):
+        """Looks up the most abundant undetermined barcodes of each lane among the
+        known indexes, in a single pass over all lanes."""
+        barcode_index = build_barcode_index(self.dem_stat["Barcode_lane_statistics"])
+        for lane, lane_stat in self.undem_stat.items():
+            barcodes = lane_stat["undemultiplexed_barcodes"]
+            self.identified[lane] = {
+                i: barcode_index.identify(barcodes["sequence"][i])
+                for i in top_k(barcodes["count"], TOP_UN_EXP_IND)
+            }
+        nr_identified = sum(
+            bool(known)
+            for lane_identified in self.identified.values()
+            for known in lane_identified.values()
+        )
+        if nr_identified:
+            self.abstract.append(
+                f"INFO: {nr_identified} of the most abundant undetermined barcodes "
+                "match known indexes, see the Metrics file."
+            )
+
     def make_demultiplexed_counts_file(self, demuxfile):
         """Reformats the content of the demultiplex and undemultiplexed files
         to be more easy to read."""
@@ -268,34 +325,44 @@ class RunQC:
             "Index",
             "Index name",
             "% of >= Q30 Bases (PF)",
+            "Known index",
         ]
-        toCSV = []
-        for pool in self.input_pools:
-            if self.run_type == "MiSeq":
-                lane = "1"
-            else:
-                lane = pool.location[1][0]
-            for row in self.dem_stat["Barcode_lane_statistics"]:
-                if row["Lane"] == lane:
-                    row_dict = {x: row[x] for x in keys if x in row}
-                    row_dict["Index name"] = ""
-                    toCSV.append(row_dict)
-            if lane in list(self.undem_stat.keys()):
-                undet_per_lane = self.undem_stat[lane]["undemultiplexed_barcodes"]
-                nr_undet = len(undet_per_lane["count"])
-                for row in range(nr_undet):
-                    row_dict = {x: "" for x in keys}
-                    row_dict["# Reads"] = undet_per_lane["count"][row]
-                    row_dict["Index"] = undet_per_lane["sequence"][row]
-                    row_dict["Index name"] = undet_per_lane["index_name"][row]
-                    row_dict["Lane"] = undet_per_lane["lane"][row]
-                    toCSV.append(row_dict)
         try:
-            f = open(demuxfile, "w")
-            dict_writer = csv.DictWriter(f, keys, dialect="excel")
-            dict_writer.writer.writerow(keys)
-            dict_writer.writerows(toCSV)
-            f.close
+            with open(demuxfile, "w") as f:
+                writer = csv.writer(f, dialect="excel")
+                writer.writerow(keys)
+                for pool in self.input_pools:
+                    if self.run_type == "MiSeq":
+                        lane = "1"
+                    else:
+                        lane = pool.location[1][0]
+                    for row in self.dem_stat["Barcode_lane_statistics"]:
+                        if row["Lane"] == lane:
+                            writer.writerow(
+                                [
+                                    "" if x == "Index name" else row.get(x, "")
+                                    for x in keys
+                                ]
+                            )
+                    if lane in self.undem_stat:
+                        # Rows are streamed from the arrays of undemultiplexed barcodes
+                        undet_per_lane = self.undem_stat[lane][
+                            "undemultiplexed_barcodes"
+                        ]
+                        nr_undet = len(undet_per_lane["count"])
+                        identified = self.identified.get(lane, {})
+                        writer.writerows(
+                            zip(
+                                repeat("", nr_undet),
+                                repeat("", nr_undet),
+                                undet_per_lane["lane"],
+                                undet_per_lane["count"],
+                                undet_per_lane["sequence"],
+                                undet_per_lane["index_name"],
+                                repeat("", nr_undet),
+                                (identified.get(i, "") for i in range(nr_undet)),
+                            )
+                        )
             self.abstract.append(
                 "INFO: A Metrics file has been created with "
                 "demultiplexed and undemultiplexed counts for debugging."
@@ -344,6 +411,7 @@ class LaneQC:
 
         ##  Info from files in file system
         self.counts = undem_stat[lane_number]["undemultiplexed_barcodes"]["count"]
+        self.sequences = undem_stat[lane_number]["undemultiplexed_barcodes"]["sequence"]
         self.BLS = dem_stat["Barcode_lane_statistics"]
 
         ##  Tresholds
@@ -358,6 +426,7 @@ class LaneQC:
         self.high_lane_yield = False
         self.high_index_yield = False
         self.nr_samps_updat = 0
+        self.updated_files = []
         self.html_file_error = False
         self.QC_fail = []
 
@@ -477,22 +546,65 @@ class LaneQC:
                             IQC.lane_index_QC(self.reads_threshold, self.Q30_treshold)
                             if IQC.html_file_error:
                                 self.html_file_error = IQC.html_file_error
-                            set_field(IQC.t_file)
+                            self.updated_files.append(IQC.t_file)
                             self.nr_samps_updat += 1
                         except:
                             self.QC_fail.append(samp)
         self._check_un_exp_lane_yield()
-        for index_count in self.counts:
-            self._check_un_exp_ind_yield(index_count)
+        self._check_un_exp_ind_yield()
 
     def _check_un_exp_lane_yield(self):
-        unexp_lane_yield = sum([int(x) for x in self.counts])
+        unexp_lane_yield = self.counts.sum()
         if unexp_lane_yield > self.un_exp_lane:
             self.high_lane_yield = True
 
-    def _check_un_exp_ind_yield(self, index_count):
-        if int(index_count) > self.thres_un_exp_ind:
+    def _check_un_exp_ind_yield(self):
+        """Only the most abundant un expected indexes need to be checked against the
+        treshold. Those above it are written to the qc log file."""
+        top = top_k(self.counts, TOP_UN_EXP_IND)
+        high = top[self.counts[top] > self.thres_un_exp_ind]
+        if high.size:
             self.high_index_yield = True
+            for i in high:
+                qc_logg = (
+                    f"High yield of un expected index {self.sequences[i]} on lane "
+                    f"{self.lane}: {self.counts[i]}"
+                )
+                print(qc_logg, file=self.qc_log_file)
+
+
+def build_barcode_index(barcode_lane_statistics):
+    """Builds an identification index of the 10X, SmartSeq3 and ONT indexes and of the
+    indexes demultiplexed in this run. Indexes of other runs are not included."""
+    barcode_index = BarcodeIndex()
+    for name, seqs in Chromium_10X_indexes.items():
+        if len(seqs) == 2:
+            barcode_index.add(seqs[0], name, "10X", "i7")
+            barcode_index.add(seqs[1], name, "10X", "i5")
+        else:
+            for seq in seqs:
+                barcode_index.add(seq, name, "10X", "i7")
+    for name, (i7_seqs, i5_seqs) in SMARTSEQ3_indexes.items():
+        for seq in i7_seqs:
+            barcode_index.add(seq, name, "SmartSeq3", "i7")
+        for seq in i5_seqs:
+            barcode_index.add(seq, name, "SmartSeq3", "i5")
+    for barcode in ONT_BARCODES:
+        barcode_index.add(barcode["seq"], barcode["label"], "ONT", "i7")
+    for row in barcode_lane_statistics:
+        name = "{} lane {}".format(row.get("Sample ID"), row.get("Lane"))
+        for seq, read in zip(re.split(r"[+-]", row.get("Index", "")), ["i7", "i5"]):
+            barcode_index.add(seq, name, "this run", read)
+    return barcode_index
+
+
+def top_k(values, k):
+    """Returns the positions of the k largest values, largest first, by partial sorting."""
+    if len(values) > k:
+        top = np.argpartition(values, -k)[-k:]
+    else:
+        top = np.arange(len(values))
+    return top[np.argsort(values[top])[::-1]]
 
 
 class IndexQC:
@@ -533,11 +645,11 @@ class IndexQC:
             self.html_file_error = True
 
     def _set_Q30(self):
-        if "% Bases >=Q30" not in dict(list(self.t_file.udf.items())):
+        if "% Bases >=Q30" not in self.t_file.udf:
             self.t_file.udf["% Bases >=Q30"] = self.stats["% of >= Q30 Bases (PF)"]
 
     def _set_reads(self):
-        if "# Reads" not in dict(list(self.t_file.udf.items())):
+        if "# Reads" not in self.t_file.udf:
             try:
                 self.t_file.udf["# Reads"] = float(
                     self.stats["# Reads"].replace(",", "")
@@ -575,6 +687,7 @@ def main(lims, pid, epp_logger, demuxfile, qc_log_file):
     RQC.make_qc_log_file(qc_log_file)
     RQC.get_run_info()
     RQC.run_QC()
+    RQC.identify_undetermined()
     RQC.make_demultiplexed_counts_file(demuxfile)
     RQC.logging()
 